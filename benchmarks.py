@@ -0,0 +1,455 @@
+"""Micro-benchmarks for hot paths in bot.py.
+
+Usage: python benchmarks.py [name ...]
+
+Runs against the real module, so the usual environment (.env) must be
+present; placeholder values are filled in for anything missing so the
+benchmarks never touch the network or a real wallet.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.fernet import Fernet
+from solders.keypair import Keypair
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("SOLANA_RPC_URL", "http://127.0.0.1:8899")
+os.environ.setdefault("BOT_WALLET_PRIVATE_KEY", str(Keypair()))
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode())
+os.environ.setdefault("JUPITER_API", "http://127.0.0.1:1/quote")
+os.environ.setdefault("TOKEN_MINT", "So11111111111111111111111111111111111111112")
+
+import bot  # noqa: E402
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+BENCHMARKS = {}
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+def timeit(label, fn, n=100_000):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed / n * 1e6:8.2f} µs/op")
+
+
+def _per_click_table():
+    """The dispatch table as it used to be rebuilt inside handle_button_click."""
+    return {
+        "wallet": bot.wallet_info,
+        "deposit": bot.deposit_info,
+        "set_sell_target": bot.set_sell_target,
+        "set_buy_target": bot.set_buy_target,
+        "cancel_sell": bot.cancel_sell,
+        "transaction_history": bot.transaction_history,
+        "withdraw_sol": bot.withdraw_phantom,
+        "active_trades": bot.active_trades,
+        "help": bot.help_command,
+        "reset_wallet": bot.confirm_reset_wallet,
+        "cancel_reset": lambda q, c: q.message.reply_text("Wallet reset canceled."),
+        "view_solscan": bot.view_solscan,
+        "buy_now": bot.buy_now,
+        "sell_now": bot.sell_now,
+    }
+
+
+def _per_call_menu():
+    """The /start keyboard as it used to be rebuilt on every call."""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("💼 Wallet Info", callback_data="wallet"),
+         InlineKeyboardButton("💰 Deposit", callback_data="deposit")],
+        [InlineKeyboardButton("🎯 Set Sell Target", callback_data="set_sell_target"),
+         InlineKeyboardButton("📈 Set Buy Target", callback_data="set_buy_target")],
+        [InlineKeyboardButton("🚀 Buy Now", callback_data="buy_now"),
+         InlineKeyboardButton("📉 Sell Now", callback_data="sell_now")],
+        [InlineKeyboardButton("📜 Transaction History", callback_data="transaction_history"),
+         InlineKeyboardButton("🚫 Cancel Sell", callback_data="cancel_sell")],
+        [InlineKeyboardButton("🔍 Solscan", callback_data="view_solscan"),
+         InlineKeyboardButton("❓ Help", callback_data="help")]
+    ])
+
+
+class _Message:
+    async def reply_text(self, *args, **kwargs):
+        pass
+
+
+class _User:
+    id = 1
+
+
+class _Query:
+    def __init__(self, data):
+        self.data = data
+        self.from_user = _User()
+        self.message = _Message()
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+
+class _Update:
+    def __init__(self, data):
+        self.callback_query = _Query(data)
+        self.effective_message = self.callback_query.message
+
+
+@benchmark
+def dispatch():
+    """Per-click cost of resolving a callback to its handler."""
+    timeit("rebuild table + lookup", lambda: _per_click_table()["help"])
+    timeit("module registry lookup", lambda: bot.BUTTON_ACTIONS["help"])
+
+
+@benchmark
+def menu():
+    """Cost of producing the main menu keyboard."""
+    timeit("build InlineKeyboardMarkup", _per_call_menu, n=20_000)
+    timeit("shared MAIN_MENU", lambda: bot.MAIN_MENU, n=20_000)
+
+
+@benchmark
+def handle_click():
+    """End-to-end handle_button_click for the help button with I/O stubbed out."""
+    bot.load_wallets = lambda: None
+    update = _Update("help")
+
+    async def run(n=20_000):
+        start = time.perf_counter()
+        for _ in range(n):
+            await bot.handle_button_click(update, None)
+        elapsed = time.perf_counter() - start
+        print(f"{'handle_button_click(help)':<40} {elapsed / n * 1e6:8.2f} µs/op")
+
+    asyncio.run(run())
+
+
+def _scratch_journal(directory):
+    journal = bot.StateJournal(os.path.join(directory, "state.journal"), os.path.join(directory, "state.snapshot.json"))
+    return journal, journal.table("user_sell_targets"), journal.table("user_entry_prices")
+
+
+@benchmark
+def journal():
+    """Cost of one state mutation: journal append vs rewriting the whole state file."""
+    with tempfile.TemporaryDirectory() as directory:
+        state_journal, targets, _ = _scratch_journal(directory)
+        for i in range(100_000):
+            dict.__setitem__(targets, str(i), 2.0)
+
+        timeit("journaled set (batched fsync)", lambda: targets.__setitem__("1", 3.0))
+        state_journal.flush()
+
+        path = os.path.join(directory, "rewrite.json")
+
+        def rewrite():
+            with open(path, "w") as f:
+                json.dump(targets, f)
+
+        timeit("full rewrite of 100k entries", rewrite, n=20)
+
+
+@benchmark
+def recovery():
+    """Startup recovery time: snapshot load plus journal tail replay at the compaction bound."""
+    with tempfile.TemporaryDirectory() as directory:
+        state_journal, targets, entries = _scratch_journal(directory)
+        for i in range(100_000):
+            targets[str(i)] = 2.0
+            entries[str(i)] = 0.001
+        state_journal.snapshot()
+        for i in range(bot.JOURNAL_COMPACT_RECORDS):
+            targets[str(i % 1000)] = 3.0
+        state_journal.flush()
+
+        restored, _, _ = _scratch_journal(directory)
+        start = time.perf_counter()
+        replayed = restored.recover()
+        elapsed = time.perf_counter() - start
+        print(f"{'recover 200k keys + ' + str(replayed) + ' records':<40} {elapsed * 1e3:8.2f} ms")
+
+
+@benchmark
+def signals():
+    """Per-tick cost of indicator updates and signal order evaluation as the book grows."""
+    indicators = bot.RollingIndicators()
+    timeit("indicator update", lambda: indicators.update(100.0))
+
+    for size in (100, 10_000, 100_000):
+        book = bot.SignalOrderBook({})
+        for i in range(size):
+            book.place(str(i), "buy", 1.0, "rsi14", "<", "-1")  # Never fires, so the book stays full
+        timeit(f"evaluate {size} signal orders", lambda: book.on_tick(indicators), n=200)
+
+
+@benchmark
+def alerts():
+    """Per-tick cost of price alerts at 100k subscriptions: sorted trigger index vs scanning every alert."""
+    book = bot.PriceAlertBook({})
+    for i in range(100_000):  # Spread 1-50% either side of the current price of 1.0
+        distance = (1 + i % 500) / 1000
+        if i % 2:
+            book.place(str(i % 20_000), 1.0 + distance, bot.ALERT_ABOVE)
+        else:
+            book.place(str(i % 20_000), 1.0 - distance, bot.ALERT_BELOW)
+
+    timeit("sorted index, quiet tick", lambda: book.on_tick(1.0))
+    timeit("full scan, quiet tick",
+           lambda: [a for a in book.alerts.values()
+                    if ((a["price"] <= 1.0) if a["direction"] == "above" else (a["price"] >= 1.0))], n=20)
+
+    start = time.perf_counter()
+    fired = book.on_tick(1.2)  # A 20% move: every above-alert under 1.2 fires
+    elapsed = time.perf_counter() - start
+    print(f"{'tick firing ' + str(len(fired)) + ' alerts':<40} {elapsed * 1e3:8.2f} ms")
+
+
+@benchmark
+def bus():
+    """Event bus delivery rate per policy, and the trigger stage on its own (no execution behind it)."""
+    async def deliver(policy, n=100_000):
+        event_bus = bot.EventBus()
+
+        async def sink(event):
+            pass
+
+        event_bus.subscribe(bot.PriceTick, sink, policy=policy)
+        workers = []
+        event_bus.start(lambda coro: workers.append(asyncio.ensure_future(coro)))
+        tick = bot.PriceTick("mint", 1.0, 0.0)
+        start = time.perf_counter()
+        for _ in range(n):
+            await event_bus.publish(tick)
+        await event_bus.drain(60)
+        elapsed = time.perf_counter() - start
+        for worker in workers:
+            worker.cancel()
+        print(f"{'publish + deliver (' + policy + ')':<40} {elapsed / n * 1e6:8.2f} µs/op")
+
+    for policy in (bot.BLOCK, bot.DROP_OLDEST):
+        asyncio.run(deliver(policy))
+
+    bot.event_bus = bot.EventBus()  # No subscribers: time evaluate_triggers alone
+    bot.stop_orders = bot.StopOrderBook({})  # Unjournaled scratch book
+    for i in range(10_000):
+        dict.__setitem__(bot.user_sell_targets, str(i), 100.0)  # Bypass the journal; nothing fires
+        bot.stop_orders.place(str(i), bot.STOP_LOSS, 1.0, 1.0, stop_price=0.5)
+    tick = bot.PriceTick(bot.TOKEN_MINT, 1.0, 0.0)
+
+    async def evaluate(n=200):
+        start = time.perf_counter()
+        for _ in range(n):
+            await bot.evaluate_triggers(tick)
+        elapsed = time.perf_counter() - start
+        print(f"{'evaluate_triggers, 20k orders':<40} {elapsed / n * 1e6:8.2f} µs/op")
+
+    asyncio.run(evaluate())
+    dict.clear(bot.user_sell_targets)
+
+
+class _RpcStub(BaseHTTPRequestHandler):
+    """Local JSON-RPC node answering getSlot after `delay` seconds, or HTTP 503 while `failing`."""
+    delay = 0.0
+    failing = False
+    hits = 0
+
+    def do_POST(self):
+        type(self).hits += 1
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.delay)
+        if self.failing:
+            self.send_response(503)
+            self.end_headers()
+            return
+        body = json.dumps({"jsonrpc": "2.0", "result": 1234, "id": request["id"]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_rpc_stub(name, delay):
+    handler = type(name, (_RpcStub,), {"delay": delay})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, handler
+
+
+@benchmark
+def rpc_pool():
+    """RpcPool against three local stub nodes: latency ranking, failover, breaker open and recovery."""
+    stubs = [_start_rpc_stub(name, delay) for name, delay in (("fast", 0.005), ("medium", 0.02), ("slow", 0.06))]
+    urls = [f"http://127.0.0.1:{server.server_address[1]}" for server, _ in stubs]
+    handlers = dict(zip(urls, (handler for _, handler in stubs)))
+
+    def report(label, pool):
+        print(f"## {label}")
+        for endpoint in pool.ranked():
+            handler, snap = handlers[endpoint.url], endpoint.snapshot()
+            print(f"  {handler.__name__:<8} hits={handler.hits:<4} latency={snap['latency_ms']}ms "
+                  f"error_rate={snap['error_rate']} breaker={snap['state']}")
+            handler.hits = 0
+
+    async def run(calls=100):
+        random.seed(0)
+        pool = bot.RpcPool(urls, explore_rate=0.1)
+        for endpoint in pool.endpoints:  # Short breaker settings so the whole cycle fits in a second
+            endpoint.breaker.failure_threshold = 2
+            endpoint.breaker.reset_timeout = 0.5
+
+        async def burst():
+            start = time.perf_counter()
+            ok = 0
+            for _ in range(calls):
+                try:
+                    await pool.get_slot()
+                    ok += 1
+                except Exception:
+                    pass
+            return ok, (time.perf_counter() - start) / calls * 1e3
+
+        for endpoint in pool.endpoints:  # Measure every node first (the first call also pays the TCP connect)
+            for _ in range(5):
+                await pool._call_on(endpoint, "get_slot")
+        report("after measuring each node 5 times", pool)
+
+        ok, ms = await burst()
+        report(f"healthy: {ok}/{calls} ok, {ms:.1f} ms/call (reads go to the best-ranked node)", pool)
+
+        best = handlers[pool.ranked()[0].url]
+        best.failing = True
+        ok, ms = await burst()
+        report(f"{best.__name__} node returning 503: {ok}/{calls} ok, {ms:.1f} ms/call "
+               f"(failover, error-rate demotion, open breaker)", pool)
+
+        best.failing = False
+        await asyncio.sleep(0.6)  # Past the breaker cooldown: the next call is a half-open probe
+        ok, ms = await burst()
+        report(f"{best.__name__} node recovered: {ok}/{calls} ok, {ms:.1f} ms/call (probes close the breaker and win the rank back)", pool)
+        await pool.close()
+
+    asyncio.run(run())
+    for server, _ in stubs:
+        server.shutdown()
+
+
+@benchmark
+def versioned():
+    """Wire size and signing cost of a 30-account swap as a legacy vs a v0 transaction with a lookup table."""
+    from solders.address_lookup_table_account import AddressLookupTableAccount
+    from solders.hash import Hash
+    from solders.instruction import AccountMeta, Instruction
+    from solders.message import Message, MessageV0
+    from solders.pubkey import Pubkey
+
+    payer = Keypair()
+    accounts = [Pubkey.new_unique() for _ in range(30)]  # A multi-hop route touches this many
+    ix = Instruction(Pubkey.new_unique(), bytes(64), [AccountMeta(payer.pubkey(), True, True)] +
+                     [AccountMeta(a, False, True) for a in accounts])
+    blockhash = Hash.new_unique()
+    table = AddressLookupTableAccount(Pubkey.new_unique(), accounts)
+    legacy = Message.new_with_blockhash([ix], payer.pubkey(), blockhash)
+    v0 = MessageV0.try_compile(payer.pubkey(), [ix], [table], blockhash)
+
+    for label, message in (("legacy", legacy), ("v0 + lookup table", v0)):
+        size = len(bytes(bot.sign_swap_transaction(message, payer)))
+        print(f"{label + ' size':<40} {size:8d} bytes (limit 1232)")
+        timeit(f"sign {label}", lambda: bot.sign_swap_transaction(message, payer), n=5_000)
+
+
+@benchmark
+def api():
+    """Read API cost for a 100-user page: rendering from in-memory state vs serving the cached body."""
+    bot.ADMIN_API_TOKEN = "benchmark"
+    for i in range(10_000):
+        bot.user_wallets[str(i)] = bot.UserWallet(f"{i:044d}", "key", 0.5, 10.0)
+    scope = {"method": "GET", "path": "/api/users", "query_string": b"limit=100"}
+    headers = {"authorization": "Bearer benchmark"}
+
+    async def render(cached, n=2_000):
+        start = time.perf_counter()
+        for _ in range(n):
+            if not cached:
+                bot.read_api.cache.clear()
+            await bot.read_api.render(scope, headers)
+        elapsed = time.perf_counter() - start
+        print(f"{'GET /api/users ' + ('(cached)' if cached else '(rendered)'):<40} {elapsed / n * 1e6:8.2f} µs/op")
+
+    asyncio.run(render(False))
+    asyncio.run(render(True))
+    bot.user_wallets.clear()
+
+
+@benchmark
+def tracing():
+    """Per-call cost of a diagnostics span, as wired in (off unless DIAGNOSTICS_ENABLED) and forced on."""
+    def off():
+        with bot.span("rpc", "get_balance"):
+            pass
+
+    def on():
+        with bot._Span("rpc:get_balance"):
+            pass
+
+    timeit(f"span() (DIAGNOSTICS_ENABLED={bot.DIAGNOSTICS_ENABLED})", off)
+    timeit("_Span (recording)", on)
+
+
+def _traced_kib(build):
+    """Bytes retained by whatever build() returns, in KiB."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / 1024
+
+
+@benchmark
+def memory():
+    """Resident size of 100k user wallets: the layout change (dict -> slotted UserWallet) and the history tail bound, measured apart."""
+    users = 100_000
+    txids = [str(i) * 8 for i in range(50)]  # A long-lived user's history
+    tail = txids[-bot.WALLET_TX_TAIL:]
+    key = "gAAAAA" + "x" * 114  # Fernet-token-sized encrypted key
+
+    def as_dicts(history):
+        return lambda: {str(i): {"address": f"{i:044d}", "encrypted_key": key, "sol_balance": 0.5,
+                                 "token_balance": 10.0, "transactions": list(history)} for i in range(users)}
+
+    def as_slots(history):
+        return lambda: {str(i): bot.UserWallet(f"{i:044d}", key, 0.5, 10.0, tuple(history)) for i in range(users)}
+
+    # Same history length on both sides isolates the layout; the tail bound is reported on its own
+    dict_full, slots_full = _traced_kib(as_dicts(txids)), _traced_kib(as_slots(txids))
+    dict_tail, slots_tail = _traced_kib(as_dicts(tail)), _traced_kib(as_slots(tail))
+    print(f"{'history':<10} {'dict wallets':>14} {'UserWallet':>14} {'layout saving':>14}")
+    for label, dicts, slots in ((f"{len(txids)} txids", dict_full, slots_full), (f"{len(tail)} txids", dict_tail, slots_tail)):
+        print(f"{label:<10} {dicts / 1024:10.2f} MiB {slots / 1024:10.2f} MiB {1 - slots / dicts:14.0%}")
+    print(f"tail bound ({len(txids)} -> {len(tail)} txids): dict {1 - dict_tail / dict_full:.0%} less, "
+          f"UserWallet {1 - slots_tail / slots_full:.0%} less")
+    print(f"combined (dict, {len(txids)} txids -> UserWallet, {len(tail)} txids): {1 - slots_tail / dict_full:.0%} less")
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"# {name}: {BENCHMARKS[name].__doc__}")
+        BENCHMARKS[name]()
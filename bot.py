@@ -7,26 +7,60 @@ import sqlite3
 import httpx
 import base64
 import nest_asyncio
+import functools
+import random
+import shutil
+import signal
 import sys
+import threading
 import sqlite3
 import time
 import json
 import asyncio
-from collections import deque
+import csv
+import datetime
+import hashlib
+import hmac
+import io
+import re
+import urllib.parse
+import tempfile
+import heapq
+import bisect
+import itertools
+import math
+import contextlib
+import contextvars
+import inspect
+import traceback
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+
+import numpy as np
 
 
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden, RetryAfter
 from telegram.ext import Application, CommandHandler, CallbackContext, CallbackQueryHandler, ConversationHandler, MessageHandler, filters
 from solders.keypair import Keypair
 from solders.pubkey import Pubkey
-from solders.transaction import Transaction
+from solders.transaction import Transaction, VersionedTransaction
+from solders.message import Message, MessageV0
+from solders.instruction import AccountMeta, Instruction
+from solders.address_lookup_table_account import AddressLookupTable, AddressLookupTableAccount
+from solders.signature import Signature
+from solders.transaction_status import TransactionConfirmationStatus
 from solders.system_program import TransferParams, transfer
+from spl.token.constants import TOKEN_PROGRAM_ID
+from spl.token.instructions import create_idempotent_associated_token_account, get_associated_token_address, transfer_checked
+from spl.token.models import TransferCheckedParams
 from solana.rpc.async_api import AsyncClient
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from cryptography.fernet import Fernet
 from filelock import FileLock
 from waitress import serve  # ✅ Production server
+import uvicorn
 
 # ✅ Apply async patch for nested loops
 nest_asyncio.apply()
@@ -56,9 +90,19 @@ BOT_WALLET_PRIVATE_KEY = os.getenv("BOT_WALLET_PRIVATE_KEY")
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
 JUPITER_API = os.getenv("JUPITER_API")
 TOKEN_MINT = os.getenv("TOKEN_MINT")
+SOLANA_RPC_URLS = [url.strip() for url in os.getenv("SOLANA_RPC_URLS", SOLANA_RPC_URL).split(",") if url.strip()]
+RPC_BROADCAST_FANOUT = int(os.getenv("RPC_BROADCAST_FANOUT", 3))  # Nodes each sendTransaction goes to
+RPC_EXPLORE_RATE = float(os.getenv("RPC_EXPLORE_RATE", 0.05))  # Share of reads sent to a lower-ranked node to refresh its score
+BOT_LOOKUP_TABLES = [a.strip() for a in os.getenv("BOT_LOOKUP_TABLES", "").split(",") if a.strip()]  # Bot-owned ALTs for packed transfers
+ALT_CACHE_TTL = float(os.getenv("ALT_CACHE_TTL", 3600))  # Seconds before a lookup table's contents are refetched
 TOKEN_DECIMALS = int(os.getenv("TOKEN_DECIMALS", 6))
 ADMIN_WALLET = os.getenv("ADMIN_WALLET_ADDRESS")
 DEX_PROGRAM_ID = os.getenv("DEX_PROGRAM_ID")  # ✅ Fixed!
+SOL_MINT = "So11111111111111111111111111111111111111112"
+TOKEN_MINT_PUBKEY = Pubkey.from_string(TOKEN_MINT)
+ADMIN_USER_IDS = {uid.strip() for uid in os.getenv("ADMIN_USER_IDS", "").split(",") if uid.strip()}
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")  # Bearer token for admin HTTP routes; routes are disabled when unset
+DIAGNOSTICS_ENABLED = os.getenv("DIAGNOSTICS_ENABLED", "").lower() in ("1", "true", "yes")  # Off: spans compile away
 
 # ✅ Secure encryption setup
 if not ENCRYPTION_KEY:
@@ -74,23 +118,320 @@ except Exception as e:
 
 # ✅ Wallet storage files
 WALLETS_FILE = "user_wallets.json"
+WALLET_JOURNAL_FILE = "user_wallets.journal"  # Encrypted per-wallet records appended between full saves
+WALLET_JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024
 lock = FileLock(WALLETS_FILE + ".lock")
+_wallets_stamp = None
+
+# ✅ State journal settings
+STATE_JOURNAL_FILE = "bot_state.journal"
+STATE_SNAPSHOT_FILE = "bot_state.snapshot.json"
+JOURNAL_FLUSH_INTERVAL = 0.1      # Seconds between batched write + fsync of pending records
+JOURNAL_BATCH_RECORDS = 512       # Flush early once this many records are pending
+JOURNAL_COMPACT_RECORDS = 50_000  # Snapshot and truncate once the journal tail is this long (bounds replay time)
+
+
+class StateJournal:
+    """Append-only journal of mutations to the registered state dicts, plus compacted snapshots.
+
+    Every mutation is one JSON line with a sequence number. Lines are buffered and written
+    with a single fsync per flush interval. A snapshot stores every table with the last
+    sequence number it covers; recovery loads it and replays only the journal records
+    after that sequence, so replay is bounded by JOURNAL_COMPACT_RECORDS.
+    """
+    def __init__(self, journal_file=STATE_JOURNAL_FILE, snapshot_file=STATE_SNAPSHOT_FILE):
+        self.journal_file = journal_file
+        self.snapshot_file = snapshot_file
+        self.tables = {}
+        self.seq = 0
+        self.tail = 0  # Records in the journal since the last snapshot
+        self.pending = []
+        self.handle = None
+        self.stats = {"records": 0, "flushes": 0, "snapshots": 0}
+
+    def table(self, name: str) -> "JournaledDict":
+        self.tables[name] = JournaledDict(name, self)
+        return self.tables[name]
+
+    def record(self, name, op, key=None, value=None):
+        self.seq += 1
+        self.tail += 1
+        self.stats["records"] += 1
+        self.pending.append(json.dumps({"s": self.seq, "t": name, "o": op, "k": key, "v": value}))
+        if len(self.pending) >= JOURNAL_BATCH_RECORDS:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if self.handle is None:
+            self.handle = open(self.journal_file, "a", encoding="utf-8")
+        self.handle.write("\n".join(self.pending) + "\n")
+        self.pending.clear()
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.stats["flushes"] += 1
+
+    def _rotate(self) -> dict:
+        """Move the current journal aside and capture the state it leads up to (loop thread, cheap)."""
+        self.flush()
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+        rotated = self.journal_file + ".1"
+        if os.path.exists(self.journal_file):
+            if os.path.exists(rotated):  # A previous snapshot never completed: keep both tails
+                with open(rotated, "a", encoding="utf-8") as dst, open(self.journal_file, encoding="utf-8") as src:
+                    shutil.copyfileobj(src, dst)
+                os.remove(self.journal_file)
+            else:
+                os.replace(self.journal_file, rotated)
+        self.tail = 0
+        return {"seq": self.seq, "tables": {name: dict(table) for name, table in self.tables.items()}}
+
+    def _write_snapshot(self, state: dict):
+        """Write a snapshot atomically, then drop the rotated journal it supersedes."""
+        state["saved_at"] = time.time()
+        temp_file = self.snapshot_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.snapshot_file)
+        rotated = self.journal_file + ".1"
+        if os.path.exists(rotated):
+            os.remove(rotated)
+        self.stats["snapshots"] += 1
+
+    def snapshot(self):
+        self._write_snapshot(self._rotate())
+
+    async def compact(self):
+        """Snapshot without blocking the loop; mutations keep appending to a fresh journal meanwhile."""
+        await asyncio.to_thread(self._write_snapshot, self._rotate())
+
+    def recover(self) -> int:
+        """Load the snapshot, replay the journal tail and compact; returns records replayed."""
+        self.seq = 0
+        for table in self.tables.values():
+            dict.clear(table)
+
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, encoding="utf-8") as f:
+                state = json.load(f)
+            self.seq = state["seq"]
+            for name, data in state["tables"].items():
+                if name in self.tables:
+                    dict.update(self.tables[name], data)
+
+        replayed = 0
+        for path in (self.journal_file + ".1", self.journal_file):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        logging.warning("⚠️ Ignoring torn record at the end of the state journal")
+                        break
+                    if entry["s"] <= self.seq:
+                        continue
+                    self.seq = entry["s"]
+                    replayed += 1
+                    table = self.tables.get(entry["t"])
+                    if table is None:
+                        continue
+                    if entry["o"] == "set":
+                        dict.__setitem__(table, entry["k"], entry["v"])
+                    elif entry["o"] == "del":
+                        dict.pop(table, entry["k"], None)
+                    elif entry["o"] == "clear":
+                        dict.clear(table)
+
+        # Start from a clean journal so new records never follow a torn line
+        self.snapshot()
+        return replayed
+
+    async def run(self):
+        """Group-commit pending records and compact once the tail grows past its bound."""
+        while True:
+            await asyncio.sleep(JOURNAL_FLUSH_INTERVAL)
+            try:
+                if self.tail >= JOURNAL_COMPACT_RECORDS:
+                    await self.compact()
+                else:
+                    self.flush()
+            except OSError as e:
+                logging.error(f"🚨 State journal write failed: {str(e)}")
+
+    def close(self):
+        """Final compaction on shutdown: the next start loads one snapshot and replays nothing."""
+        self.snapshot()
+
+
+class JournaledDict(dict):
+    """A dict whose mutations are appended to the state journal (values must be JSON-serializable)."""
+    def __init__(self, name: str, journal: StateJournal):
+        super().__init__()
+        self.name = name
+        self.journal = journal
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.journal.record(self.name, "set", key, value)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.journal.record(self.name, "del", key)
+
+    def pop(self, key, *default):
+        if key in self:
+            self.journal.record(self.name, "del", key)
+        return super().pop(key, *default)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self.journal.record(self.name, "del", key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        super().clear()
+        self.journal.record(self.name, "clear")
+
+
+state_journal = StateJournal()
+
+WALLET_TX_TAIL = 20  # Recent transaction ids kept per wallet; the full history lives in SQLite
+
+
+def user_key(user_id) -> str:
+    """Canonical key for every per-user map: the Telegram id as a string (JSON keys are strings)."""
+    return str(user_id)
+
+
+@dataclass(slots=True)
+class UserWallet:
+    """One user's custodial wallet. Slotted, so 100k users don't each carry a __dict__."""
+    address: str
+    encrypted_key: str
+    sol_balance: float = 0.0
+    token_balance: float = 0.0
+    transactions: tuple = ()  # Most recent WALLET_TX_TAIL txids, oldest first
+
+    @classmethod
+    def from_record(cls, record: dict) -> "UserWallet":
+        """Build from a persisted record; raises KeyError if address or key is missing."""
+        return cls(
+            record["address"],
+            record["encrypted_key"],
+            float(record.get("sol_balance", 0.0)),
+            float(record.get("token_balance", 0.0)),
+            tuple(record.get("transactions", ()))[-WALLET_TX_TAIL:],
+        )
+
+    def record_transaction(self, txid: str):
+        self.transactions = (self.transactions + (txid,))[-WALLET_TX_TAIL:]
+
+    def to_record(self) -> dict:
+        return {
+            "address": self.address,
+            "encrypted_key": self.encrypted_key,
+            "sol_balance": self.sol_balance,
+            "token_balance": self.token_balance,
+            "transactions": list(self.transactions),
+        }
+
 
-# ✅ Initialize Solana client
-solana_client = AsyncClient(SOLANA_RPC_URL)
-
-# ✅ User state tracking
-user_wallets = {}
-user_sell_targets = {}
-user_sell_amounts = {}
-user_entry_prices = {}
-user_last_withdrawal = {}
-user_active_trades = {}
-user_buy_targets = {}
+# ✅ User state tracking, every map keyed by user_key()
+user_wallets = {}  # user_key -> UserWallet
+user_sell_targets = state_journal.table("user_sell_targets")
+user_sell_amounts = state_journal.table("user_sell_amounts")
+user_entry_prices = state_journal.table("user_entry_prices")
+user_last_withdrawal = state_journal.table("user_last_withdrawal")
+user_active_trades = state_journal.table("user_active_trades")
+user_buy_targets = state_journal.table("user_buy_targets")
 BUY_TARGET_INPUT = range(1)
 # ✅ Define conversation state for input handling
 TARGET_INPUT = range(1)
 
+# ✅ Static responses, built once at import instead of on every command or click
+MAIN_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💼 Wallet Info", callback_data="wallet"),
+     InlineKeyboardButton("💰 Deposit", callback_data="deposit")],
+    [InlineKeyboardButton("🎯 Set Sell Target", callback_data="set_sell_target"),
+     InlineKeyboardButton("📈 Set Buy Target", callback_data="set_buy_target")],
+    [InlineKeyboardButton("🚀 Buy Now", callback_data="buy_now"),
+     InlineKeyboardButton("📉 Sell Now", callback_data="sell_now")],
+    [InlineKeyboardButton("📜 Transaction History", callback_data="transaction_history"),
+     InlineKeyboardButton("🚫 Cancel Sell", callback_data="cancel_sell")],
+    [InlineKeyboardButton("🔍 Solscan", callback_data="view_solscan"),
+     InlineKeyboardButton("❓ Help", callback_data="help")]
+])
+
+HELP_TEXT = "\n".join([
+    "\U0001F4AC **Help Menu:**\n",
+    "/start - Initialize wallet",
+    "/set_target <multiplier> - Set sell target",
+    "/stop_loss <price> [amount] - Sell if the price falls to a level",
+    "/trailing_stop <percent> [amount] - Sell on a drop from the running high",
+    "/cancel_stop - Cancel your stop order",
+    "/signal <buy|sell> <amount> <indicator> <op> <value> - Order on SMA/EMA/RSI conditions",
+    "/signals - Your signal orders and current indicators",
+    "/signal_cancel <id> - Cancel a signal order",
+    "/alert <price> [above|below] - Notify me when the price gets there (no trade)",
+    "/alerts - Your price alerts",
+    "/alert_cancel <id> - Remove a price alert",
+    "/portfolio - Position and PnL",
+    "/price - Latest price",
+    "/chart [1s|1m|5m|1h] - Recent price chart",
+    "/active_trades - View active trades",
+    "/export [csv|json] [from] [to] - Download your full trade history",
+    "/dca <sol_amount> <interval e.g. 4h> [runs] - Recurring buy",
+    "/dca_list - Your recurring buys",
+    "/dca_cancel <id> - Stop a recurring buy",
+    "/withdraw <amount> <recipient_address> - Withdraw SOL",
+    "Use the buttons to navigate.",
+])
+
+DEPOSIT_TEXT = (
+    "💰 **Deposit SOL**\n\n"
+    "Click the button below to buy SOL and deposit directly into your wallet."
+)
+
+# Wallet message templates: only the per-user fields are filled in with str.format
+WELCOME_BACK_TEMPLATE = (
+    "👋 **Welcome back!**\n"
+    "📌 **Your Permanent Wallet Address:** `{address}`\n"
+    "💰 **SOL Balance:** {sol_balance:.4f} SOL\n"
+    "🎯 **Token Balance:** {token_balance:.2f} Tokens\n\n"
+    "🔒 **Your wallet is permanently stored and cannot be replaced.**"
+)
+WALLET_CREATED_TEMPLATE = (
+    "✅ **Wallet Created**\n"
+    "📌 **Your Address:** `{address}`\n"
+    "🔐 **Your private key is encrypted & stored securely.**\n\n"
+    "⚠️ **This wallet is PERMANENT and cannot be changed.**"
+)
+WALLET_RACE_TEMPLATE = (
+    "⚠️ **Wallet creation interrupted, but your wallet is safe!**\n"
+    "📌 **Your Permanent Address:** `{address}`"
+)
+WALLET_INFO_TEMPLATE = (
+    "💰 **Wallet Info:**\n\n"
+    "📌 **Address:** {address}\n"
+    "🔹 **SOL Balance:** {balance:.4f} SOL"
+)
+
 # ✅ Configure logging securely
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -103,6 +444,157 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# ✅ Diagnostics settings (only used when DIAGNOSTICS_ENABLED)
+DIAG_LAG_INTERVAL = float(os.getenv("DIAG_LAG_INTERVAL", 0.25))  # Seconds between loop heartbeats
+DIAG_STALL_SECONDS = float(os.getenv("DIAG_STALL_SECONDS", 0.2))  # Loop blocked this long counts as a stall
+DIAG_SLOW_SPAN_SECONDS = float(os.getenv("DIAG_SLOW_SPAN_SECONDS", 1.0))  # Spans at least this slow are kept
+DIAG_HISTORY = 100  # Stalls and slow spans kept for the endpoint
+DIAG_PROFILE_MAX_SECONDS = 30
+
+_trace_chain = contextvars.ContextVar("trace_chain", default=())
+
+
+class Diagnostics:
+    """Opt-in event-loop lag monitor, stall catcher, span timings and sampling profiler.
+
+    A loop task stamps a heartbeat every DIAG_LAG_INTERVAL; its oversleep is the loop lag.
+    A watchdog thread notices when the heartbeat goes stale and grabs the loop thread's
+    stack at that moment, which names whatever synchronous call (requests, FileLock,
+    Fernet, SQLite) is holding the loop. The profiler samples the same stack on demand.
+    """
+    def __init__(self):
+        self.loop_thread_id = None
+        self.heartbeat = time.monotonic()
+        self.lag = {"last_ms": 0.0, "max_ms": 0.0, "samples": 0, "stalls": 0}
+        self.spans = {}  # chain -> [count, total seconds, max seconds]
+        self.span_lock = threading.Lock()  # Spans also close in to_thread workers and are read by Flask
+        self.slow_spans = deque(maxlen=DIAG_HISTORY)
+        self.stalls = deque(maxlen=DIAG_HISTORY)
+        self.profiling = threading.Lock()
+
+    def record_span(self, chain: tuple, elapsed: float):
+        key = ">".join(chain)
+        with self.span_lock:
+            entry = self.spans.get(key)
+            if entry is None:
+                entry = self.spans[key] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+            if elapsed >= DIAG_SLOW_SPAN_SECONDS:
+                self.slow_spans.append({"chain": key, "ms": round(elapsed * 1000, 1), "at": time.time()})
+
+    async def run(self):
+        """Heartbeat task; also starts the watchdog thread on first run."""
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()  # Fresh stamp, or startup time would read as a stall
+        threading.Thread(target=self._watchdog, name="diagnostics-watchdog", daemon=True).start()
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(DIAG_LAG_INTERVAL)
+            self.heartbeat = time.monotonic()
+            lag_ms = max(0.0, self.heartbeat - before - DIAG_LAG_INTERVAL) * 1000
+            self.lag["last_ms"] = round(lag_ms, 1)
+            self.lag["max_ms"] = max(self.lag["max_ms"], round(lag_ms, 1))
+            self.lag["samples"] += 1
+
+    def _watchdog(self):
+        stall = None
+        while True:
+            time.sleep(DIAG_LAG_INTERVAL / 2)
+            blocked = time.monotonic() - self.heartbeat - DIAG_LAG_INTERVAL
+            if blocked < DIAG_STALL_SECONDS:
+                stall = None
+                continue
+            if stall is None:  # One stack per stall, taken while the loop is still stuck
+                frame = sys._current_frames().get(self.loop_thread_id)
+                stall = {"at": time.time(), "stack": traceback.format_stack(frame, limit=20) if frame else []}
+                self.stalls.append(stall)
+                self.lag["stalls"] += 1
+            stall["blocked_ms"] = round(blocked * 1000, 1)
+
+    def profile(self, seconds: float, hz: int) -> dict:
+        """Sample the loop thread's stack for `seconds`; returns collapsed stacks -> sample count."""
+        if not self.profiling.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            counts = {}
+            interval = 1.0 / hz
+            deadline = time.monotonic() + min(seconds, DIAG_PROFILE_MAX_SECONDS)
+            while time.monotonic() < deadline:
+                frame = sys._current_frames().get(self.loop_thread_id)
+                if frame is not None:
+                    stack = ";".join(f"{os.path.basename(f.f_code.co_filename)}:{f.f_code.co_name}:{line}"
+                                     for f, line in reversed(list(traceback.walk_stack(frame))))
+                    counts[stack] = counts.get(stack, 0) + 1
+                time.sleep(interval)
+            return counts
+        finally:
+            self.profiling.release()
+
+    def snapshot(self) -> dict:
+        with self.span_lock:
+            spans = sorted(((chain, tuple(entry)) for chain, entry in self.spans.items()),
+                           key=lambda item: item[1][1], reverse=True)
+            slow_spans = list(self.slow_spans)
+        return {
+            "loop_lag": self.lag,
+            "spans": [{"chain": chain, "count": count, "total_ms": round(total * 1000, 1),
+                       "avg_ms": round(total / count * 1000, 2), "max_ms": round(worst * 1000, 1)}
+                      for chain, (count, total, worst) in spans],
+            "slow_spans": slow_spans,
+            "stalls": list(self.stalls),
+        }
+
+
+diagnostics = Diagnostics()
+
+
+class _Span:
+    """Times one step and nests it under the caller's chain (contextvars follow tasks across awaits)."""
+    __slots__ = ("name", "token", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.token = _trace_chain.set(_trace_chain.get() + (self.name,))
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        diagnostics.record_span(_trace_chain.get(), time.perf_counter() - self.start)
+        _trace_chain.reset(self.token)
+
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+def span(*parts):
+    """`with span("rpc", method):` times a block; a shared no-op when diagnostics are off."""
+    if not DIAGNOSTICS_ENABLED:
+        return _NO_SPAN
+    return _Span(":".join(parts))
+
+
+def traced(fn):
+    """Time every call of `fn` (sync or async) as a span; returns `fn` itself when diagnostics are off."""
+    if not DIAGNOSTICS_ENABLED:
+        return fn
+    name = fn.__qualname__
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            with _Span(name):
+                return await fn(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _Span(name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 
@@ -111,6 +603,94 @@ def keep_alive():
     """Prevent hosting platform from sleeping the bot"""
     return "Bot is running", 200
 
+
+def require_api_token(view):
+    """Reject requests that don't carry the admin bearer token."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not ADMIN_API_TOKEN or not hmac.compare_digest(supplied, ADMIN_API_TOKEN):
+            return jsonify({"error": "unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@app.route("/metrics", methods=["GET"])
+@require_api_token
+def metrics():
+    """Resilience and pipeline counters for dashboards and alerting."""
+    return jsonify({
+        "breakers": {name: breaker.snapshot() for name, breaker in list(breakers.items())},
+        "retry_budget": retry_budget.snapshot(),
+        "rpc_endpoints": solana_client.snapshot(),
+        "swap_aggregator": swap_aggregator.stats,
+        "messenger": {**messenger.stats, "backlog": messenger.backlog()},
+        "event_bus": event_bus.snapshot(),
+        "in_flight_executions": len(lifecycle.in_flight),
+        "user_actions": inflight.stats,
+        "dca": {**dca_scheduler.stats, "active": len(dca_scheduler.orders)},
+        "price_alerts": len(price_alerts),
+        "pending_confirmations": len(lifecycle.pending_confirmations),
+        "preflight": simulation_cache.stats,
+        "lookup_tables": {**lookup_tables.stats, "cached": len(lookup_tables.tables)},
+        "deposits": {**deposit_scanner.stats, "active_users": len(deposit_scanner.active)},
+        "token_accounts": {**token_accounts.stats, "known": len(token_accounts.known), "queued": len(token_accounts.queued)},
+        "wallet_pool": {**wallet_pool.stats, "reserve": len(wallet_pool.reserve)},
+        "read_api": read_api.stats,
+        "state_journal": {**state_journal.stats, "tail": state_journal.tail},
+        "loop_lag": diagnostics.lag if DIAGNOSTICS_ENABLED else None
+    }), 200
+
+
+@app.route("/diagnostics", methods=["GET"])
+@require_api_token
+def diagnostics_report():
+    """Loop lag, recent stalls with the blocking stack, and span timings per call chain."""
+    if not DIAGNOSTICS_ENABLED:
+        return jsonify({"error": "diagnostics are disabled (set DIAGNOSTICS_ENABLED=1)"}), 404
+    return jsonify(diagnostics.snapshot()), 200
+
+
+@app.route("/diagnostics/profile", methods=["GET"])
+@require_api_token
+def diagnostics_profile():
+    """Sample the event-loop thread (?seconds=5&hz=100) and return collapsed stacks for flamegraph tools."""
+    if not DIAGNOSTICS_ENABLED:
+        return jsonify({"error": "diagnostics are disabled (set DIAGNOSTICS_ENABLED=1)"}), 404
+    if diagnostics.loop_thread_id is None:
+        return jsonify({"error": "event loop not running yet"}), 409
+    try:
+        seconds = float(request.args.get("seconds", 5))
+        hz = min(max(int(request.args.get("hz", 100)), 1), 1000)
+    except ValueError:
+        return jsonify({"error": "seconds and hz must be numbers"}), 400
+    try:
+        counts = diagnostics.profile(seconds, hz)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    body = "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items(), key=lambda item: -item[1]))
+    return Response(body, mimetype="text/plain")
+
+
+@app.route("/export/<user_id>", methods=["GET"])
+@require_api_token
+def export_fills(user_id):
+    """Stream a user's fill ledger as CSV or JSON (?format=csv|json&from=YYYY-MM-DD&to=YYYY-MM-DD)."""
+    fmt = request.args.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        start, end = parse_export_range(request.args.get("from"), request.args.get("to"))
+    except ValueError:
+        return jsonify({"error": "dates must be YYYY-MM-DD"}), 400
+
+    chunks = export_chunks(iter_fills(user_id, start, end), fmt)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename=fills-{user_id}.{fmt}"}
+    )
+
 # @app.route("/phantom_webhook", methods=["POST"])
 # def phantom_webhook():
 #     """Essential for receiving transaction notifications"""
@@ -157,6 +737,1152 @@ class RateLimiter:
 
 rate_limiter = RateLimiter(max_calls=5, period=60)
 
+
+# ✅ Resilience settings
+HEDGE_AFTER_SECONDS = float(os.getenv("HEDGE_AFTER_SECONDS", 0.75))  # Launch a second read if the first is slow
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", 30))
+
+
+class CircuitOpenError(Exception):
+    """Raised when an endpoint's breaker is open and the call is rejected without being attempted."""
+
+
+class TransactionFailedError(Exception):
+    """The transaction failed on-chain or expired without landing: none of its effects happened."""
+
+
+class TxOutcomeUnknown(Exception):
+    """The transaction was sent but whether it landed could not be determined."""
+    def __init__(self, txid: str):
+        super().__init__(f"Outcome of {txid} is unknown")
+        self.txid = txid
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, then lets a single probe through once the cooldown passes."""
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "retries": 0, "hedges": 0}
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self.probing = False
+        if self.state == "closed" or (self.state == "half_open" and not self.probing):
+            self.probing = self.state == "half_open"
+            return True
+        self.stats["rejected"] += 1
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.stats["failures"] += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"⚠️ Circuit breaker '{self.name}' opened after {self.failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, **self.stats}
+
+
+class RetryBudget:
+    """Global retry allowance: each request earns a fraction of a retry, plus a small steady trickle."""
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_tokens=20):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated = time.monotonic()
+        self.exhausted = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self.updated) * self.min_per_second)
+        self.updated = now
+
+    def on_request(self):
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.exhausted += 1
+        return False
+
+    def snapshot(self) -> dict:
+        self._refill()
+        return {"tokens": round(self.tokens, 2), "exhausted": self.exhausted}
+
+
+breakers = {}
+retry_budget = RetryBudget()
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    if endpoint not in breakers:
+        breakers[endpoint] = CircuitBreaker(endpoint)
+    return breakers[endpoint]
+
+
+def backoff_delay(attempt: int, base: float = 0.25, cap: float = 8.0) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Client errors (other than 429) will fail the same way again."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return not isinstance(error, (ValueError, KeyError, CircuitOpenError))
+
+
+async def _hedged(fn, args, kwargs, breaker, hedge_after):
+    """Start a second identical read if the first has not answered within `hedge_after`."""
+    first = asyncio.ensure_future(fn(*args, **kwargs))
+    done, _ = await asyncio.wait({first}, timeout=hedge_after)
+    if done:
+        return first.result()
+
+    breaker.stats["hedges"] += 1
+    pending = {first, asyncio.ensure_future(fn(*args, **kwargs))}
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                for other in pending:
+                    other.cancel()
+                return task.result()
+            error = task.exception()
+    raise error
+
+
+async def resilient_call(endpoint: str, fn, *args, attempts: int = 3, idempotent: bool = False,
+                         retry_on=is_retryable, **kwargs):
+    """Call `fn` behind the endpoint's circuit breaker with jittered, budgeted retries.
+
+    Idempotent reads are also hedged. Writes are only retried when `retry_on` says the
+    failed attempt cannot have taken effect.
+    """
+    breaker = get_breaker(endpoint)
+    retry_budget.on_request()
+
+    for attempt in range(attempts):
+        if not breaker.allow():
+            raise CircuitOpenError(f"{endpoint} circuit is open")
+        breaker.stats["calls"] += 1
+        try:
+            if idempotent and HEDGE_AFTER_SECONDS > 0:
+                result = await _hedged(fn, args, kwargs, breaker, HEDGE_AFTER_SECONDS)
+            else:
+                result = await fn(*args, **kwargs)
+            breaker.record_success()
+            return result
+        except Exception as e:
+            breaker.record_failure()
+            if attempt == attempts - 1 or not retry_on(e) or not retry_budget.try_spend():
+                raise
+            breaker.stats["retries"] += 1
+            await asyncio.sleep(backoff_delay(attempt))
+
+
+class RpcEndpoint:
+    """One RPC node with rolling latency / error-rate estimates and its own circuit breaker."""
+    def __init__(self, url, alpha=0.2):
+        self.url = url
+        self.client = AsyncClient(url)
+        self.alpha = alpha
+        self.latency = None  # EWMA seconds; None until first measured
+        self.error_rate = 0.0
+        self.breaker = CircuitBreaker(f"rpc:{url}")
+
+    def record(self, elapsed: float, ok: bool):
+        self.latency = elapsed if self.latency is None else self.latency + self.alpha * (elapsed - self.latency)
+        self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def score(self) -> float:
+        """Lower is better. Unmeasured nodes score 0 so they get tried."""
+        return (self.latency or 0.0) * (1 + 10 * self.error_rate)
+
+    def snapshot(self) -> dict:
+        return {
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            **self.breaker.snapshot()
+        }
+
+
+class RpcPool:
+    """Drop-in replacement for AsyncClient that spreads calls over several RPC endpoints.
+
+    Reads go to the fastest healthy node and fail over down the ranking; a small share
+    is tried on a lower-ranked node first, so a node that recovered (or was slow only
+    while connecting) can win its place back. Transaction submissions are broadcast
+    to the best `fanout` nodes in parallel; the first acceptance wins and the rest
+    keep propagating the same signed transaction.
+    """
+    BROADCAST_METHODS = {"send_transaction", "send_raw_transaction"}
+
+    def __init__(self, urls, fanout=RPC_BROADCAST_FANOUT, explore_rate=RPC_EXPLORE_RATE):
+        self.endpoints = [RpcEndpoint(url) for url in urls]
+        self.fanout = max(1, fanout)
+        self.explore_rate = explore_rate
+
+    def ranked(self) -> list:
+        return sorted(self.endpoints, key=lambda e: (e.breaker.state == "open", e.score()))
+
+    async def _call_on(self, endpoint: RpcEndpoint, method: str, *args, **kwargs):
+        start = time.monotonic()
+        try:
+            result = await getattr(endpoint.client, method)(*args, **kwargs)
+        except Exception:
+            endpoint.record(time.monotonic() - start, False)
+            raise
+        endpoint.record(time.monotonic() - start, True)
+        return result
+
+    async def call(self, method: str, *args, **kwargs):
+        """Route a read to the best endpoint, failing over to the next on error."""
+        error = None
+        order = self.ranked()
+        if len(order) > 1 and random.random() < self.explore_rate:
+            order.insert(0, order.pop(random.randrange(1, len(order))))
+        with span("rpc", method):
+            for endpoint in order:
+                if not endpoint.breaker.allow():
+                    continue
+                try:
+                    return await self._call_on(endpoint, method, *args, **kwargs)
+                except Exception as e:
+                    logger.warning(f"⚠️ RPC {method} failed on {endpoint.url}: {str(e)}")
+                    error = e
+        raise error or CircuitOpenError("No healthy RPC endpoint")
+
+    async def broadcast(self, method: str, *args, **kwargs):
+        """Send to several nodes at once and return the first successful response."""
+        targets = [e for e in self.ranked() if e.breaker.allow()][:self.fanout]
+        if not targets:
+            raise CircuitOpenError("No healthy RPC endpoint")
+
+        pending = {asyncio.ensure_future(self._call_on(e, method, *args, **kwargs)) for e in targets}
+        error = None
+        with span("rpc", method):
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()  # Remaining sends finish in the background
+                    error = task.exception()
+        raise error
+
+    def __getattr__(self, name):
+        if not callable(getattr(AsyncClient, name, None)):
+            raise AttributeError(name)
+        if name in self.BROADCAST_METHODS:
+            return functools.partial(self.broadcast, name)
+        return functools.partial(self.call, name)
+
+    async def close(self):
+        await asyncio.gather(*(e.client.close() for e in self.endpoints), return_exceptions=True)
+
+    def snapshot(self) -> dict:
+        return {e.url: e.snapshot() for e in self.endpoints}
+
+
+solana_client = RpcPool(SOLANA_RPC_URLS)
+
+
+# ✅ Stop order types
+STOP_LOSS = 0
+TRAILING_STOP = 1
+STOP_ORDER_NAMES = {STOP_LOSS: "Stop-Loss", TRAILING_STOP: "Trailing Stop"}
+
+
+class StopOrderBook:
+    """Stop-loss and trailing-stop orders stored in NumPy columns so each tick is one vectorized pass.
+
+    Orders (including ratcheted trailing highs) are persisted as a journaled table
+    and the columns are rebuilt from it on startup.
+    """
+    def __init__(self, orders: dict, capacity=1024):
+        self.orders = orders  # user_id -> {"kind", "amount", "trigger", "high", "trail"}, journaled
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.trigger = np.zeros(capacity, dtype=np.float64)
+        self.high = np.zeros(capacity, dtype=np.float64)
+        self.trail = np.zeros(capacity, dtype=np.float64)
+        self.amount = np.zeros(capacity, dtype=np.float64)
+        self.owners = [None] * capacity
+        self.slots = {}  # user_id -> slot index
+        self.free = list(range(capacity - 1, -1, -1))  # Pop lowest slot first
+        self.size = 0  # One past the highest slot ever used
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _grow(self):
+        old = len(self.kind)
+        new = old * 2
+        for name in ("kind", "active", "trigger", "high", "trail", "amount"):
+            column = getattr(self, name)
+            grown = np.zeros(new, dtype=column.dtype)
+            grown[:old] = column
+            setattr(self, name, grown)
+        self.owners.extend([None] * old)
+        self.free = list(range(new - 1, old - 1, -1)) + self.free
+
+    def _insert(self, user_id: str, spec: dict):
+        slot = self.slots.get(user_id)
+        if slot is None:
+            if not self.free:
+                self._grow()
+            slot = self.free.pop()
+            self.slots[user_id] = slot
+            self.owners[slot] = user_id
+            self.size = max(self.size, slot + 1)
+
+        self.kind[slot] = spec["kind"]
+        self.amount[slot] = spec["amount"]
+        self.high[slot] = spec["high"]
+        self.trail[slot] = spec["trail"]
+        self.trigger[slot] = spec["trigger"]
+        self.active[slot] = True
+
+    def load(self):
+        for slot in self.slots.values():
+            self.active[slot] = False
+            self.owners[slot] = None
+        self.slots.clear()
+        self.free = list(range(len(self.kind) - 1, -1, -1))
+        self.size = 0
+        for user_id, spec in self.orders.items():
+            self._insert(user_id, spec)
+
+    def place(self, user_id: str, kind: int, amount: float, reference_price: float,
+              stop_price: float = 0.0, trail_pct: float = 0.0):
+        """Create or replace the user's stop order. `amount` of 0 means the full token balance."""
+        spec = {"kind": kind, "amount": amount, "high": reference_price, "trail": trail_pct,
+                "trigger": reference_price * (1.0 - trail_pct) if kind == TRAILING_STOP else stop_price}
+        self.orders[user_id] = spec
+        self._insert(user_id, spec)
+
+    def cancel(self, user_id: str) -> bool:
+        slot = self.slots.pop(user_id, None)
+        if slot is None:
+            return False
+        self.orders.pop(user_id, None)
+        self.active[slot] = False
+        self.owners[slot] = None
+        self.free.append(slot)
+        return True
+
+    def _spec(self, slot: int) -> dict:
+        return {
+            "kind": int(self.kind[slot]),
+            "amount": float(self.amount[slot]),
+            "trigger": float(self.trigger[slot]),
+            "high": float(self.high[slot]),
+            "trail": float(self.trail[slot]),
+        }
+
+    def get(self, user_id: str):
+        slot = self.slots.get(user_id)
+        return None if slot is None else self._spec(slot)
+
+    def on_tick(self, price: float) -> list:
+        """Advance high-water marks and return the orders triggered at `price`."""
+        n = self.size
+        active = self.active[:n]
+        trailing = active & (self.kind[:n] == TRAILING_STOP)
+
+        # ✅ Ratchet trailing stops up, never down
+        raised = trailing & (price > self.high[:n])
+        np.maximum(self.high[:n], price, out=self.high[:n], where=trailing)
+        np.multiply(self.high[:n], 1.0 - self.trail[:n], out=self.trigger[:n], where=trailing)
+
+        fired = []
+        for slot in np.flatnonzero(active & (price <= self.trigger[:n])):
+            user_id = self.owners[slot]
+            fired.append((user_id, int(self.kind[slot]), float(self.amount[slot]), float(self.trigger[slot])))
+            self.cancel(user_id)
+
+        for slot in np.flatnonzero(raised & self.active[:n]):  # Journal the new high-water marks
+            self.orders[self.owners[slot]] = self._spec(slot)
+        return fired
+
+
+stop_orders = StopOrderBook(state_journal.table("stop_orders"))
+
+
+# ✅ Indicator catalogue: name -> (kind, period in price ticks)
+SIGNAL_INDICATORS = {
+    "price": ("price", 1),
+    "sma20": ("sma", 20),
+    "sma50": ("sma", 50),
+    "ema12": ("ema", 12),
+    "ema26": ("ema", 26),
+    "rsi14": ("rsi", 14),
+}
+INDICATOR_IDS = {name: i for i, name in enumerate(SIGNAL_INDICATORS)}
+SIGNAL_OPS = ("<", ">", "crosses_above", "crosses_below")
+OP_BELOW, OP_ABOVE, OP_CROSS_UP, OP_CROSS_DOWN = range(len(SIGNAL_OPS))
+SIGNAL_MAX_PER_USER = 10
+
+
+class RollingIndicators:
+    """SMA, EMA and Wilder RSI for one mint, each updated in O(1) per price tick.
+
+    `values` and `previous` are vectors indexed by INDICATOR_IDS (NaN until an
+    indicator has seen `period` ticks), so order evaluation can gather them in bulk.
+    """
+    def __init__(self):
+        self.window = max(period for kind, period in SIGNAL_INDICATORS.values() if kind == "sma")
+        self.ring = np.zeros(self.window, dtype=np.float64)
+        self.count = 0
+        self.last_price = None
+        self.sums = {}      # sma period -> running sum
+        self.emas = {}      # ema period -> value
+        self.gains = {}     # rsi period -> average gain
+        self.losses = {}    # rsi period -> average loss
+        self.values = np.full(len(SIGNAL_INDICATORS), np.nan)
+        self.previous = self.values.copy()
+
+    def update(self, price: float):
+        self.previous[:] = self.values
+        n = self.count + 1
+        change = price - self.last_price if self.last_price is not None else 0.0
+
+        for i, (kind, period) in enumerate(SIGNAL_INDICATORS.values()):
+            if kind == "price":
+                self.values[i] = price
+            elif kind == "sma":
+                total = self.sums.get(period, 0.0) + price
+                if n > period:
+                    total -= self.ring[(self.count - period) % self.window]  # Price leaving the window
+                self.sums[period] = total
+                self.values[i] = total / period if n >= period else np.nan
+            elif kind == "ema":
+                alpha = 2.0 / (period + 1)
+                ema = self.emas.get(period, price)
+                self.emas[period] = ema = ema + alpha * (price - ema)
+                self.values[i] = ema if n >= period else np.nan
+            elif kind == "rsi" and n > 1:
+                gain, loss = max(change, 0.0), max(-change, 0.0)
+                if n <= period + 1:  # Seed with a simple average of the first `period` changes
+                    avg_gain = self.gains.get(period, 0.0) + gain / period
+                    avg_loss = self.losses.get(period, 0.0) + loss / period
+                else:
+                    avg_gain = (self.gains[period] * (period - 1) + gain) / period
+                    avg_loss = (self.losses[period] * (period - 1) + loss) / period
+                self.gains[period], self.losses[period] = avg_gain, avg_loss
+                if n <= period:
+                    self.values[i] = np.nan
+                else:
+                    self.values[i] = 100.0 if avg_loss == 0 else 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+
+        self.ring[self.count % self.window] = price
+        self.last_price = price
+        self.count = n
+
+    def snapshot(self) -> dict:
+        return {name: (None if np.isnan(v) else float(v)) for name, v in zip(SIGNAL_INDICATORS, self.values)}
+
+
+class SignalEngine:
+    """Per-mint rolling indicators fed by oracle ticks."""
+    def __init__(self):
+        self.indicators = {}  # mint -> RollingIndicators
+
+    def get(self, mint: str) -> RollingIndicators:
+        indicators = self.indicators.get(mint)
+        if indicators is None:
+            indicators = self.indicators[mint] = RollingIndicators()
+        return indicators
+
+    def on_tick(self, mint: str, price: float) -> RollingIndicators:
+        indicators = self.get(mint)
+        indicators.update(price)
+        return indicators
+
+    def warm(self, mint: str, closes):
+        """Seed indicators from recent candle closes after a restart."""
+        indicators = self.get(mint)
+        for price in closes:
+            indicators.update(float(price))
+
+
+signal_engine = SignalEngine()
+
+
+class SignalOrderBook:
+    """Indicator-conditioned one-shot orders in NumPy columns, evaluated in one vectorized pass per tick.
+
+    A condition compares one indicator with a constant or with another indicator
+    (`rhs` >= 0), e.g. "rsi14 < 30" or "ema12 crosses_above ema26". Orders are
+    persisted as a journaled table and rebuilt from it on startup.
+    """
+    def __init__(self, orders: dict, capacity=1024):
+        self.orders = orders  # str(order_id) -> spec, journaled
+        self.lhs = np.zeros(capacity, dtype=np.int16)
+        self.rhs = np.full(capacity, -1, dtype=np.int16)
+        self.op = np.zeros(capacity, dtype=np.int8)
+        self.threshold = np.zeros(capacity, dtype=np.float64)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.ids = [None] * capacity
+        self.slots = {}  # order_id -> slot
+        self.free = list(range(capacity - 1, -1, -1))
+        self.size = 0
+        self.next_id = 1
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _grow(self):
+        old = len(self.lhs)
+        for name, fill in (("lhs", 0), ("rhs", -1), ("op", 0), ("threshold", 0), ("active", False)):
+            column = getattr(self, name)
+            grown = np.full(old * 2, fill, dtype=column.dtype)
+            grown[:old] = column
+            setattr(self, name, grown)
+        self.ids.extend([None] * old)
+        self.free = list(range(old * 2 - 1, old - 1, -1)) + self.free
+
+    def _insert(self, order_id: int, spec: dict):
+        if not self.free:
+            self._grow()
+        slot = self.free.pop()
+        self.slots[order_id] = slot
+        self.ids[slot] = order_id
+        self.size = max(self.size, slot + 1)
+        self.lhs[slot] = INDICATOR_IDS[spec["lhs"]]
+        self.rhs[slot] = INDICATOR_IDS.get(spec["rhs"], -1) if spec["rhs"] else -1
+        self.op[slot] = SIGNAL_OPS.index(spec["op"])
+        self.threshold[slot] = spec["threshold"]
+        self.active[slot] = True
+
+    def load(self):
+        for slot in self.slots.values():
+            self.active[slot] = False
+        self.slots.clear()
+        self.free = list(range(len(self.lhs) - 1, -1, -1))
+        self.size = 0
+        for order_id, spec in self.orders.items():
+            self._insert(int(order_id), spec)
+        self.next_id = max((int(i) for i in self.orders), default=0) + 1
+
+    def place(self, user_id: str, side: str, amount: float, lhs: str, op: str, rhs) -> int:
+        """`rhs` is an indicator name or a number."""
+        order_id = self.next_id
+        self.next_id += 1
+        spec = {"user_id": user_id, "side": side, "amount": amount, "lhs": lhs, "op": op,
+                "rhs": rhs if rhs in INDICATOR_IDS else None,
+                "threshold": 0.0 if rhs in INDICATOR_IDS else float(rhs)}
+        self.orders[str(order_id)] = spec
+        self._insert(order_id, spec)
+        return order_id
+
+    def cancel(self, order_id: int, user_id: str = None) -> bool:
+        spec = self.orders.get(str(order_id))
+        if spec is None or (user_id is not None and spec["user_id"] != user_id):
+            return False
+        del self.orders[str(order_id)]
+        slot = self.slots.pop(order_id)
+        self.active[slot] = False
+        self.ids[slot] = None
+        self.free.append(slot)
+        return True
+
+    def for_user(self, user_id: str) -> list:
+        return [(int(i), spec) for i, spec in self.orders.items() if spec["user_id"] == user_id]
+
+    def on_tick(self, indicators: RollingIndicators) -> list:
+        """Return (order_id, spec) for every order whose condition holds on this tick, removing them."""
+        n = self.size
+        if not self.slots:
+            return []
+        rhs = self.rhs[:n]
+        has_rhs = rhs >= 0
+        rhs_idx = np.where(has_rhs, rhs, 0)
+        right = np.where(has_rhs, indicators.values[rhs_idx], self.threshold[:n])
+        right_prev = np.where(has_rhs, indicators.previous[rhs_idx], self.threshold[:n])
+        left = indicators.values[self.lhs[:n]]
+        left_prev = indicators.previous[self.lhs[:n]]
+        op = self.op[:n]
+
+        # NaN (not warmed up) compares False everywhere, so cold indicators never fire
+        hit = np.where(op == OP_BELOW, left < right,
+              np.where(op == OP_ABOVE, left > right,
+              np.where(op == OP_CROSS_UP, (left_prev <= right_prev) & (left > right),
+                       (left_prev >= right_prev) & (left < right))))
+
+        fired = []
+        for slot in np.flatnonzero(self.active[:n] & hit):
+            order_id = self.ids[slot]
+            fired.append((order_id, self.orders[str(order_id)]))
+            self.cancel(order_id)
+        return fired
+
+
+signal_orders = SignalOrderBook(state_journal.table("signal_orders"))
+
+
+ALERT_MAX_PER_USER = 20
+ALERT_ABOVE, ALERT_BELOW = "above", "below"
+
+
+class PriceAlertBook:
+    """Notify-only price alerts in two sorted trigger lists, so a tick costs O(log n + k).
+
+    Both lists are kept sorted so that everything a tick fires is a suffix: "below"
+    alerts by threshold (price <= t fires t >= price) and "above" alerts by negated
+    threshold. Firing is then one bisect plus a tail slice, regardless of book size.
+    Alerts are persisted as a journaled table and the index is rebuilt on startup.
+    """
+    def __init__(self, alerts: dict):
+        self.alerts = alerts  # str(alert_id) -> spec, journaled
+        self.keys = {ALERT_ABOVE: [], ALERT_BELOW: []}  # Sorted trigger keys
+        self.ids = {ALERT_ABOVE: [], ALERT_BELOW: []}   # Alert ids, parallel to keys
+        self.by_user = {}  # user_id -> set of alert ids
+        self.next_id = 1
+
+    def __len__(self):
+        return len(self.alerts)
+
+    @staticmethod
+    def _key(direction: str, price: float) -> float:
+        return -price if direction == ALERT_ABOVE else price
+
+    def _insert(self, alert_id: int, spec: dict):
+        keys, ids = self.keys[spec["direction"]], self.ids[spec["direction"]]
+        key = self._key(spec["direction"], spec["price"])
+        index = bisect.bisect_right(keys, key)
+        keys.insert(index, key)
+        ids.insert(index, alert_id)
+        self.by_user.setdefault(spec["user_id"], set()).add(alert_id)
+
+    def load(self):
+        for direction in self.keys:
+            self.keys[direction].clear()
+            self.ids[direction].clear()
+        self.by_user.clear()
+        for alert_id, spec in sorted(self.alerts.items(), key=lambda item: self._key(item[1]["direction"], item[1]["price"])):
+            self._insert(int(alert_id), spec)
+        self.next_id = max((int(i) for i in self.alerts), default=0) + 1
+
+    def place(self, user_id: str, price: float, direction: str) -> int:
+        alert_id = self.next_id
+        self.next_id += 1
+        spec = {"user_id": user_id, "price": price, "direction": direction, "created": time.time()}
+        self.alerts[str(alert_id)] = spec
+        self._insert(alert_id, spec)
+        return alert_id
+
+    def cancel(self, alert_id: int, user_id: str = None) -> bool:
+        spec = self.alerts.get(str(alert_id))
+        if spec is None or (user_id is not None and spec["user_id"] != user_id):
+            return False
+        del self.alerts[str(alert_id)]
+        keys, ids = self.keys[spec["direction"]], self.ids[spec["direction"]]
+        index = bisect.bisect_left(keys, self._key(spec["direction"], spec["price"]))
+        while ids[index] != alert_id:  # Step over other alerts at the same price
+            index += 1
+        del keys[index], ids[index]
+        self._forget(spec["user_id"], alert_id)
+        return True
+
+    def _forget(self, user_id: str, alert_id: int):
+        owned = self.by_user[user_id]
+        owned.discard(alert_id)
+        if not owned:
+            del self.by_user[user_id]
+
+    def for_user(self, user_id: str) -> list:
+        return [(i, self.alerts[str(i)]) for i in sorted(self.by_user.get(user_id, ()))]
+
+    def on_tick(self, price: float) -> list:
+        """Remove and return (alert_id, spec) for every alert reached at `price`."""
+        fired = []
+        for direction in (ALERT_ABOVE, ALERT_BELOW):
+            keys, ids = self.keys[direction], self.ids[direction]
+            index = bisect.bisect_left(keys, self._key(direction, price))
+            if index == len(keys):
+                continue
+            for alert_id in ids[index:]:
+                spec = self.alerts.pop(str(alert_id))
+                self._forget(spec["user_id"], alert_id)
+                fired.append((alert_id, spec))
+            del keys[index:], ids[index:]
+        return fired
+
+
+price_alerts = PriceAlertBook(state_journal.table("price_alerts"))
+
+
+# ✅ Outbound message priorities (lower number is sent first)
+PRIORITY_FILL = 0
+PRIORITY_ALERT = 1
+PRIORITY_INFO = 2
+
+TELEGRAM_MAX_MESSAGE = 4096
+
+
+class TokenBucket:
+    """Token bucket that reports how long to wait for the next token."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class OutboundMessenger:
+    """Telegram sender honoring the global and per-chat Bot API limits.
+
+    Messages are queued per chat and sent by a single worker in priority order.
+    Plain-text updates waiting for the same chat are coalesced into one message,
+    and 429 responses pause only the affected chat (or everything, for a global flood).
+    """
+    def __init__(self, global_rate=30, per_chat_interval=1.0):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.per_chat_interval = per_chat_interval
+        self.pending = {}  # chat_id -> [(priority, seq, text, parse_mode, reply_markup)]
+        self.chat_ready_at = {}  # chat_id -> monotonic time of the next allowed send
+        self.ready = []  # heap of (priority, seq, chat_id)
+        self.delayed = []  # heap of (ready_at, priority, seq, chat_id)
+        self.paused_until = 0.0
+        self.seq = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.stats = {"queued": 0, "sent": 0, "coalesced": 0, "retry_after": 0, "dropped": 0}
+
+    def send(self, chat_id, text, priority=PRIORITY_INFO, parse_mode=None, reply_markup=None):
+        """Queue a message without waiting for delivery."""
+        chat_id = str(chat_id)
+        seq = next(self.seq)
+        queue = self.pending.setdefault(chat_id, [])
+        if not queue or priority < min(item[0] for item in queue):
+            heapq.heappush(self.ready, (priority, seq, chat_id))
+        queue.append((priority, seq, text, parse_mode, reply_markup))
+        self.stats["queued"] += 1
+        self.wakeup.set()
+
+    def backlog(self) -> int:
+        return sum(len(queue) for queue in self.pending.values())
+
+    def _next_payload(self, chat_id):
+        """Pop the next message for a chat, merging queued plain-text updates."""
+        queue = self.pending[chat_id]
+        queue.sort()
+        priority, _, text, parse_mode, reply_markup = queue.pop(0)
+
+        if reply_markup is None:
+            while queue and queue[0][4] is None and queue[0][3] == parse_mode \
+                    and len(text) + len(queue[0][2]) + 2 <= TELEGRAM_MAX_MESSAGE:
+                text += "\n\n" + queue.pop(0)[2]
+                self.stats["coalesced"] += 1
+
+        return priority, text, parse_mode, reply_markup
+
+    async def run(self, bot):
+        """Deliver queued messages until cancelled."""
+        while True:
+            now = time.monotonic()
+            while self.delayed and self.delayed[0][0] <= now:
+                _, priority, seq, chat_id = heapq.heappop(self.delayed)
+                heapq.heappush(self.ready, (priority, seq, chat_id))
+
+            if not self.ready:
+                self.wakeup.clear()
+                timeout = self.delayed[0][0] - now if self.delayed else None
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            priority, seq, chat_id = heapq.heappop(self.ready)
+            if not self.pending.get(chat_id):
+                continue  # Stale entry, already delivered
+
+            ready_at = max(self.chat_ready_at.get(chat_id, 0.0), self.paused_until)
+            if ready_at > now:
+                heapq.heappush(self.delayed, (ready_at, priority, seq, chat_id))
+                continue
+
+            wait = self.global_bucket.delay()
+            if wait > 0:
+                heapq.heappush(self.ready, (priority, seq, chat_id))
+                await asyncio.sleep(wait)
+                continue
+            self.global_bucket.take()
+
+            priority, text, parse_mode, reply_markup = self._next_payload(chat_id)
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
+                self.stats["sent"] += 1
+                self.chat_ready_at[chat_id] = time.monotonic() + self.per_chat_interval
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if hasattr(retry_after, "total_seconds"):
+                    retry_after = retry_after.total_seconds()
+                self.stats["retry_after"] += 1
+                logger.warning(f"⚠️ Telegram asked to retry after {retry_after}s (chat {chat_id})")
+                self.pending[chat_id].insert(0, (priority, next(self.seq), text, parse_mode, reply_markup))
+                self.chat_ready_at[chat_id] = time.monotonic() + retry_after
+                if retry_after > self.per_chat_interval * 5:
+                    self.paused_until = time.monotonic() + retry_after  # Global flood control
+            except Forbidden:
+                self.stats["dropped"] += 1
+                logger.info(f"User {chat_id} blocked the bot; message dropped.")
+            except Exception as e:
+                self.stats["dropped"] += 1
+                logger.error(f"🚨 Outbound message to {chat_id} failed: {str(e)}")
+
+            if self.pending.get(chat_id):
+                next_priority = min(item[0] for item in self.pending[chat_id])
+                heapq.heappush(self.ready, (next_priority, next(self.seq), chat_id))
+            else:
+                self.pending.pop(chat_id, None)
+
+
+messenger = OutboundMessenger()
+
+
+# ✅ Internal event bus settings
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 1024))  # Per-subscriber queue bound
+EXECUTION_WORKERS = int(os.getenv("EXECUTION_WORKERS", 32))  # Triggered orders executed concurrently
+
+# Subscriber queue policies when the queue is full
+DROP_OLDEST = "drop_oldest"  # Keep the newest events; for state where only the latest matters
+DROP_NEWEST = "drop_newest"  # Keep what is already queued and refuse the new event
+BLOCK = "block"              # Backpressure: the publisher waits for room; nothing is lost
+
+
+@dataclass(frozen=True, slots=True)
+class PriceTick:
+    mint: str
+    price: float
+    at: float
+
+
+@dataclass(frozen=True, slots=True)
+class OrderTriggered:
+    user_id: str
+    side: str      # "buy" or "sell"
+    amount: float  # SOL for buys, tokens for sells (0 = full balance)
+    reason: str
+    price: float
+
+
+@dataclass(frozen=True, slots=True)
+class TxSubmitted:
+    user_id: str
+    side: str
+    txid: str
+
+
+@dataclass(frozen=True, slots=True)
+class TxConfirmed:
+    user_id: str
+    side: str
+    txid: str
+    status: str  # "confirmed", "failed" or "timeout"
+
+
+@dataclass(frozen=True, slots=True)
+class BalanceChanged:
+    user_id: str
+    sol_delta: float
+    token_delta: float
+    reason: str  # "swap" or "deposit"
+
+
+class Subscription:
+    """One subscriber's bounded queue and the worker task(s) that drain it into its handler."""
+    def __init__(self, name, handler, maxsize, policy, workers):
+        self.name = name
+        self.handler = handler
+        self.policy = policy
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize)
+        self.stats = {"delivered": 0, "dropped": 0, "blocked": 0, "errors": 0, "max_depth": 0}
+
+    async def offer(self, event):
+        if self.queue.full():
+            if self.policy == DROP_NEWEST:
+                self.stats["dropped"] += 1
+                return
+            if self.policy == DROP_OLDEST:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.stats["dropped"] += 1
+            else:
+                self.stats["blocked"] += 1
+                await self.queue.put(event)
+                return
+        self.queue.put_nowait(event)
+        self.stats["max_depth"] = max(self.stats["max_depth"], self.queue.qsize())
+
+    async def run(self):
+        while True:
+            event = await self.queue.get()
+            try:
+                await self.handler(event)
+                self.stats["delivered"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"🚨 {self.name} failed on {type(event).__name__}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+
+class EventBus:
+    """In-process typed pub/sub: each stage consumes from its own bounded queue at its own pace.
+
+    A slow subscriber only fills its own queue; what happens then is its policy
+    (drop oldest, drop newest, or make publishers wait).
+    """
+    def __init__(self):
+        self.subscribers = {}  # event type -> [Subscription]
+
+    def subscribe(self, event_type, handler, policy=BLOCK, maxsize=EVENT_QUEUE_SIZE, workers=1) -> Subscription:
+        subscription = Subscription(f"{event_type.__name__}->{handler.__name__}", handler, maxsize, policy, workers)
+        self.subscribers.setdefault(event_type, []).append(subscription)
+        return subscription
+
+    async def publish(self, event):
+        for subscription in self.subscribers.get(type(event), ()):
+            await subscription.offer(event)
+
+    def start(self, spawn):
+        for subscriptions in self.subscribers.values():
+            for subscription in subscriptions:
+                for _ in range(subscription.workers):
+                    spawn(subscription.run())
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait until every queued event has been handled; False if the timeout hit first."""
+        joins = [s.queue.join() for subscriptions in self.subscribers.values() for s in subscriptions]
+        try:
+            await asyncio.wait_for(asyncio.gather(*joins), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def snapshot(self) -> dict:
+        return {s.name: {**s.stats, "depth": s.queue.qsize(), "policy": s.policy}
+                for subscriptions in self.subscribers.values() for s in subscriptions}
+
+
+event_bus = EventBus()
+
+
+class InFlightRegistry:
+    """Per-user action de-duplication and wallet locks.
+
+    A repeated action (same idempotency key) while the first is still running is
+    collapsed onto the running task instead of starting new work, and swaps for the
+    same wallet are serialized so they cannot race each other for funds.
+    """
+    def __init__(self):
+        self.running = {}  # idempotency key -> Task
+        self.locks = {}  # user_id -> asyncio.Lock
+        self.stats = {"started": 0, "collapsed": 0}
+
+    def join(self, key: str):
+        """Return the task already running for `key` (counted as a collapsed duplicate), if any."""
+        task = self.running.get(key)
+        if task is not None:
+            self.stats["collapsed"] += 1
+        return task
+
+    def lock(self, user_id: str) -> asyncio.Lock:
+        if user_id not in self.locks:
+            self.locks[user_id] = asyncio.Lock()
+        return self.locks[user_id]
+
+    @contextlib.asynccontextmanager
+    async def lock_all(self, user_ids):
+        """Hold every listed wallet's lock, acquired in sorted order so overlapping batches cannot deadlock."""
+        async with contextlib.AsyncExitStack() as stack:
+            for user_id in sorted(set(user_ids)):
+                await stack.enter_async_context(self.lock(user_id))
+            yield
+
+    async def run(self, key: str, coro_factory):
+        """Run `coro_factory()` once per key at a time; concurrent callers share its result."""
+        task = self.running.get(key)
+        if task is None:
+            self.stats["started"] += 1
+            task = lifecycle.track(coro_factory())
+            self.running[key] = task
+            task.add_done_callback(lambda _: self.running.pop(key, None))
+        else:
+            self.stats["collapsed"] += 1
+        return await asyncio.shield(task)
+
+
+inflight = InFlightRegistry()
+EXCLUSIVE_ACTIONS = {"buy_now", "sell_now", "withdraw_sol"}  # Actions that move funds
+
+
+# ✅ Price history settings
+PRICE_POLL_INTERVAL = float(os.getenv("PRICE_POLL_INTERVAL", 60))  # Seconds between oracle ticks
+CANDLE_RESOLUTIONS = (1, 60, 300, 3600)  # 1s, 1m, 5m, 1h
+CANDLE_HISTORY = int(os.getenv("CANDLE_HISTORY", 1440))  # Closed candles kept in memory per resolution
+CANDLE_LABELS = {"1s": 1, "1m": 60, "5m": 300, "1h": 3600}
+
+
+class CandleSeries:
+    """Ring buffer of closed candles (ts, open, high, low, close, volume) plus the candle being built."""
+    def __init__(self, resolution, capacity=CANDLE_HISTORY):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.data = np.zeros((capacity, 6), dtype=np.float64)
+        self.count = 0  # Closed candles written so far
+        self.current = None
+
+    def update(self, ts: float, price: float, volume: float = 0.0):
+        """Apply a tick in O(1). Returns the candle it closed, if any."""
+        bucket = int(ts) // self.resolution * self.resolution
+        current = self.current
+
+        if current is None:
+            self.current = [bucket, price, price, price, price, volume]
+            return None
+        if bucket == current[0]:
+            current[2] = max(current[2], price)
+            current[3] = min(current[3], price)
+            current[4] = price
+            current[5] += volume
+            return None
+        if bucket < current[0]:
+            return None  # Late tick for a candle that is already closed
+
+        self.append(current)
+        self.current = [bucket, price, price, price, price, volume]
+        return current
+
+    def append(self, candle):
+        self.data[self.count % self.capacity] = candle
+        self.count += 1
+
+    def last(self, n: int, include_current: bool = True) -> np.ndarray:
+        """Most recent candles in chronological order."""
+        n = min(n, self.count, self.capacity)
+        rows = self.data[np.arange(self.count - n, self.count) % self.capacity]
+        if include_current and self.current is not None:
+            rows = np.vstack([rows, self.current])
+        return rows
+
+
+class CandleStore:
+    """Builds candles at every resolution from oracle ticks and persists closed ones in batches."""
+    def __init__(self, resolutions=CANDLE_RESOLUTIONS, capacity=CANDLE_HISTORY, flush_size=200, flush_interval=60):
+        self.resolutions = resolutions
+        self.capacity = capacity
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.series = {}  # (mint, resolution) -> CandleSeries
+        self.latest = {}  # mint -> (price, ts)
+        self.unsaved = []
+        self.last_flush = time.monotonic()
+
+    def _series(self, mint, resolution) -> CandleSeries:
+        series = self.series.get((mint, resolution))
+        if series is None:
+            series = self.series[(mint, resolution)] = CandleSeries(resolution, self.capacity)
+        return series
+
+    def on_tick(self, mint: str, price: float, ts: float = None, volume: float = 0.0):
+        ts = ts or time.time()
+        self.latest[mint] = (price, ts)
+
+        for resolution in self.resolutions:
+            closed = self._series(mint, resolution).update(ts, price, volume)
+            if closed is not None:
+                self.unsaved.append((mint, resolution, *closed))
+
+        if len(self.unsaved) >= self.flush_size or time.monotonic() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def last_price(self, mint: str):
+        return self.latest.get(mint, (None, None))[0]
+
+    def candles(self, mint: str, resolution: int, n: int) -> np.ndarray:
+        return self._series(mint, resolution).last(n)
+
+    def flush(self):
+        """Write closed candles to SQLite in one batch."""
+        self.last_flush = time.monotonic()
+        if not self.unsaved:
+            return
+
+        rows, self.unsaved = self.unsaved, []
+        try:
+            conn = sqlite3.connect("trading_bot.db")
+            conn.executemany("""
+                INSERT OR REPLACE INTO candles (mint, resolution, ts, open, high, low, close, volume)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(m, r, int(t), o, h, l, c, v) for m, r, t, o, h, l, c, v in rows])
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"🚨 Candle flush failed: {str(e)}")
+            self.unsaved = rows + self.unsaved  # Retry on the next flush
+
+    def load(self, mint: str):
+        """Warm the ring buffers from persisted candles after a restart."""
+        try:
+            conn = sqlite3.connect("trading_bot.db")
+            for resolution in self.resolutions:
+                rows = conn.execute("""
+                    SELECT ts, open, high, low, close, volume FROM candles
+                    WHERE mint = ? AND resolution = ? ORDER BY ts DESC LIMIT ?
+                """, (mint, resolution, self.capacity)).fetchall()
+                series = self._series(mint, resolution)
+                for row in reversed(rows):
+                    series.append(row)
+                if rows:
+                    self.latest.setdefault(mint, (rows[0][4], rows[0][0]))
+            conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"🚨 Candle load failed: {str(e)}")
+
+
+candle_store = CandleStore()
+
 # ✅ Set up the database only once
 
 def setup_database():
@@ -175,6 +1901,117 @@ def setup_database():
         )
     """)
 
+    # ✅ Per-user fill ledger (several rows may share one pooled swap transaction)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fills (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            side TEXT NOT NULL,
+            token_amount REAL NOT NULL,
+            sol_amount REAL NOT NULL,
+            price REAL NOT NULL,
+            transaction_id TEXT NOT NULL,
+            batch_id TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # ✅ Running per-user aggregates, updated in the same transaction as each fill
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS portfolio (
+            user_id TEXT PRIMARY KEY,
+            position REAL NOT NULL DEFAULT 0,
+            cost_basis REAL NOT NULL DEFAULT 0,
+            realized_pnl REAL NOT NULL DEFAULT 0,
+            fill_count INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # ✅ Checkpoints for resumable admin bulk jobs
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS admin_jobs (
+            job_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            report_path TEXT NOT NULL,
+            created_by TEXT,
+            last_user_id TEXT,
+            report_offset INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(admin_jobs)")}
+    if "last_user_id" not in columns:  # Tables created before resume-by-key
+        cursor.execute("ALTER TABLE admin_jobs ADD COLUMN last_user_id TEXT")
+        cursor.execute("ALTER TABLE admin_jobs ADD COLUMN report_offset INTEGER NOT NULL DEFAULT 0")
+
+    # ✅ Closed OHLCV candles, flushed in batches by the candle store
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS candles (
+            mint TEXT NOT NULL,
+            resolution INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            volume REAL NOT NULL,
+            PRIMARY KEY (mint, resolution, ts)
+        )
+    """)
+
+    # ✅ Recurring DCA buy orders, driven by the in-memory scheduler heap
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS dca_orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            sol_amount REAL NOT NULL,
+            interval_seconds INTEGER NOT NULL,
+            next_run REAL NOT NULL,
+            runs INTEGER NOT NULL DEFAULT 0,
+            max_runs INTEGER,
+            status TEXT NOT NULL DEFAULT 'active',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # ✅ Deposit scanner cursors: newest signature already processed per custodial wallet
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS wallet_cursors (
+            address TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            last_signature TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # ✅ Pooled-swap payouts the bot owes (status 'pending', settled by hand), or owes only if
+    #    transaction `txid` turns out to have landed / been dropped (status 'unconfirmed')
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pending_payouts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            address TEXT NOT NULL,
+            asset TEXT NOT NULL,
+            units INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            txid TEXT,
+            owed_if TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(pending_payouts)")}
+    if "txid" not in columns:  # Tables created before outcome reconciliation
+        cursor.execute("ALTER TABLE pending_payouts ADD COLUMN txid TEXT")
+        cursor.execute("ALTER TABLE pending_payouts ADD COLUMN owed_if TEXT")
+
+    # ✅ Per-user date-range scans for history export
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_fills_user_ts ON fills (user_id, timestamp)")
+
     conn.commit()
     conn.close()
 
@@ -202,14 +2039,329 @@ def log_transaction(user_id, sell_amount, target_price, txid):
         conn.close()
 
 
+@traced
+def log_fill(user_id, side, token_amount, sol_amount, txid, batch_id=None):
+    """Record a user's share of an executed swap and fold it into their portfolio aggregates."""
+    price = sol_amount / token_amount if token_amount else 0.0
+    position = portfolio.get(user_id).copy()
+    position.apply(side, token_amount, sol_amount)
+    try:
+        conn = sqlite3.connect("trading_bot.db")
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            INSERT INTO fills (user_id, side, token_amount, sol_amount, price, transaction_id, batch_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, side, token_amount, sol_amount, price, txid, batch_id))
+        portfolio.save(cursor, user_id, position)
+
+        conn.commit()
+        portfolio.positions[user_id] = position
+        logging.info(f"✅ Fill logged: {user_id} {side} {token_amount} tokens for {sol_amount} SOL")
+
+    except sqlite3.Error as e:
+        logging.error(f"🚨 Database Error: {str(e)}")
+
+    finally:
+        conn.close()
+
+
+def reverse_fill(user_id, txid):
+    """Drop a user's fills for a transaction that never landed and refold their aggregates from the rest.
+
+    Average-cost aggregates cannot be un-applied, so the user's remaining fills are
+    replayed; returns the number of fills removed.
+    """
+    try:
+        conn = sqlite3.connect("trading_bot.db")
+        cursor = conn.cursor()
+
+        removed = cursor.execute("DELETE FROM fills WHERE user_id = ? AND transaction_id = ?", (user_id, txid)).rowcount
+        if not removed:
+            return 0
+        position = Position()
+        for side, token_amount, sol_amount in cursor.execute(
+                "SELECT side, token_amount, sol_amount FROM fills WHERE user_id = ? ORDER BY id", (user_id,)).fetchall():
+            position.apply(side, token_amount, sol_amount)
+        portfolio.save(cursor, user_id, position)
+
+        conn.commit()
+        portfolio.positions[user_id] = position
+        logging.warning(f"⚠️ Fill reversed: {user_id} {txid} never landed")
+        return removed
+
+    except sqlite3.Error as e:
+        logging.error(f"🚨 Database Error: {str(e)}")
+        return 0
+
+    finally:
+        conn.close()
+
+
+def log_pending_payout(batch_id, user_id, address, asset, units, txid=None, owed_if=None):
+    """Persist a payout the bot still owes a user so it survives restarts.
+
+    With `owed_if` ("landed" or "dropped") the debt depends on the outcome of `txid`;
+    the row stays 'unconfirmed' until reconcile_pending_payouts resolves it.
+    """
+    status = "unconfirmed" if owed_if else "pending"
+    try:
+        conn = sqlite3.connect("trading_bot.db")
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            INSERT INTO pending_payouts (batch_id, user_id, address, asset, units, status, txid, owed_if)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (batch_id, user_id, str(address), asset, units, status, txid, owed_if))
+
+        conn.commit()
+        logging.warning(f"⚠️ {status.capitalize()} payout recorded: {units} {asset} units to {user_id} ({batch_id})")
+
+    except sqlite3.Error as e:
+        logging.critical(f"🚨 Could not record pending payout of {units} {asset} units to {user_id} ({batch_id}): {str(e)}")
+
+    finally:
+        conn.close()
+
+
+class Position:
+    """Running position aggregates for one user (average-cost accounting)."""
+    __slots__ = ("position", "cost_basis", "realized_pnl", "fill_count")
+
+    def __init__(self, position=0.0, cost_basis=0.0, realized_pnl=0.0, fill_count=0):
+        self.position = position
+        self.cost_basis = cost_basis
+        self.realized_pnl = realized_pnl
+        self.fill_count = fill_count
+
+    def copy(self):
+        return Position(self.position, self.cost_basis, self.realized_pnl, self.fill_count)
+
+    def as_tuple(self):
+        return (self.position, self.cost_basis, self.realized_pnl, self.fill_count)
+
+    @property
+    def avg_entry(self) -> float:
+        return self.cost_basis / self.position if self.position else 0.0
+
+    def apply(self, side: str, token_amount: float, sol_amount: float):
+        if side == "buy":
+            self.position += token_amount
+            self.cost_basis += sol_amount
+        else:
+            # Tokens sold beyond the tracked position (e.g. deposited externally) carry no cost basis
+            sold = min(token_amount, self.position)
+            released = self.avg_entry * sold
+            self.realized_pnl += sol_amount - released
+            self.cost_basis -= released
+            self.position -= sold
+        self.fill_count += 1
+
+    def unrealized_pnl(self, price: float) -> float:
+        return self.position * price - self.cost_basis
+
+
+class PortfolioBook:
+    """In-memory per-user aggregates backed by the portfolio table, so reports never scan the ledger."""
+    def __init__(self):
+        self.positions = {}
+
+    def get(self, user_id: str) -> Position:
+        return self.positions.get(user_id) or Position()
+
+    @staticmethod
+    def save(cursor, user_id: str, position: Position):
+        cursor.execute("""
+            INSERT INTO portfolio (user_id, position, cost_basis, realized_pnl, fill_count, updated_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+                position = excluded.position,
+                cost_basis = excluded.cost_basis,
+                realized_pnl = excluded.realized_pnl,
+                fill_count = excluded.fill_count,
+                updated_at = excluded.updated_at
+        """, (user_id, *position.as_tuple()))
+
+    def load(self):
+        try:
+            conn = sqlite3.connect("trading_bot.db")
+            rows = conn.execute("SELECT user_id, position, cost_basis, realized_pnl, fill_count FROM portfolio").fetchall()
+            conn.close()
+            self.positions = {row[0]: Position(*row[1:]) for row in rows}
+            logging.info(f"✅ Loaded portfolio aggregates: {len(self.positions)} users")
+        except sqlite3.Error as e:
+            logging.error(f"🚨 Portfolio load failed: {str(e)}")
+
+    @staticmethod
+    def replay_ledger(rebuilt: dict = None, after_id: int = 0) -> tuple:
+        """Fold fills with id > after_id into rebuilt. Returns (rebuilt, last fill id read)."""
+        rebuilt = {} if rebuilt is None else rebuilt
+        conn = sqlite3.connect("trading_bot.db")
+        last_id = after_id
+        for fill_id, user_id, side, token_amount, sol_amount in conn.execute(
+                "SELECT id, user_id, side, token_amount, sol_amount FROM fills WHERE id > ? ORDER BY id", (after_id,)):
+            rebuilt.setdefault(user_id, Position()).apply(side, token_amount, sol_amount)
+            last_id = fill_id
+        conn.close()
+        return rebuilt, last_id
+
+    async def rebuild_from_ledger(self, apply: bool = False) -> list:
+        """Replay the fill ledger and return users whose stored aggregates disagree with it.
+
+        The bulk replay runs in a worker thread; the tail of fills logged meanwhile is
+        folded in on the event loop, so the comparison (and any fix) sees exactly the
+        fills log_fill has already applied to self.positions.
+        """
+        rebuilt, last_id = await asyncio.to_thread(self.replay_ledger)
+        self.replay_ledger(rebuilt, last_id)
+
+        mismatches = []
+        for user_id in rebuilt.keys() | self.positions.keys():
+            expected, stored = rebuilt.get(user_id, Position()), self.get(user_id)
+            if any(abs(a - b) > 1e-9 for a, b in zip(expected.as_tuple(), stored.as_tuple())):
+                mismatches.append((user_id, stored, expected))
+
+        if apply and mismatches:
+            conn = sqlite3.connect("trading_bot.db")
+            cursor = conn.cursor()
+            for user_id, _, expected in mismatches:
+                self.save(cursor, user_id, expected)
+                self.positions[user_id] = expected
+            conn.commit()
+            conn.close()
+        return mismatches
+
+
+portfolio = PortfolioBook()
+
+
+# ✅ Ledger export settings
+EXPORT_FIELDS = ("timestamp", "side", "token_amount", "sol_amount", "price", "transaction_id", "batch_id")
+EXPORT_FORMATS = {"csv": "text/csv", "json": "application/json"}
+EXPORT_CHUNK_ROWS = 1000  # Rows pulled from the cursor (and written) per step
+
+
+def parse_export_range(start=None, end=None):
+    """Turn inclusive YYYY-MM-DD bounds into [start, end) timestamp strings (None = open)."""
+    if start:
+        start = datetime.datetime.strptime(start, "%Y-%m-%d").strftime("%Y-%m-%d")
+    if end:
+        end = (datetime.datetime.strptime(end, "%Y-%m-%d") + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+    return start, end
+
+
+def iter_fills(user_id, start=None, end=None, chunk=EXPORT_CHUNK_ROWS):
+    """Yield a user's fills oldest first, reading the cursor in fixed-size chunks.
+
+    The (user_id, timestamp) index serves both the range filter and the ordering,
+    so SQLite neither scans the table nor sorts the result.
+    """
+    query = f"SELECT {', '.join(EXPORT_FIELDS)} FROM fills WHERE user_id = ?"
+    params = [user_id]
+    if start:
+        query += " AND timestamp >= ?"
+        params.append(start)
+    if end:
+        query += " AND timestamp < ?"
+        params.append(end)
+    query += " ORDER BY timestamp, id"
+
+    conn = sqlite3.connect("trading_bot.db")
+    try:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+def export_chunks(rows, fmt, chunk=EXPORT_CHUNK_ROWS):
+    """Encode fill rows as CSV or a JSON array, one text chunk per `chunk` rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(EXPORT_FIELDS)
+    else:
+        buffer.write("[")
+
+    first = True
+    for count, row in enumerate(rows, 1):
+        if fmt == "csv":
+            writer.writerow(row)
+        else:
+            buffer.write(("" if first else ",") + "\n" + json.dumps(dict(zip(EXPORT_FIELDS, row))))
+            first = False
+        if count % chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if fmt == "json":
+        buffer.write("\n]\n")
+    yield buffer.getvalue()
+
+
+def write_fills_export(user_id, fmt, start=None, end=None):
+    """Stream a user's fills into a temporary file and return (path, row count)."""
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    with tempfile.NamedTemporaryFile("w", suffix=f".{fmt}", delete=False, newline="", encoding="utf-8") as f:
+        for text in export_chunks(counted(iter_fills(user_id, start, end)), fmt):
+            f.write(text)
+    return f.name, count
 
 
 # ✅ Load wallets securely
-def load_wallets():
+def _wallet_files_stamp():
+    """(mtime, size) of the wallet file and its journal, used to skip redundant reloads."""
+    stamp = []
+    for path in (WALLETS_FILE, WALLET_JOURNAL_FILE):
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def _read_wallet_journal() -> dict:
+    """Replay per-wallet records appended since the last full save."""
+    records = {}
+    if not os.path.exists(WALLET_JOURNAL_FILE):
+        return records
+    with open(WALLET_JOURNAL_FILE, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(cipher.decrypt(line.strip()))
+            except Exception:
+                logging.warning("⚠️ Ignoring unreadable record at the end of the wallet journal")
+                break
+            records[record["user_id"]] = record["wallet"]
+    return records
+
+
+@traced
+def load_wallets(force=False):
     """Load and upgrade wallet format if needed, handling corrupted files."""
-    global user_wallets
+    global user_wallets, _wallets_stamp
     try:
         with lock:
+            stamp = _wallet_files_stamp()
+            if not force and stamp == _wallets_stamp:
+                return  # ✅ Nothing changed on disk since the last load
+            if stamp == (None, None):
+                return
+
+            raw_wallets = {}
             if os.path.exists(WALLETS_FILE):
                 with open(WALLETS_FILE, "rb") as f:
                     encrypted = f.read()
@@ -221,62 +2373,176 @@ def load_wallets():
                 except json.JSONDecodeError:
                     logging.error("🚨 Wallet data corrupted. Resetting to empty wallets.")
                     raw_wallets = {}
+            raw_wallets.update(_read_wallet_journal())
+
+            # ✅ Validate wallet structure
+            valid_wallets = {}
+            for user_id, record in raw_wallets.items():
+                try:
+                    valid_wallets[user_key(user_id)] = UserWallet.from_record(record)
+                except (KeyError, TypeError, ValueError):
+                    logging.warning(f"⚠️ Wallet for {user_id} is missing fields and was skipped.")
 
-                # ✅ Validate wallet structure
-                valid_wallets = {}
-                for user_id, wallet in raw_wallets.items():
-                    if all(k in wallet for k in ["address", "encrypted_key"]):
-                        valid_wallets[user_id] = {
-                            "address": wallet["address"],
-                            "encrypted_key": wallet["encrypted_key"],
-                            "sol_balance": wallet.get("sol_balance", 0.0),
-                            "token_balance": wallet.get("token_balance", 0.0),
-                            "transactions": wallet.get("transactions", [])
-                        }
-                    else:
-                        logging.warning(f"⚠️ Wallet for {user_id} is missing fields and was skipped.")
-
-                user_wallets = valid_wallets
-                logging.info(f"✅ Loaded wallets: {len(user_wallets)} users")
+            user_wallets = valid_wallets
+            _wallets_stamp = stamp
+            logging.info(f"✅ Loaded wallets: {len(user_wallets)} users")
 
     except Exception as e:
         logging.error(f"🚨 Wallet load failed: {str(e)}")
 
 # ✅ Securely save wallets
+@traced
 def save_wallets():
+    """Rewrite the full wallet file and truncate the journal it now contains."""
+    global _wallets_stamp
     try:
         with lock:
             temp_file = WALLETS_FILE + ".tmp"
-            encrypted = cipher.encrypt(json.dumps(user_wallets).encode())
+            encrypted = cipher.encrypt(json.dumps({uid: wallet.to_record() for uid, wallet in user_wallets.items()}).encode())
 
             with open(temp_file, "wb") as f:
                 f.write(encrypted)
+                f.flush()
+                os.fsync(f.fileno())
 
             os.replace(temp_file, WALLETS_FILE)
+            open(WALLET_JOURNAL_FILE, "wb").close()
+            _wallets_stamp = _wallet_files_stamp()
     except Exception as e:
         logging.error(f"🚨 Wallet save failed: {str(e)}")
 
 
+@traced
+def append_wallet_record(user_id: str, wallet: UserWallet):
+    """Persist one wallet as a single encrypted journal line instead of rewriting every wallet."""
+    global _wallets_stamp
+    try:
+        with lock:
+            in_sync = _wallet_files_stamp() == _wallets_stamp  # No other process wrote since our last load
+            with open(WALLET_JOURNAL_FILE, "ab") as f:
+                f.write(cipher.encrypt(json.dumps({"user_id": user_id, "wallet": wallet.to_record()}).encode()) + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if in_sync:
+                _wallets_stamp = _wallet_files_stamp()
+            if os.path.getsize(WALLET_JOURNAL_FILE) > WALLET_JOURNAL_COMPACT_BYTES:
+                save_wallets()
+    except Exception as e:
+        logging.error(f"🚨 Wallet record write failed: {str(e)}")
+
+
+# ✅ Wallet pool settings
+WALLET_POOL_FILE = "wallet_pool.jsonl"
+WALLET_POOL_SIZE = int(os.getenv("WALLET_POOL_SIZE", 500))  # Pre-generated wallets kept in reserve
+WALLET_POOL_BATCH = 50  # Wallets generated (and fsynced) per refill step
+
+
+class WalletPool:
+    """Reserve of pre-generated, pre-encrypted wallets refilled by a background thread.
+
+    Records are appended to WALLET_POOL_FILE with the private key already Fernet-encrypted,
+    so the file carries the same protection as the wallet store. A record counts as
+    claimed once it is in the wallet store; on load those are filtered out, so a crash
+    between claim and save never hands one keypair to two users.
+    """
+    def __init__(self, path=WALLET_POOL_FILE, size=WALLET_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.low_water = max(1, size // 4)
+        self.reserve = deque()
+        self.file_records = 0
+        self.file_lock = threading.Lock()
+        self.refill_needed = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.stats = {"generated": 0, "claimed": 0, "misses": 0}
+
+    @staticmethod
+    def generate() -> dict:
+        keypair = Keypair()
+        return {"address": str(keypair.pubkey()), "encrypted_key": cipher.encrypt(keypair.to_bytes()).decode()}
+
+    def _write(self, records: list, mode: str):
+        with self.file_lock:
+            with open(self.path, mode, encoding="utf-8") as f:
+                f.writelines(json.dumps(record) + "\n" for record in records)
+                f.flush()
+                os.fsync(f.fileno())
+            self.file_records = len(records) if mode == "w" else self.file_records + len(records)
+
+    def load(self, claimed_addresses: set):
+        """Restore unclaimed records from disk and rewrite the file without the claimed ones."""
+        seen = set(claimed_addresses)
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # Torn tail from a crash mid-append
+                    if record["address"] not in seen:
+                        seen.add(record["address"])
+                        self.reserve.append(record)
+        self._write(list(self.reserve), "w")
+
+    def _refill(self):
+        while not self.stopping.is_set():
+            while len(self.reserve) < self.size and not self.stopping.is_set():
+                batch = [self.generate() for _ in range(WALLET_POOL_BATCH)]
+                self._write(batch, "a")
+                self.reserve.extend(batch)
+                self.stats["generated"] += len(batch)
+            if self.file_records > 4 * self.size:
+                self._write(list(self.reserve), "w")  # Compact; records claimed meanwhile are filtered on load
+            self.refill_needed.wait()
+            self.refill_needed.clear()
+
+    def start(self, claimed_addresses: set):
+        self.load(claimed_addresses)
+        self.thread = threading.Thread(target=self._refill, name="wallet-pool", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.refill_needed.set()
+
+    def claim(self) -> UserWallet:
+        """Take a wallet in O(1); generates inline only if the reserve has run dry."""
+        try:
+            record = self.reserve.popleft()
+            self.stats["claimed"] += 1
+        except IndexError:
+            record = self.generate()
+            self.stats["misses"] += 1
+        if len(self.reserve) < self.low_water:
+            self.refill_needed.set()
+        return UserWallet(record["address"], record["encrypted_key"])
+
+    def release(self, wallet: UserWallet):
+        """Return an unused claim to the front of the reserve."""
+        self.reserve.appendleft({"address": wallet.address, "encrypted_key": wallet.encrypted_key})
+
+
+wallet_pool = WalletPool()
+
+
 async def get_sol_balance(wallet_address: str) -> float:
     """Fetch SOL balance securely with error handling and retries."""
     load_wallets()
     
-    for attempt in range(3):  # Retry up to 3 times
-        try:
-            response = await solana_client.get_balance(Pubkey.from_string(wallet_address))
-            
-            # ✅ Ensure response is valid before processing
-            if response and isinstance(response.value, int):
-                return response.value / 1e9  # Convert lamports to SOL
+    try:
+        response = await resilient_call("rpc", solana_client.get_balance, Pubkey.from_string(wallet_address), idempotent=True)
 
-            logger.warning(f"⚠️ Unexpected balance response: {response}")
+        # ✅ Ensure response is valid before processing
+        if response and isinstance(response.value, int):
+            return response.value / 1e9  # Convert lamports to SOL
 
-        except Exception as e:
-            logger.error(f"⚠️ Attempt {attempt + 1}: Balance check failed for {wallet_address} - {str(e)}")
-            await asyncio.sleep(1)  # Short delay before retrying
+        logger.warning(f"⚠️ Unexpected balance response: {response}")
+
+    except Exception as e:
+        logger.error(f"⚠️ Balance check failed for {wallet_address} - {str(e)}")
 
-    logger.warning(f"❌ Failed to fetch balance for {wallet_address} after 3 attempts.")
-    return 0.0  # Return 0 SOL if all retries fail
+    return 0.0  # Return 0 SOL if the call fails
 
 # # ✅ Fetch SOL balance securely with retries
 # async def get_sol_balance(wallet_address: str) -> float:
@@ -320,20 +2586,28 @@ async def get_sol_balance(wallet_address: str) -> float:
 #         return 0.0
 
 
-async def get_token_balance(wallet_address: str) -> float:
-    """Fetch token balance securely."""
-    try:
-        wallet_pubkey = Pubkey.from_string(wallet_address)
-        response = await solana_client.get_token_accounts_by_owner(wallet_pubkey)
+@functools.lru_cache(maxsize=65536)
+def associated_token_address(owner: Pubkey, mint: Pubkey = TOKEN_MINT_PUBKEY) -> Pubkey:
+    """Derive the owner's ATA locally (PDA search, no RPC) and memoize it per (owner, mint)."""
+    return get_associated_token_address(owner, mint)
 
-        # ✅ Check response structure before accessing values
-        if response and "result" in response and "value" in response["result"]:
-            accounts = response["result"]["value"]
-            if accounts:
-                return float(accounts[0]["account"]["data"]["parsed"]["info"]["tokenAmount"]["uiAmount"])
 
-        logging.warning(f"⚠️ No token balance found for {wallet_address}")
-        return 0.0  # Return zero if no balance found
+def token_amount_from_account(account) -> float:
+    """UI amount held by a raw SPL token account (layout: mint 32 | owner 32 | amount u64 LE)."""
+    if account is None:
+        return 0.0
+    return int.from_bytes(bytes(account.data)[64:72], "little") / 10**TOKEN_DECIMALS
+
+
+async def get_token_balance(wallet_address: str) -> float:
+    """Fetch the TOKEN_MINT balance by reading the wallet's derived ATA directly."""
+    try:
+        ata = associated_token_address(Pubkey.from_string(wallet_address))
+        response = await resilient_call("rpc", solana_client.get_account_info, ata, idempotent=True)
+        if response.value is None:
+            return 0.0  # ✅ No ATA yet: the wallet has never held the token
+        token_accounts.known.add(ata)
+        return token_amount_from_account(response.value)
 
     except Exception as e:
         logging.error(f"🚨 Token balance retrieval error: {str(e)}")
@@ -349,9 +2623,9 @@ async def update_wallet_balances(user_id: str):
 
     wallet = user_wallets[user_id]
     try:
-        wallet["sol_balance"] = await get_sol_balance(wallet["address"])
-        wallet["token_balance"] = await get_token_balance(wallet["address"])
-        save_wallets()
+        wallet.sol_balance = await get_sol_balance(wallet.address)
+        wallet.token_balance = await get_token_balance(wallet.address)
+        append_wallet_record(user_id, wallet)
     except Exception as e:
         logger.error(f"⚠️ Balance update failed: {str(e)}")
 
@@ -359,124 +2633,1515 @@ async def update_wallet_balances(user_id: str):
 
 
 
+# ✅ Preflight settings
+KEYPAIR_CACHE_SECONDS = 300      # How long a decrypted signing key stays in memory after use
+KEYPAIR_CACHE_SIZE = 1024
+SIMULATION_CACHE_SECONDS = 30    # How long a preflight verdict is reused for the same wallet, route and size
+DOOMED_SIMULATION_MARKERS = (    # Failures that will repeat until the wallet's state changes
+    "InsufficientFunds", "insufficient funds", "insufficient lamports", "AccountNotFound", "InvalidAccountData"
+)
+
+
+class KeypairCache:
+    """Decrypted keypairs for recently active wallets, so signing skips the Fernet decrypt."""
+    def __init__(self, ttl=KEYPAIR_CACHE_SECONDS, size=KEYPAIR_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()  # address -> (keypair, expires_at)
+
+    @traced
+    def get(self, wallet: UserWallet) -> Keypair:
+        now = time.monotonic()
+        entry = self.entries.get(wallet.address)
+        if entry and entry[1] > now:
+            self.entries.move_to_end(wallet.address)
+            return entry[0]
+
+        secret = cipher.decrypt(wallet.encrypted_key.encode())
+        keypair = Keypair.from_bytes(secret) if len(secret) == 64 else Keypair.from_base58_string(secret.decode())
+        self.entries[wallet.address] = (keypair, now + self.ttl)
+        self.entries.move_to_end(wallet.address)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return keypair
+
+
+keypair_cache = KeypairCache()
+
+
+def load_user_keypair(wallet: UserWallet) -> Keypair:
+    """Decrypt a custodial keypair stored either as raw bytes or as a base58 string."""
+    return keypair_cache.get(wallet)
+
+
+class SimulationCache:
+    """Recent preflight verdicts per (wallet, route, size bucket).
+
+    Size buckets are powers of two of the input amount, so an order of a similar size
+    on the same route reuses the verdict: a recent pass skips the simulation round trip,
+    a recent doomed failure is rejected before even requesting a quote.
+    """
+    def __init__(self, ttl=SIMULATION_CACHE_SECONDS):
+        self.ttl = ttl
+        self.verdicts = {}  # key -> (error or None, expires_at)
+        self.stats = {"simulated": 0, "rejected": 0, "cache_hits": 0, "cache_rejects": 0}
+
+    @staticmethod
+    def key(owner: str, is_buy: bool, base_units: int) -> tuple:
+        return owner, is_buy, max(int(base_units), 1).bit_length()
+
+    def get(self, key):
+        """(True, None) for a fresh pass, (True, error) for a fresh doomed failure, (False, None) otherwise."""
+        verdict = self.verdicts.get(key)
+        if verdict is None:
+            return False, None
+        if verdict[1] < time.monotonic():
+            del self.verdicts[key]
+            return False, None
+        return True, verdict[0]
+
+    def put(self, key, error=None):
+        if len(self.verdicts) > 10_000:  # Drop expired entries before the map grows without bound
+            now = time.monotonic()
+            self.verdicts = {k: v for k, v in self.verdicts.items() if v[1] >= now}
+        self.verdicts[key] = (error, time.monotonic() + self.ttl)
+
+
+simulation_cache = SimulationCache()
+
+
+def simulation_error(response) -> str:
+    """Readable failure reason from a simulateTransaction response, or None if it would succeed."""
+    result = response.value
+    if result.err is None:
+        return None
+    logs = [line for line in (result.logs or []) if "rror" in line or "insufficient" in line]
+    return f"{result.err}" + (f" ({logs[-1]})" if logs else "")
+
+
+class LookupTableCache:
+    """Address lookup table contents by table address, fetched once and reused across swaps.
+
+    Tables are append-only while active, so a cached copy that misses newly added
+    addresses only makes a transaction slightly larger (those keys stay static).
+    """
+    def __init__(self, ttl=ALT_CACHE_TTL):
+        self.ttl = ttl
+        self.tables = {}  # address -> (AddressLookupTableAccount, expires_at)
+        self.stats = {"hits": 0, "fetched": 0, "missing": 0}
+
+    async def get(self, addresses: list) -> list:
+        now = time.monotonic()
+        stale = [a for a in dict.fromkeys(addresses) if a not in self.tables or self.tables[a][1] <= now]
+        self.stats["hits"] += len(addresses) - len(stale)
+        for i in range(0, len(stale), 100):  # getMultipleAccounts takes at most 100 keys
+            chunk = stale[i:i + 100]
+            response = await resilient_call("rpc", solana_client.get_multiple_accounts,
+                                            [Pubkey.from_string(a) for a in chunk], idempotent=True)
+            for address, account in zip(chunk, response.value):
+                if account is None:
+                    self.stats["missing"] += 1
+                    self.tables.pop(address, None)
+                    logger.warning(f"⚠️ Address lookup table {address} not found")
+                    continue
+                table = AddressLookupTable.deserialize(bytes(account.data))
+                self.tables[address] = (AddressLookupTableAccount(Pubkey.from_string(address), list(table.addresses)), now + self.ttl)
+                self.stats["fetched"] += 1
+        return [self.tables[a][0] for a in addresses if a in self.tables]
+
+
+lookup_tables = LookupTableCache()
+
+
+def jupiter_instruction(ix: dict) -> Instruction:
+    """Instruction from Jupiter's /swap-instructions JSON shape."""
+    accounts = [AccountMeta(Pubkey.from_string(a["pubkey"]), a["isSigner"], a["isWritable"]) for a in ix["accounts"]]
+    return Instruction(Pubkey.from_string(ix["programId"]), base64.b64decode(ix["data"]), accounts)
+
+
+async def build_swap_message(quote: dict, payer: Pubkey):
+    """Message to sign for a quote: Jupiter's serialized transaction (legacy or v0) as is,
+    or a v0 message compiled from its swap instructions against cached lookup tables."""
+    if "tx" in quote:
+        return VersionedTransaction.from_bytes(base64.b64decode(quote["tx"])).message
+
+    parts = [*quote.get("computeBudgetInstructions", ()), *quote.get("setupInstructions", ()), quote["swapInstruction"]]
+    if quote.get("cleanupInstruction"):
+        parts.append(quote["cleanupInstruction"])
+    tables, latest = await asyncio.gather(
+        lookup_tables.get(quote.get("addressLookupTableAddresses", [])),
+        resilient_call("rpc", solana_client.get_latest_blockhash, idempotent=True)
+    )
+    return MessageV0.try_compile(payer, [jupiter_instruction(ix) for ix in parts], tables, latest.value.blockhash)
+
+
+@traced
+async def request_swap_quote(is_buy: bool, amount: float, owner: str) -> dict:
+    """Request a Jupiter quote with either a serialized swap transaction or its instructions for `owner`."""
+    params = {
+        "inputMint": SOL_MINT if is_buy else TOKEN_MINT,
+        "outputMint": TOKEN_MINT if is_buy else SOL_MINT,
+        "amount": int(amount * (10**9 if is_buy else 10**TOKEN_DECIMALS)),
+        "slippageBps": 100,  # 1% slippage
+        "userPublicKey": owner,
+        "asLegacyTransaction": "false"  # ✅ v0 + lookup tables: multi-hop routes fit in one transaction
+    }
+
+    headers = {"Authorization": f"Bearer {os.getenv('JUPITER_API_KEY')}"} if os.getenv("JUPITER_API_KEY") else {}
+
+    async def fetch():
+        async with httpx.AsyncClient() as client:
+            response = await client.get(JUPITER_API, params=params, headers=headers, timeout=10)
+            response.raise_for_status()
+            return response.json()
+
+    quote = await resilient_call("jupiter", fetch, idempotent=True)
+    if "tx" not in quote and "swapInstruction" not in quote:
+        raise ValueError("Invalid API response: neither 'tx' nor 'swapInstruction' present")
+    return quote
+
+
+def quote_out_amount(quote: dict, is_buy: bool) -> float:
+    """Output amount of a quote in UI units (tokens for buys, SOL for sells)."""
+    return float(quote.get("outAmount", 0)) / (10**TOKEN_DECIMALS if is_buy else 1e9)
+
+
+def sign_swap_transaction(message, keypair: Keypair) -> VersionedTransaction:
+    """Sign a legacy or v0 swap message; the user is its only signer (and fee payer)."""
+    return VersionedTransaction(message, [keypair])
+
+
+@traced
+async def send_swap_transaction(quote: dict, keypair: Keypair, preflight_key=None) -> dict:
+    """Simulate the quoted swap while signing it, then submit it with blockhash retries.
+
+    Orders that fail simulation are rejected without touching the send path. A recent
+    passing verdict for `preflight_key` skips the simulation; if the simulation call
+    itself fails the order proceeds (fail open).
+    """
+    message = await build_swap_message(quote, keypair.pubkey())
+    cached, _ = simulation_cache.get(preflight_key) if preflight_key else (False, None)
+
+    if cached:
+        simulation_cache.stats["cache_hits"] += 1
+        transaction = sign_swap_transaction(message, keypair)
+    else:
+        unsigned = VersionedTransaction.populate(message, [Signature.default()] * message.header.num_required_signatures)
+        simulation, transaction = await asyncio.gather(
+            resilient_call("rpc", solana_client.simulate_transaction, unsigned,
+                           replace_recent_blockhash=True, idempotent=True),
+            asyncio.to_thread(sign_swap_transaction, message, keypair),
+            return_exceptions=True
+        )
+        if isinstance(transaction, BaseException):
+            raise transaction
+        if isinstance(simulation, BaseException):
+            logger.warning(f"⚠️ Preflight simulation unavailable, submitting anyway: {str(simulation)}")
+        else:
+            simulation_cache.stats["simulated"] += 1
+            error = simulation_error(simulation)
+            doomed = error is not None and any(marker in error for marker in DOOMED_SIMULATION_MARKERS)
+            if preflight_key and (error is None or doomed):
+                simulation_cache.put(preflight_key, error)  # Slippage-style failures are not cached: a re-quote may pass
+            if error is not None:
+                simulation_cache.stats["rejected"] += 1
+                logger.warning(f"🛑 Preflight rejected swap: {error}")
+                return {"status": "error", "message": f"Swap would fail: {error}"}
+
+    # ✅ Only an expired blockhash guarantees the transaction did not land, so only that is retried
+    result = await resilient_call(
+        "rpc", solana_client.send_transaction, transaction,
+        retry_on=lambda e: "Blockhash" in str(e)
+    )
+    return {"status": "success", "txid": str(result.value)}
+
+
+@traced
 async def execute_swap(user_id: str, is_buy: bool, amount: float) -> dict:
     """Execute DEX swap using Jupiter API with error handling"""
+    async with inflight.lock(user_id):  # ✅ One swap per wallet at a time
+        return await _execute_swap(user_id, is_buy, amount)
+
+
+async def _execute_swap(user_id: str, is_buy: bool, amount: float) -> dict:
     try:
         wallet = user_wallets.get(user_id)
         if not wallet:
             return {"status": "error", "message": "Wallet not found"}
 
-        params = {
-            "inputMint": TOKEN_MINT if is_buy else "So11111111111111111111111111111111111111112",
-            "outputMint": "So11111111111111111111111111111111111111112" if is_buy else TOKEN_MINT,
-            "amount": int(amount * (10**9 if is_buy else 10**TOKEN_DECIMALS)),
-            "slippageBps": 100  # 1% slippage
-        }
-
-        headers = {"Authorization": f"Bearer {os.getenv('JUPITER_API_KEY')}"} if os.getenv("JUPITER_API_KEY") else {}
-        response = requests.get(JUPITER_API, params=params, headers=headers)
-        response.raise_for_status()
+        # ✅ A wallet that just failed preflight on this route and size is rejected before quoting
+        preflight_key = simulation_cache.key(wallet.address, is_buy, amount * (1e9 if is_buy else 10**TOKEN_DECIMALS))
+        cached, error = simulation_cache.get(preflight_key)
+        if cached and error:
+            simulation_cache.stats["cache_rejects"] += 1
+            return {"status": "error", "message": f"Swap would fail: {error}"}
 
         # ✅ Handle missing or incorrect API response
         try:
-            quote = response.json()
-            if "tx" not in quote:
-                raise ValueError("Invalid API response: 'tx' field missing")
+            quote = await request_swap_quote(is_buy, amount, wallet.address)
         except (ValueError, KeyError, json.JSONDecodeError) as e:
             logger.error(f"🚨 API response error: {str(e)}")
             return {"status": "error", "message": "Failed to get swap transaction"}
 
-        transaction = Transaction.deserialize(base64.b64decode(quote["tx"]))
-        keypair = Keypair.from_base58_string(cipher.decrypt(wallet["encrypted_key"].encode()).decode())
-        transaction.sign(keypair)
+        result = await send_swap_transaction(quote, load_user_keypair(wallet), preflight_key)
 
-        # ✅ Execute transaction with retries
-        for attempt in range(3):
-            try:
-                result = await solana_client.send_transaction(transaction)
-                return {"status": "success", "txid": result.value}
-            except Exception as e:
-                if "Blockhash" in str(e):
-                    await asyncio.sleep(1)
-                    continue
-                raise
+        if result["status"] == "success":
+            out_amount = quote_out_amount(quote, is_buy)
+            token_amount, sol_amount = (out_amount, amount) if is_buy else (amount, out_amount)
+            log_fill(user_id, "buy" if is_buy else "sell", token_amount, sol_amount, result["txid"])
+            lifecycle.watch(result["txid"], user_id, "buy" if is_buy else "sell")  # Journaled before anything can drop it
+            await event_bus.publish(TxSubmitted(user_id, "buy" if is_buy else "sell", result["txid"]))
+            wallet.record_transaction(result["txid"])
+            append_wallet_record(user_id, wallet)
+            result["out_amount"] = out_amount
 
-        return {"status": "error", "message": "Transaction failed after 3 attempts"}
+        return result
 
     except Exception as e:
         logger.error(f"🚨 Swap error: {str(e)}")
         return {"status": "error", "message": str(e)}
 
 
-async def handle_sell_now(user_id):
-    """Automatically execute a sell when target price is reached."""
+TX_EXPIRY_SECONDS = 180      # An unseen transaction this old can no longer land (its blockhash has expired)
+TX_OUTCOME_TIMEOUT = 300     # Seconds confirm_outcome keeps polling through RPC errors before giving up
+TX_POLL_SECONDS = 1
+PAYOUT_RECONCILE_SECONDS = 30
+
+
+@traced
+async def submit_instructions(instructions: list, signers: list, confirm: bool = True) -> str:
+    """Build a transaction paid by the bot wallet, sign it with `signers` and submit it.
+
+    With BOT_LOOKUP_TABLES configured the transaction is v0 and repeated keys (mint,
+    token program, bot ATA) are table indexes instead of 32-byte addresses.
+    """
+    latest, tables = await asyncio.gather(
+        resilient_call("rpc", solana_client.get_latest_blockhash, idempotent=True),
+        lookup_tables.get(BOT_LOOKUP_TABLES)
+    )
+    blockhash = latest.value.blockhash
+    if tables:
+        transaction = VersionedTransaction(MessageV0.try_compile(bot_wallet.pubkey(), instructions, tables, blockhash), [bot_wallet, *signers])
+    else:
+        message = Message.new_with_blockhash(instructions, bot_wallet.pubkey(), blockhash)
+        transaction = Transaction([bot_wallet, *signers], message, blockhash)
+
+    sent_at = time.time()
+    result = await resilient_call("rpc", solana_client.send_transaction, transaction, retry_on=lambda e: False)
+    if confirm:
+        await confirm_outcome(str(result.value), sent_at)
+    return str(result.value)
+
+
+async def confirm_outcome(txid: str, sent_at: float):
+    """Wait until a sent transaction's fate is known.
+
+    Returns once it is confirmed without error. Raises TransactionFailedError if it
+    failed on-chain or is still unseen TX_EXPIRY_SECONDS after sending (its blockhash
+    has expired, so it can no longer land), and TxOutcomeUnknown if RPC errors keep
+    the answer out of reach for TX_OUTCOME_TIMEOUT. Unlike confirm_transaction, a
+    landed-but-failed transaction is never reported as confirmed.
+    """
+    signature = Signature.from_string(txid)
+    confirmed = (TransactionConfirmationStatus.Confirmed, TransactionConfirmationStatus.Finalized)
+    deadline = time.monotonic() + TX_OUTCOME_TIMEOUT
+    while True:
+        try:
+            response = await solana_client.get_signature_statuses([signature], search_transaction_history=True)
+            status = response.value[0]
+            if status is not None and status.confirmation_status in confirmed:
+                if status.err is not None:
+                    raise TransactionFailedError(f"{txid} failed on-chain: {status.err}")
+                return
+            if status is None and time.time() - sent_at > TX_EXPIRY_SECONDS:
+                raise TransactionFailedError(f"{txid} expired without landing")
+        except TransactionFailedError:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ Status check for {txid} failed: {str(e)}")
+        if time.monotonic() > deadline:
+            raise TxOutcomeUnknown(txid)
+        await asyncio.sleep(TX_POLL_SECONDS)
+
+
+async def reconcile_pending_payouts():
+    """Resolve 'unconfirmed' payouts once their transaction has landed or been dropped.
+
+    A row written with owed_if="landed" becomes 'pending' (owed) if the transaction
+    landed and 'void' if it was dropped; owed_if="dropped" is the reverse.
+    """
+    confirmed = (TransactionConfirmationStatus.Confirmed, TransactionConfirmationStatus.Finalized)
+    while True:
+        try:
+            conn = sqlite3.connect("trading_bot.db")
+            try:
+                rows = conn.execute("""
+                    SELECT id, txid, owed_if, (julianday('now') - julianday(created_at)) * 86400
+                    FROM pending_payouts WHERE status = 'unconfirmed'
+                """).fetchall()
+            finally:
+                conn.close()
+            txids = list(dict.fromkeys(row[1] for row in rows))[:256]
+            outcomes = {}
+            if txids:
+                response = await solana_client.get_signature_statuses(
+                    [Signature.from_string(t) for t in txids], search_transaction_history=True
+                )
+                for txid, status in zip(txids, response.value):
+                    if status is not None and status.confirmation_status in confirmed:
+                        outcomes[txid] = "dropped" if status.err else "landed"
+                    elif status is None:
+                        outcomes[txid] = None  # Decided below from the row's age
+            settled = []
+            for row_id, txid, owed_if, age in rows:
+                if txid not in outcomes:
+                    continue
+                outcome = outcomes[txid] or ("dropped" if age > TX_EXPIRY_SECONDS else None)
+                if outcome:
+                    settled.append(("pending" if outcome == owed_if else "void", row_id))
+            if settled:
+                conn = sqlite3.connect("trading_bot.db")
+                try:
+                    conn.executemany("UPDATE pending_payouts SET status = ? WHERE id = ?", settled)
+                    conn.commit()
+                finally:
+                    conn.close()
+                owed = sum(1 for status, _ in settled if status == "pending")
+                logger.warning(f"⚠️ Reconciled {len(settled)} unconfirmed payouts, {owed} now owed")
+        except Exception as e:
+            logger.error(f"Payout reconciliation error: {str(e)}")
+        await asyncio.sleep(PAYOUT_RECONCILE_SECONDS)
+
+
+def token_transfer_ix(source_owner: Pubkey, dest_owner: Pubkey, base_units: int):
+    """SPL transfer of TOKEN_MINT between the associated token accounts of two owners."""
+    mint = TOKEN_MINT_PUBKEY
+    return transfer_checked(TransferCheckedParams(
+        program_id=TOKEN_PROGRAM_ID,
+        source=associated_token_address(source_owner, mint),
+        mint=mint,
+        dest=associated_token_address(dest_owner, mint),
+        owner=source_owner,
+        amount=base_units,
+        decimals=TOKEN_DECIMALS
+    ))
+
+
+# ✅ ATA provisioning settings
+ATA_BATCH_WINDOW = 5.0      # Seconds to collect owners before creating their token accounts
+ATA_CREATES_PER_TX = 10     # Idempotent ATA creations packed into one bot-paid transaction
+ACCOUNTS_PER_LOOKUP = 100   # getMultipleAccounts limit
+ATA_KNOWN_MAX = int(os.getenv("ATA_KNOWN_MAX", 50_000))  # Existing ATAs remembered; forgotten ones are just re-checked
+
+
+class KnownAccounts:
+    """Bounded set of account addresses, evicting the least recently seen past `size`."""
+    def __init__(self, size=ATA_KNOWN_MAX):
+        self.size = size
+        self.entries = OrderedDict()  # address -> None
+
+    def __contains__(self, address) -> bool:
+        if address in self.entries:
+            self.entries.move_to_end(address)
+            return True
+        return False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, address):
+        self.entries[address] = None
+        self.entries.move_to_end(address)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def update(self, addresses):
+        for address in addresses:
+            self.add(address)
+
+
+class TokenAccountProvisioner:
+    """Creates missing TOKEN_MINT ATAs for many owners in packed transactions, off the fill path.
+
+    Owners are queued when they place a buy order (wallets that never buy never pay
+    rent for one); one background task checks them with getMultipleAccounts and
+    creates only the missing accounts. Recently seen ATAs are remembered, so payouts
+    can skip the create instruction.
+    """
+    def __init__(self):
+        self.known = KnownAccounts()  # ATAs known to exist (bounded)
+        self.queued = set()   # Owners waiting for the next batch
+        self.wakeup = asyncio.Event()
+        self.stats = {"checked": 0, "created": 0, "transactions": 0}
+
+    def request(self, owner):
+        owner = Pubkey.from_string(owner) if isinstance(owner, str) else owner
+        if associated_token_address(owner) not in self.known:
+            self.queued.add(owner)
+            self.wakeup.set()
+
+    async def ensure(self, owners: list) -> int:
+        """Create the ATAs that don't exist yet; returns how many were created."""
+        pending = [(owner, associated_token_address(owner)) for owner in owners]
+        pending = [(owner, ata) for owner, ata in pending if ata not in self.known]
+
+        missing = []
+        for i in range(0, len(pending), ACCOUNTS_PER_LOOKUP):
+            chunk = pending[i:i + ACCOUNTS_PER_LOOKUP]
+            response = await resilient_call("rpc", solana_client.get_multiple_accounts, [ata for _, ata in chunk], idempotent=True)
+            self.stats["checked"] += len(chunk)
+            for (owner, ata), account in zip(chunk, response.value):
+                if account is None:
+                    missing.append((owner, ata))
+                else:
+                    self.known.add(ata)
+
+        async def create_chunk(chunk):
+            instructions = [create_idempotent_associated_token_account(bot_wallet.pubkey(), owner, TOKEN_MINT_PUBKEY) for owner, _ in chunk]
+            try:
+                await submit_instructions(instructions, [])
+            except Exception as e:
+                logger.error(f"🚨 ATA creation failed for {len(chunk)} owners: {str(e)}")
+                return 0
+            self.known.update(ata for _, ata in chunk)
+            self.stats["transactions"] += 1
+            return len(chunk)
+
+        chunks = [missing[i:i + ATA_CREATES_PER_TX] for i in range(0, len(missing), ATA_CREATES_PER_TX)]
+        created = sum(await asyncio.gather(*(create_chunk(chunk) for chunk in chunks)))
+        self.stats["created"] += created
+        return created
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(ATA_BATCH_WINDOW)  # Let a burst of sign-ups land in the same batch
+            self.wakeup.clear()
+            owners, self.queued = list(self.queued), set()
+            try:
+                await self.ensure(owners)
+            except Exception as e:
+                logger.error(f"🚨 ATA provisioning error: {str(e)}")
+                self.queued.update(owners)  # Retry with the next batch
+
+
+token_accounts = TokenAccountProvisioner()
+
+
+async def handle_sell_now(user_id, amount=None, reason="target"):
+    """Automatically execute a sell when a target or stop order triggers."""
     if user_id not in user_wallets:
         logging.warning(f"User {user_id} does not have a wallet.")
         return
 
     wallet = user_wallets[user_id]
-    user_balance = await get_token_balance(wallet["address"])
+    user_balance = await get_token_balance(wallet.address)
 
     if user_balance <= 0:
         logging.warning(f"User {user_id} has no tokens to sell.")
         return
 
-    sell_amount = user_balance  # Selling full balance
-    target_price = user_sell_targets.get(user_id, None)
+    sell_amount = min(amount, user_balance) if amount else user_balance  # Full balance by default
 
-    if not target_price:
+    if reason == "target" and not user_sell_targets.get(user_id):
         logging.warning(f"User {user_id} has no sell target set.")
         return
 
-    result = await execute_swap(user_id, sell_amount)  # ✅ Call execute_sell()
-    
+    result = await swap_aggregator.submit(user_id, False, sell_amount)
+
+    if result["status"] == "success":
+        logging.info(f"✅ Auto-sell ({reason}) successful for {user_id}, TxID: {result['txid']}")
+        messenger.send(user_id, f"✅ Auto-sell ({reason}) executed: {sell_amount} tokens\n📄 TxID: {result['txid']}", PRIORITY_FILL)
+    else:
+        logging.error(f"❌ Auto-sell ({reason}) failed for {user_id}: {result['message']}")
+        messenger.send(user_id, f"❌ Auto-sell ({reason}) failed: {result['message']}", PRIORITY_FILL)
+
+
+async def handle_buy_now(user_id, sol_amount, reason):
+    """Automatically execute a buy of `sol_amount` SOL when an order triggers."""
+    if user_id not in user_wallets:
+        logging.warning(f"User {user_id} does not have a wallet.")
+        return
+
+    result = await swap_aggregator.submit(user_id, True, sol_amount)
+
     if result["status"] == "success":
-        logging.info(f"✅ Auto-sell successful for {user_id}, TxID: {result['txid']}")
+        logging.info(f"✅ Auto-buy ({reason}) successful for {user_id}, TxID: {result['txid']}")
+        messenger.send(user_id, f"✅ Auto-buy ({reason}) executed: {sol_amount} SOL\n📄 TxID: {result['txid']}", PRIORITY_FILL)
     else:
-        logging.error(f"❌ Auto-sell failed for {user_id}: {result['message']}")
+        logging.error(f"❌ Auto-buy ({reason}) failed for {user_id}: {result['message']}")
+        messenger.send(user_id, f"❌ Auto-buy ({reason}) failed: {result['message']}", PRIORITY_FILL)
+
+
+# ✅ Swap batching settings
+SWAP_BATCH_WINDOW = float(os.getenv("SWAP_BATCH_WINDOW", 0.5))  # Seconds to collect triggered orders (0 disables)
+MAX_SIGNERS_PER_TX = 6    # User signatures that fit in one legacy transaction next to the fee payer
+MAX_PAYOUTS_PER_TX = 8    # Payout transfers (plus ATA creation) per bot-signed transaction
+
+
+class SwapAggregator:
+    """Collects same-direction orders triggered within a short window and fills them with one pooled swap.
+
+    Each user's input is moved into the bot wallet (several user signatures packed per
+    transaction), a single Jupiter quote and swap is executed for the aggregate, and the
+    output is paid back pro rata. Every user's share is recorded in the fill ledger.
+    """
+    def __init__(self, window=SWAP_BATCH_WINDOW):
+        self.window = window
+        self.pending = {}  # (is_buy, mint) -> [(user_id, amount, future)]
+        self.stats = {"orders": 0, "batches": 0, "quotes_saved": 0}
+
+    @traced
+    async def submit(self, user_id: str, is_buy: bool, amount: float) -> dict:
+        """Queue an order into the current window and wait for its share of the fill."""
+        if not lifecycle.executing:
+            return {"status": "error", "message": "Bot is restarting, please try again shortly"}
+        if self.window <= 0:
+            return await execute_swap(user_id, is_buy, amount)
+
+        loop = asyncio.get_running_loop()
+        key = (is_buy, TOKEN_MINT)
+        future = loop.create_future()
+        batch = self.pending.setdefault(key, [])
+        batch.append((user_id, amount, future))
+        if len(batch) == 1:
+            loop.call_later(self.window, lambda: lifecycle.track(self.flush(key)))
+        return await future
+
+    async def flush_all(self):
+        """Execute every batch still waiting for its window (used while draining)."""
+        await asyncio.gather(*(self.flush(key) for key in list(self.pending)))
+
+    async def flush(self, key):
+        batch = self.pending.pop(key, [])
+        if not batch:
+            return
+
+        is_buy = key[0]
+        self.stats["orders"] += len(batch)
+
+        if len(batch) == 1:
+            user_id, amount, _ = batch[0]
+            results = [await execute_swap(user_id, is_buy, amount)]
+        else:
+            self.stats["batches"] += 1
+            self.stats["quotes_saved"] += len(batch) - 1
+            try:
+                async with inflight.lock_all(user_id for user_id, _, _ in batch):  # ✅ Same wallet locks as execute_swap
+                    results = await self._execute_pooled(is_buy, batch)
+            except Exception as e:
+                logger.error(f"🚨 Pooled swap error: {str(e)}")
+                results = [{"status": "error", "message": str(e)}] * len(batch)
+
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _collect_ixs(is_buy: bool, owner: Pubkey, units: int) -> list:
+        """Move a user's swap input into the bot wallet."""
+        if is_buy:
+            return [transfer(TransferParams(from_pubkey=owner, to_pubkey=bot_wallet.pubkey(), lamports=units))]
+        return [token_transfer_ix(owner, bot_wallet.pubkey(), units)]
+
+    @staticmethod
+    def _payout_ixs(pays_tokens: bool, dest: Pubkey, units: int) -> list:
+        """Pay tokens (creating the ATA if needed) or SOL from the bot wallet to a user."""
+        if pays_tokens:
+            transfer_ix = token_transfer_ix(bot_wallet.pubkey(), dest, units)
+            if associated_token_address(dest) in token_accounts.known:
+                return [transfer_ix]  # ✅ Pre-provisioned: no create instruction needed
+            return [create_idempotent_associated_token_account(bot_wallet.pubkey(), dest, TOKEN_MINT_PUBKEY), transfer_ix]
+        return [transfer(TransferParams(from_pubkey=bot_wallet.pubkey(), to_pubkey=dest, lamports=units))]
+
+    async def _pay(self, pays_tokens: bool, members: list) -> dict:
+        """Send payouts in packed transactions. Returns {index: txid, None (not paid) or TxOutcomeUnknown}."""
+        async def pay_chunk(chunk):
+            instructions = []
+            for _, owner, units in chunk:
+                instructions += self._payout_ixs(pays_tokens, owner, units)
+            try:
+                txid = await submit_instructions(instructions, [])
+            except TxOutcomeUnknown as e:
+                logger.critical(f"🚨 Payout transaction {e.txid} unconfirmed")
+                txid = e
+            except Exception as e:
+                logger.error(f"🚨 Payout transaction failed: {str(e)}")
+                txid = None
+            return {index: txid for index, _, _ in chunk}
+
+        chunks = [members[i:i + MAX_PAYOUTS_PER_TX] for i in range(0, len(members), MAX_PAYOUTS_PER_TX)]
+        paid = {}
+        for outcome in await asyncio.gather(*(pay_chunk(chunk) for chunk in chunks)):
+            paid.update(outcome)
+        return paid
+
+    def _settle(self, batch_id: str, user_id: str, owner: Pubkey, asset: str, units: int, outcome) -> bool:
+        """Book one payout outcome from _pay; returns True if it was paid."""
+        if isinstance(outcome, TxOutcomeUnknown):
+            log_pending_payout(batch_id, user_id, owner, asset, units, outcome.txid, owed_if="dropped")
+            return False
+        if not outcome:
+            log_pending_payout(batch_id, user_id, owner, asset, units)
+            return False
+        return True
+
+    @staticmethod
+    async def _swap_output(txid: str, is_buy: bool):
+        """Base units the bot wallet actually received in a confirmed swap, from its pre/post balances."""
+        for _ in range(5):  # The confirmed transaction can take a moment to be served
+            try:
+                response = await resilient_call(
+                    "rpc", solana_client.get_transaction, Signature.from_string(txid),
+                    encoding="base64", commitment="confirmed", max_supported_transaction_version=0, idempotent=True
+                )
+                if response.value is not None:
+                    _, lamports, token_units = balance_delta_units(response.value, str(bot_wallet.pubkey()))
+                    return max(token_units if is_buy else lamports, 0)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not load swap {txid}: {str(e)}")
+            await asyncio.sleep(1)
+        return None
+
+    async def _execute_pooled(self, is_buy: bool, batch: list) -> list:
+        batch_id = f"batch-{int(time.time() * 1000)}"
+        in_scale = 1e9 if is_buy else 10**TOKEN_DECIMALS
+        out_scale = 10**TOKEN_DECIMALS if is_buy else 1e9
+        in_asset, out_asset = ("sol", "token") if is_buy else ("token", "sol")
+        results = [None] * len(batch)
+
+        # ✅ Step 1: collect inputs, packing several user signatures per transaction
+        members = []  # (index, keypair, base_units)
+        for index, (user_id, amount, _) in enumerate(batch):
+            wallet = user_wallets.get(user_id)
+            if not wallet:
+                results[index] = {"status": "error", "message": "Wallet not found"}
+                continue
+            members.append((index, load_user_keypair(wallet), int(amount * in_scale)))
+
+        async def collect_chunk(chunk):
+            instructions = []
+            if not is_buy and associated_token_address(bot_wallet.pubkey()) not in token_accounts.known:
+                instructions.append(create_idempotent_associated_token_account(bot_wallet.pubkey(), bot_wallet.pubkey(), TOKEN_MINT_PUBKEY))
+            for _, keypair, units in chunk:
+                instructions += self._collect_ixs(is_buy, keypair.pubkey(), units)
+            try:
+                await submit_instructions(instructions, [keypair for _, keypair, _ in chunk])
+                return chunk
+            except TxOutcomeUnknown as e:
+                # The inputs may already sit in the bot wallet: owe them back if the transfer landed
+                logger.critical(f"🚨 Batch collection {e.txid} unconfirmed; {len(chunk)} refunds depend on it")
+                for index, keypair, units in chunk:
+                    log_pending_payout(batch_id, batch[index][0], keypair.pubkey(), in_asset, units, e.txid, owed_if="landed")
+                    results[index] = {"status": "error", "message": f"Batch transfer unconfirmed; refunded if it landed ({batch_id})"}
+                return []
+            except Exception as e:
+                logger.error(f"🚨 Batch collection failed: {str(e)}")
+                for index, _, _ in chunk:
+                    results[index] = {"status": "error", "message": "Could not reserve funds for the batch"}
+                return []
+
+        chunks = [members[i:i + MAX_SIGNERS_PER_TX] for i in range(0, len(members), MAX_SIGNERS_PER_TX)]
+        collected = [m for done in await asyncio.gather(*(collect_chunk(c) for c in chunks)) for m in done]
+        total_units = sum(units for _, _, units in collected)
+        if not total_units:
+            return [r or {"status": "error", "message": "Nothing to swap"} for r in results]
+
+        # ✅ Step 2: one quote and one swap for the aggregate size
+        quote = None
+        try:
+            quote = await request_swap_quote(is_buy, total_units / in_scale, bot_wallet_pubkey)
+            sent_at = time.time()
+            swap = await send_swap_transaction(quote, bot_wallet)
+            if swap["status"] != "success":
+                raise RuntimeError(swap["message"])
+            lifecycle.watch(swap["txid"], [batch[index][0] for index, _, _ in collected], "buy" if is_buy else "sell")
+            await confirm_outcome(swap["txid"], sent_at)
+        except TxOutcomeUnknown as e:
+            # Neither refund nor pay out blindly: owe the inputs back if the swap was dropped,
+            # or the guaranteed minimum output if it landed, and let reconciliation decide
+            logger.critical(f"🚨 {batch_id}: swap {e.txid} unconfirmed; settlement depends on its outcome")
+            min_out = int(quote.get("otherAmountThreshold") or 0)
+            for index, keypair, units in collected:
+                user_id = batch[index][0]
+                log_pending_payout(batch_id, user_id, keypair.pubkey(), in_asset, units, e.txid, owed_if="dropped")
+                log_pending_payout(batch_id, user_id, keypair.pubkey(), out_asset, min_out * units // total_units, e.txid, owed_if="landed")
+                results[index] = {"status": "error", "message": f"Swap unconfirmed; you will be settled once its outcome is known ({batch_id})"}
+            return results
+        except Exception as e:
+            # The swap did not happen: return the reserved inputs so nobody is left short
+            logger.error(f"🚨 Pooled swap failed, refunding {len(collected)} users: {str(e)}")
+            refunds = [(index, keypair.pubkey(), units) for index, keypair, units in collected]
+            refunded = await self._pay(not is_buy, refunds)
+            for index, owner, units in refunds:
+                if self._settle(batch_id, batch[index][0], owner, in_asset, units, refunded.get(index)):
+                    results[index] = {"status": "error", "message": "Swap failed, funds returned"}
+                else:
+                    results[index] = {"status": "error", "message": f"Swap failed, refund is pending ({batch_id})"}
+            return results
+
+        # ✅ Step 3: pay out what the swap actually delivered, pro rata, and record per-user attribution
+        out_units = await self._swap_output(swap["txid"], is_buy)
+        if out_units is None:  # Transaction not retrievable: fall back to the slippage-protected minimum
+            out_units = int(quote.get("otherAmountThreshold") or 0)
+            logger.warning(f"⚠️ {batch_id}: swap output not measurable, paying the quoted minimum {out_units}")
+        shares = [(index, keypair.pubkey(), out_units * units // total_units) for index, keypair, units in collected]
+        paid = await self._pay(is_buy, shares)
+
+        for (index, _, units), (_, owner, share) in zip(collected, shares):
+            user_id = batch[index][0]
+            amount_in, amount_out = units / in_scale, share / out_scale
+            token_amount, sol_amount = (amount_out, amount_in) if is_buy else (amount_in, amount_out)
+            log_fill(user_id, "buy" if is_buy else "sell", token_amount, sol_amount, swap["txid"], batch_id)
+
+            if self._settle(batch_id, user_id, owner, out_asset, share, paid.get(index)):
+                results[index] = {"status": "success", "txid": swap["txid"], "payout_txid": paid[index], "out_amount": amount_out}
+            else:
+                logger.critical(f"🚨 Payout of {amount_out} to {user_id} failed in {batch_id}; manual settlement required")
+                results[index] = {"status": "error", "message": f"Swap filled but payout is pending ({batch_id})"}
+
+        logger.info(f"✅ {batch_id}: {len(collected)} orders filled with one swap, TxID: {swap['txid']}")
+        return results
+
+
+swap_aggregator = SwapAggregator()
+
+
+# ✅ Admin bulk operation settings
+WALLETS_PER_RPC = 50  # Owner + ATA per wallet keeps getMultipleAccounts at its 100-key limit
+ADMIN_CONCURRENCY = int(os.getenv("ADMIN_CONCURRENCY", 8))
+SWEEP_RESERVE_SOL = float(os.getenv("SWEEP_RESERVE_SOL", 0.001))  # Left behind to stay rent-exempt
+TOPUP_MIN_SOL = float(os.getenv("TOPUP_MIN_SOL", 0.005))
+TOPUP_AMOUNT_SOL = float(os.getenv("TOPUP_AMOUNT_SOL", 0.01))
+REPORTS_DIR = "reports"
+ADMIN_JOB_KINDS = ("audit", "sweep", "topup")
+REPORT_FIELDS = ["user_id", "address", "sol_balance", "token_balance", "ledger_position", "token_diff", "action", "txid"]
+
+
+async def fetch_wallet_balances(addresses: list) -> dict:
+    """SOL and token balances for many wallets using one getMultipleAccounts call per 50 wallets."""
+    owners = [Pubkey.from_string(address) for address in addresses]
+    atas = [associated_token_address(owner) for owner in owners]
+    response = await resilient_call("rpc", solana_client.get_multiple_accounts, owners + atas, idempotent=True)
+    accounts = response.value
+
+    balances = {}
+    for i, address in enumerate(addresses):
+        owner_account, token_account = accounts[i], accounts[len(addresses) + i]
+        sol = owner_account.lamports / 1e9 if owner_account else 0.0
+        token = token_amount_from_account(token_account)
+        if token_account is not None:
+            token_accounts.known.add(atas[i])
+        balances[address] = (sol, token)
+    return balances
+
+
+class AdminJob:
+    """Audit, sweep or top-up across every custodial wallet, checkpointed after each round.
+
+    The checkpoint stores the last user key processed (wallets are visited in key
+    order, so wallets added mid-job cannot shift it) and the report size at that
+    point; a resumed job truncates rows written after the last checkpoint.
+    """
+    def __init__(self, job_id, kind, cursor=0, total=0, status="running", report_path=None, created_by=None,
+                 last_user_id=None, report_offset=0):
+        self.job_id = job_id
+        self.kind = kind
+        self.cursor = cursor  # Wallets processed so far (progress only)
+        self.total = total
+        self.status = status
+        self.report_path = report_path or os.path.join(REPORTS_DIR, f"{job_id}.csv")
+        self.created_by = created_by
+        self.last_user_id = last_user_id
+        self.report_offset = report_offset
+
+    @classmethod
+    def create(cls, kind: str, created_by: str = None):
+        job = cls(f"{kind}-{int(time.time())}", kind, created_by=created_by)
+        os.makedirs(REPORTS_DIR, exist_ok=True)
+        with open(job.report_path, "w", newline="") as f:
+            csv.writer(f).writerow(REPORT_FIELDS)
+            job.report_offset = f.tell()
+        job.checkpoint()
+        return job
+
+    @classmethod
+    def load(cls, job_id: str):
+        conn = sqlite3.connect("trading_bot.db")
+        row = conn.execute(
+            "SELECT job_id, kind, cursor, total, status, report_path, created_by, last_user_id, report_offset"
+            " FROM admin_jobs WHERE job_id = ?",
+            (job_id,)
+        ).fetchone()
+        conn.close()
+        return cls(*row) if row else None
+
+    @staticmethod
+    def unfinished() -> list:
+        conn = sqlite3.connect("trading_bot.db")
+        rows = conn.execute("SELECT job_id FROM admin_jobs WHERE status = 'running'").fetchall()
+        conn.close()
+        return [row[0] for row in rows]
+
+    def checkpoint(self):
+        conn = sqlite3.connect("trading_bot.db")
+        conn.execute("""
+            INSERT INTO admin_jobs (job_id, kind, cursor, total, status, report_path, created_by,
+                                    last_user_id, report_offset, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(job_id) DO UPDATE SET
+                cursor = excluded.cursor, total = excluded.total, status = excluded.status,
+                last_user_id = excluded.last_user_id, report_offset = excluded.report_offset,
+                updated_at = excluded.updated_at
+        """, (self.job_id, self.kind, self.cursor, self.total, self.status, self.report_path, self.created_by,
+              self.last_user_id, self.report_offset))
+        conn.commit()
+        conn.close()
+
+    async def _act(self, rows: list, semaphore):
+        """Build and submit sweep / top-up transactions for one batch of report rows."""
+        if self.kind == "sweep":
+            admin = Pubkey.from_string(ADMIN_WALLET)
+            targets = [r for r in rows if r["sol_balance"] > SWEEP_RESERVE_SOL + 1e-9]
+            chunk_size = MAX_SIGNERS_PER_TX
+        else:
+            targets = [r for r in rows if r["sol_balance"] < TOPUP_MIN_SOL]
+            chunk_size = MAX_PAYOUTS_PER_TX
+
+        async def submit(chunk):
+            instructions, signers = [], []
+            for row in chunk:
+                owner = Pubkey.from_string(row["address"])
+                if self.kind == "sweep":
+                    keypair = load_user_keypair(user_wallets[row["user_id"]])
+                    lamports = int((row["sol_balance"] - SWEEP_RESERVE_SOL) * 1e9)
+                    instructions.append(transfer(TransferParams(from_pubkey=owner, to_pubkey=admin, lamports=lamports)))
+                    signers.append(keypair)
+                else:
+                    lamports = int(TOPUP_AMOUNT_SOL * 1e9)
+                    instructions.append(transfer(TransferParams(from_pubkey=bot_wallet.pubkey(), to_pubkey=owner, lamports=lamports)))
+            async with semaphore:
+                action = self.kind
+                try:
+                    txid = await submit_instructions(instructions, signers)
+                except TxOutcomeUnknown as e:
+                    logger.critical(f"🚨 {self.job_id}: {self.kind} transaction {e.txid} unconfirmed")
+                    action, txid = f"{self.kind}_unconfirmed", e.txid
+                except Exception as e:
+                    logger.error(f"🚨 {self.job_id}: {self.kind} transaction failed: {str(e)}")
+                    action, txid = f"{self.kind}_failed", ""
+            for row in chunk:
+                row["action"] = action
+                row["txid"] = txid
+
+        await asyncio.gather(*(submit(targets[i:i + chunk_size]) for i in range(0, len(targets), chunk_size)))
+
+    async def _process_batch(self, user_ids: list, semaphore) -> list:
+        addresses = [user_wallets[uid].address for uid in user_ids]
+        async with semaphore:
+            balances = await fetch_wallet_balances(addresses)
+
+        rows = []
+        for user_id, address in zip(user_ids, addresses):
+            sol, token = balances[address]
+            ledger_position = portfolio.get(user_id).position
+            rows.append({
+                "user_id": user_id, "address": address,
+                "sol_balance": sol, "token_balance": token,
+                "ledger_position": ledger_position, "token_diff": token - ledger_position,
+                "action": "", "txid": ""
+            })
+
+        if self.kind in ("sweep", "topup"):
+            await self._act(rows, semaphore)
+        return rows
+
+    async def run(self):
+        """Process wallets from the checkpoint onward. Safe to call again after a restart."""
+        user_ids = sorted(uid for uid in user_wallets if self.last_user_id is None or uid > self.last_user_id)
+        self.total = self.cursor + len(user_ids)
+        semaphore = asyncio.Semaphore(ADMIN_CONCURRENCY)
+        round_size = WALLETS_PER_RPC * ADMIN_CONCURRENCY
+        logging.info(f"🛠️ Admin job {self.job_id} running from {self.cursor}/{self.total}")
+
+        # Drop rows written after the last checkpoint; those wallets are processed again
+        with open(self.report_path, "r+b") as f:
+            f.truncate(self.report_offset)
+
+        try:
+            for start in range(0, len(user_ids), round_size):
+                window = user_ids[start:start + round_size]
+                batches = [window[i:i + WALLETS_PER_RPC] for i in range(0, len(window), WALLETS_PER_RPC)]
+                results = await asyncio.gather(*(self._process_batch(batch, semaphore) for batch in batches))
+
+                with open(self.report_path, "a", newline="") as f:
+                    writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+                    for rows in results:
+                        writer.writerows(rows)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self.report_offset = f.tell()
+
+                self.cursor += len(window)
+                self.last_user_id = window[-1]
+                self.checkpoint()
+
+            self.status = "done"
+            self.checkpoint()
+            logging.info(f"✅ Admin job {self.job_id} finished: {self.total} wallets")
+        except Exception as e:
+            logger.error(f"🚨 Admin job {self.job_id} paused at {self.cursor}/{self.total}: {str(e)}")
+            raise
+
+
+async def run_admin_job(job: AdminJob):
+    """Run a job in the background and report the outcome to the admin who started it."""
+    try:
+        await job.run()
+        if job.created_by:
+            messenger.send(job.created_by, f"✅ Admin job `{job.job_id}` finished ({job.total} wallets). Report: {job.report_path}")
+    except Exception as e:
+        if job.created_by:
+            messenger.send(job.created_by, f"⚠️ Admin job `{job.job_id}` paused at {job.cursor}/{job.total}: {e}\nUse /admin_resume {job.job_id}")
+
+
+def resume_admin_jobs():
+    """Restart jobs that were still running when the process stopped."""
+    for job_id in AdminJob.unfinished():
+        lifecycle.spawn(run_admin_job(AdminJob.load(job_id)))
+
+
+# ✅ DCA settings
+DCA_MIN_INTERVAL = 300          # Shortest allowed recurrence, in seconds
+DCA_MAX_INTERVAL = 365 * 86400  # Longest allowed recurrence, in seconds
+DCA_MAX_PER_USER = 5
+DCA_RETRY_SECONDS = 30          # Delay before due orders are retried after a failed schedule write
+DCA_JITTER_FRACTION = float(os.getenv("DCA_JITTER_FRACTION", 0.05))  # Spread of each run, as a fraction of its interval
+DCA_INTERVAL_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+
+def parse_interval(text: str) -> int:
+    """'30m', '4h' or '1d' -> seconds, within [DCA_MIN_INTERVAL, DCA_MAX_INTERVAL]."""
+    unit = DCA_INTERVAL_UNITS.get(text[-1:].lower())
+    if unit is None:
+        raise ValueError(f"Unknown interval unit in {text!r}")
+    try:
+        value = float(text[:-1])
+    except ValueError:
+        value = math.nan
+    if not math.isfinite(value):
+        raise ValueError(f"Invalid interval {text!r}")
+    seconds = value * unit
+    if seconds < DCA_MIN_INTERVAL:
+        raise ValueError(f"The shortest interval is {DCA_MIN_INTERVAL // 60} minutes.")
+    if seconds > DCA_MAX_INTERVAL:
+        raise ValueError(f"The longest interval is {DCA_MAX_INTERVAL // 86400} days.")
+    return int(seconds)
+
+
+class DcaScheduler:
+    """Recurring buy orders for every user, driven by one task and a min-heap of due times.
+
+    Orders live in SQLite; the heap only holds (due, order_id) pairs. Cancelled or
+    rescheduled orders leave stale heap entries behind that are skipped when popped,
+    so cancel is O(1) and each run is O(log n). Run times are anchored to the
+    schedule (no drift) and jittered so orders created together do not fire together.
+    """
+    def __init__(self):
+        self.orders = {}  # order_id -> row dict
+        self.heap = []
+        self.wakeup = asyncio.Event()
+        self.stats = {"runs": 0, "failures": 0}
+
+    def _jitter(self, interval):
+        spread = interval * DCA_JITTER_FRACTION
+        return random.uniform(-spread, spread)
+
+    def _schedule(self, order):
+        heapq.heappush(self.heap, (order["next_run"], order["id"]))
+        self.wakeup.set()
+
+    def load(self):
+        """Rebuild the heap from active orders; runs missed while offline fire once, spread over their jitter window."""
+        conn = sqlite3.connect("trading_bot.db")
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute("SELECT * FROM dca_orders WHERE status = 'active'").fetchall()
+        conn.close()
+
+        now = time.time()
+        self.orders.clear()
+        self.heap.clear()
+        for row in rows:
+            order = dict(row)
+            if order["next_run"] < now:
+                order["next_run"] = now + abs(self._jitter(order["interval_seconds"]))
+            self.orders[order["id"]] = order
+            self.heap.append((order["next_run"], order["id"]))
+        heapq.heapify(self.heap)
+        self.wakeup.set()
+
+    def create(self, user_id: str, sol_amount: float, interval: int, max_runs=None) -> dict:
+        next_run = time.time() + interval + self._jitter(interval)
+        conn = sqlite3.connect("trading_bot.db")
+        with conn:
+            cursor = conn.execute("""
+                INSERT INTO dca_orders (user_id, sol_amount, interval_seconds, next_run, max_runs)
+                VALUES (?, ?, ?, ?, ?)
+            """, (user_id, sol_amount, interval, next_run, max_runs))
+        conn.close()
+
+        order = {"id": cursor.lastrowid, "user_id": user_id, "sol_amount": sol_amount, "interval_seconds": interval,
+                 "next_run": next_run, "runs": 0, "max_runs": max_runs, "status": "active"}
+        self.orders[order["id"]] = order
+        self._schedule(order)
+        return order
+
+    def cancel(self, user_id: str, order_id: int) -> bool:
+        order = self.orders.get(order_id)
+        if not order or order["user_id"] != user_id:
+            return False
+        self._finish(order, "cancelled")
+        return True
+
+    def for_user(self, user_id: str) -> list:
+        return sorted((o for o in self.orders.values() if o["user_id"] == user_id), key=lambda o: o["next_run"])
+
+    def _finish(self, order, status):
+        del self.orders[order["id"]]  # Its heap entry goes stale and is dropped when popped
+        conn = sqlite3.connect("trading_bot.db")
+        with conn:
+            conn.execute("UPDATE dca_orders SET status = ? WHERE id = ?", (status, order["id"]))
+        conn.close()
+
+    def _pop_due(self, now) -> list:
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            run_at, order_id = heapq.heappop(self.heap)
+            order = self.orders.get(order_id)
+            if order and order["next_run"] == run_at:
+                due.append(order)
+        return due
+
+    def _advance(self, orders):
+        """Move each fired order to its next slot, persisting before the buy so a crash never repeats a run.
+
+        The new slots are written to SQLite first; memory (orders and heap) only changes
+        once the write succeeded, so a failed write leaves both sides as they were.
+        """
+        now = time.time()
+        updates = []
+        for order in orders:
+            interval = order["interval_seconds"]
+            runs = order["runs"] + 1
+            next_run = order["next_run"] + interval + self._jitter(interval)
+            if next_run < now:  # Fell behind (e.g. long stall): don't fire a burst of catch-up runs
+                next_run = now + abs(self._jitter(interval))
+            status = "done" if order["max_runs"] and runs >= order["max_runs"] else "active"
+            updates.append((next_run, runs, status, order["id"]))
+
+        conn = sqlite3.connect("trading_bot.db")
+        try:
+            with conn:
+                conn.executemany("UPDATE dca_orders SET next_run = ?, runs = ?, status = ? WHERE id = ?", updates)
+        finally:
+            conn.close()
+
+        for order, (next_run, runs, status, order_id) in zip(orders, updates):
+            order.update(next_run=next_run, runs=runs, status=status)
+            if status == "done":
+                del self.orders[order_id]
+            else:
+                heapq.heappush(self.heap, (next_run, order_id))
+
+    async def _execute(self, order):
+        user_id = order["user_id"]
+        if user_id not in user_wallets:
+            logging.warning(f"DCA order {order['id']} skipped: {user_id} has no wallet.")
+            return
+
+        result = await swap_aggregator.submit(user_id, True, order["sol_amount"])
+        if result["status"] == "success":
+            self.stats["runs"] += 1
+            logging.info(f"✅ DCA buy {order['id']} for {user_id}: {order['sol_amount']} SOL, TxID: {result['txid']}")
+            messenger.send(user_id, f"✅ DCA buy executed: {order['sol_amount']} SOL\n📄 TxID: {result['txid']}", PRIORITY_FILL)
+        else:
+            self.stats["failures"] += 1
+            logging.error(f"❌ DCA buy {order['id']} failed for {user_id}: {result['message']}")
+            messenger.send(user_id, f"❌ DCA buy #{order['id']} failed: {result['message']}", PRIORITY_FILL)
+
+    async def run(self):
+        """Sleep until the earliest due order (or a new one is scheduled), then fire everything due."""
+        while True:
+            self.wakeup.clear()
+            timeout = self.heap[0][0] - time.time() if self.heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if not lifecycle.accepting:
+                return  # Shutting down: due orders stay persisted and fire after restart
+
+            due = self._pop_due(time.time())
+            if not due:
+                continue
+            try:
+                self._advance(due)
+            except sqlite3.Error as e:
+                # Not persisted, so not executed: put the runs back and retry after a pause
+                logging.error(f"🚨 DCA schedule update failed, retrying {len(due)} runs in {DCA_RETRY_SECONDS}s: {str(e)}")
+                for order in due:
+                    heapq.heappush(self.heap, (order["next_run"], order["id"]))
+                await asyncio.sleep(DCA_RETRY_SECONDS)
+                continue
+            for order in due:
+                lifecycle.track(self._execute(order))
+
+
+dca_scheduler = DcaScheduler()
+
+
+# ✅ Deposit scanner settings
+DEPOSIT_SCAN_INTERVAL = float(os.getenv("DEPOSIT_SCAN_INTERVAL", 20))  # Seconds between scan rounds
+DEPOSIT_ACTIVE_WINDOW = 900     # Users seen within this many seconds are scanned every round
+DEPOSIT_IDLE_BATCH = 200        # Other wallets scanned per round, round-robin
+DEPOSIT_CONCURRENCY = 8         # Wallets scanned at once
+DEPOSIT_PAGE_LIMIT = 100        # Signatures per getSignaturesForAddress page
+DEPOSIT_MAX_PAGES = 10          # Bound on catch-up per wallet per round
+
+
+def balance_delta_units(transaction, address: str):
+    """(fee payer, lamport change, TOKEN_MINT base-unit change) for `address` in a base64-encoded confirmed transaction."""
+    meta = transaction.transaction.meta
+    message = transaction.transaction.transaction.message
+    keys = [str(key) for key in message.account_keys]
+    if meta.loaded_addresses:
+        keys += [str(key) for key in meta.loaded_addresses.writable] + [str(key) for key in meta.loaded_addresses.readonly]
+
+    lamports = 0
+    if address in keys:
+        index = keys.index(address)
+        lamports = meta.post_balances[index] - meta.pre_balances[index]
+
+    def token_units(balances):
+        return sum(int(b.ui_token_amount.amount) for b in balances or []
+                   if str(b.owner) == address and str(b.mint) == TOKEN_MINT)
+
+    return keys[0], lamports, token_units(meta.post_token_balances) - token_units(meta.pre_token_balances)
+
+
+def deposit_delta(transaction, address: str):
+    """(fee payer, SOL change, token change) for `address` in a base64-encoded confirmed transaction."""
+    payer, lamports, token_units = balance_delta_units(transaction, address)
+    return payer, lamports / 1e9, token_units / 10**TOKEN_DECIMALS
+
+
+class DepositScanner:
+    """Incremental deposit detection for every custodial wallet.
+
+    Each wallet keeps a cursor (the newest signature already processed, or "" for a
+    wallet that had no history when first scanned) in SQLite, and
+    getSignaturesForAddress is called with `until=cursor`, so a round only pages
+    through activity that is new since the last one. A backlog longer than
+    DEPOSIT_MAX_PAGES is paged back over several rounds and only processed once it
+    reaches the cursor, so the cursor never skips history. Recently active users are scanned
+    every round and the rest in round-robin slices. A new transaction counts as a
+    deposit when the wallet's balance rose and neither the wallet nor the bot paid the
+    fee, which excludes the bot's own swaps, collections and payouts.
+    """
+    def __init__(self):
+        self.cursors = {}  # address -> last processed signature ("" = empty when first scanned)
+        self.backfill = {}  # address -> oldest signature status fetched so far of a backlog not yet back to the cursor
+        self.active = {}   # user_id -> monotonic time of last interaction
+        self.rotation = 0
+        self.stats = {"rounds": 0, "wallets_scanned": 0, "new_signatures": 0, "deposits": 0, "backfill_rounds": 0}
+
+    def touch(self, user_id: str):
+        self.active[user_id] = time.monotonic()
+
+    def load(self):
+        conn = sqlite3.connect("trading_bot.db")
+        self.cursors = dict(conn.execute("SELECT address, last_signature FROM wallet_cursors").fetchall())
+        conn.close()
+
+    def _round_wallets(self) -> list:
+        """Active users first, then the next round-robin slice of everyone else."""
+        now = time.monotonic()
+        self.active = {uid: seen for uid, seen in self.active.items() if now - seen < DEPOSIT_ACTIVE_WINDOW}
+        chosen = [uid for uid in self.active if uid in user_wallets]
+
+        idle = [uid for uid in user_wallets if uid not in self.active]
+        if idle:
+            start = self.rotation % len(idle)
+            chosen += (idle[start:] + idle[:start])[:DEPOSIT_IDLE_BATCH]
+            self.rotation = start + DEPOSIT_IDLE_BATCH
+        return chosen
+
+    async def _new_signatures(self, address: str) -> list:
+        """Signatures newer than the cursor, oldest first (the first scan of a wallet only sets the cursor).
+
+        If the page budget runs out before reaching the cursor, nothing is returned and
+        the next round resumes paging below the oldest signature fetched. Once that
+        reaches the cursor, the older part plus the resume signature itself are
+        returned; the newer signatures are picked up after the cursor has moved.
+        """
+        owner = Pubkey.from_string(address)
+        cursor = self.cursors.get(address)
+        if cursor is None:
+            response = await resilient_call("rpc", solana_client.get_signatures_for_address, owner, limit=1, idempotent=True)
+            return response.value
+
+        until = Signature.from_string(cursor) if cursor else None
+        resume = self.backfill.get(address)
+        found, before = [], resume.signature if resume else None
+        for _ in range(DEPOSIT_MAX_PAGES):
+            response = await resilient_call(
+                "rpc", solana_client.get_signatures_for_address, owner,
+                before=before, until=until, limit=DEPOSIT_PAGE_LIMIT, idempotent=True
+            )
+            found += response.value
+            if len(response.value) < DEPOSIT_PAGE_LIMIT:
+                self.backfill.pop(address, None)
+                return found[::-1] + ([resume] if resume else [])
+            before = response.value[-1].signature
+
+        self.backfill[address] = found[-1]
+        self.stats["backfill_rounds"] += 1
+        return []
+
+    async def _scan_wallet(self, user_id: str, address: str, semaphore) -> bool:
+        """Process one wallet's new activity; returns whether there was any."""
+        async with semaphore:
+            baseline = address not in self.cursors
+            signatures = await self._new_signatures(address)
+            if baseline:  # An empty wallet gets "" so its first transaction is scanned like any other
+                self.cursors[address] = str(signatures[0].signature) if signatures else ""
+                return False
+            if not signatures:
+                return False
+
+            self.stats["new_signatures"] += len(signatures)
+            sol, tokens = 0.0, 0.0
+            for status in signatures:
+                if status.err is not None:
+                    continue
+                response = await resilient_call(
+                    "rpc", solana_client.get_transaction, status.signature,
+                    encoding="base64", max_supported_transaction_version=0, idempotent=True
+                )
+                if response.value is None:
+                    continue
+                payer, sol_change, token_change = deposit_delta(response.value, address)
+                if payer not in (address, bot_wallet_pubkey):
+                    sol += max(sol_change, 0.0)
+                    tokens += max(token_change, 0.0)
+
+            if sol > 0 or tokens > 0:
+                self.stats["deposits"] += 1
+                await event_bus.publish(BalanceChanged(user_id, sol, tokens, "deposit"))
+                logging.info(f"💰 Deposit for {user_id}: {sol:.4f} SOL, {tokens:.2f} tokens")
+
+            self.cursors[address] = str(signatures[-1].signature)  # Advance only after processing (at-least-once)
+            return True
+
+    async def scan_round(self):
+        user_ids = self._round_wallets()
+        semaphore = asyncio.Semaphore(DEPOSIT_CONCURRENCY)
+        before = dict(self.cursors)
+
+        async def scan(user_id):
+            address = user_wallets[user_id].address
+            try:
+                return user_id if await self._scan_wallet(user_id, address, semaphore) else None
+            except Exception as e:
+                logger.warning(f"⚠️ Deposit scan failed for {address}: {str(e)}")
+                return None
+
+        changed = [uid for uid in await asyncio.gather(*(scan(uid) for uid in user_ids)) if uid]
+        self.stats["rounds"] += 1
+        self.stats["wallets_scanned"] += len(user_ids)
+
+        # ✅ Refresh the balance cache for wallets with new activity (one call per WALLETS_PER_RPC wallets)
+        for i in range(0, len(changed), WALLETS_PER_RPC):
+            chunk = changed[i:i + WALLETS_PER_RPC]
+            balances = await fetch_wallet_balances([user_wallets[uid].address for uid in chunk])
+            for uid in chunk:
+                wallet = user_wallets[uid]
+                wallet.sol_balance, wallet.token_balance = balances[wallet.address]
+                append_wallet_record(uid, wallet)
+
+        updates = []
+        for uid in user_ids:
+            address = user_wallets[uid].address
+            signature = self.cursors.get(address)
+            if signature is not None and signature != before.get(address):
+                updates.append((address, uid, signature))
+        if updates:
+            conn = sqlite3.connect("trading_bot.db")
+            with conn:
+                conn.executemany("""
+                    INSERT INTO wallet_cursors (address, user_id, last_signature) VALUES (?, ?, ?)
+                    ON CONFLICT(address) DO UPDATE SET last_signature = excluded.last_signature, updated_at = CURRENT_TIMESTAMP
+                """, updates)
+            conn.close()
+
+    async def run(self):
+        while True:
+            try:
+                await self.scan_round()
+            except Exception as e:
+                logger.error(f"🚨 Deposit scan round failed: {str(e)}")
+            await asyncio.sleep(DEPOSIT_SCAN_INTERVAL)
+
 
+deposit_scanner = DepositScanner()
 
 
 async def price_monitor():
-    """Monitor prices with enhanced error handling"""
+    """Publish a PriceTick per poll; order evaluation and execution run in their own stages."""
+    failures = 0
     while True:
         try:
             # Fetch current price once
             current_price = await get_token_price(TOKEN_MINT)
 
             if not current_price:
+                failures += 1
                 logger.warning("Failed to fetch price, skipping this cycle.")
-                await asyncio.sleep(300)  # Backoff on failure
+                await asyncio.sleep(PRICE_POLL_INTERVAL + backoff_delay(failures, base=5, cap=300))  # Backoff on failure
                 continue  # Skip iteration if price is invalid
-
-            # Process price updates for all users
-            for user_id, target in user_sell_targets.items():
-                entry_price = user_entry_prices.get(user_id, current_price)
-                
-                # Check if the price target is met
-                if current_price >= entry_price * target:
-                    await handle_sell_now(user_id)  # Execute sell
-            
-            await asyncio.sleep(60)  # Check prices every 60 seconds
+            failures = 0
+            await event_bus.publish(PriceTick(TOKEN_MINT, current_price, time.time()))
+            await asyncio.sleep(PRICE_POLL_INTERVAL)
 
         except Exception as e:
+            failures += 1
             logger.error(f"Price monitor error: {str(e)}")
-            await asyncio.sleep(300)  # Backoff on errors
+            await asyncio.sleep(PRICE_POLL_INTERVAL + backoff_delay(failures, base=5, cap=300))  # Backoff on errors
+
+
+async def evaluate_triggers(tick: PriceTick):
+    """PriceTick -> OrderTriggered: run every order book against the new price."""
+    current_price = tick.price
+    indicators = signal_engine.on_tick(tick.mint, current_price)  # Keep indicators warm even while draining
+
+    if not lifecycle.accepting:
+        return  # Shutting down: leave orders untouched for the next process
+
+    triggered = []
+    for user_id, target in list(user_sell_targets.items()):
+        entry_price = user_entry_prices.get(user_id, current_price)
+
+        # Check if the price target is met
+        if current_price >= entry_price * target:
+            triggered.append(OrderTriggered(user_id, "sell", 0.0, "target", current_price))
+
+    # ✅ Buy targets: consumed once the price dips to them
+    for user_id, buy_order in list(user_buy_targets.items()):
+        if current_price <= buy_order["price"]:
+            logging.info(f"🔔 Market Dip Detected! Buying for {user_id} at {current_price:.4f} SOL")
+            del user_buy_targets[user_id]
+            triggered.append(OrderTriggered(user_id, "buy", buy_order["amount"] * current_price, "buy target", current_price))
+
+    # ✅ Stop-loss / trailing-stop orders: one vectorized pass per tick
+    for user_id, kind, amount, trigger in stop_orders.on_tick(current_price):
+        logger.info(f"🔔 {STOP_ORDER_NAMES[kind]} hit for {user_id} at {current_price:.6f} SOL (trigger {trigger:.6f})")
+        triggered.append(OrderTriggered(user_id, "sell", amount, STOP_ORDER_NAMES[kind], current_price))
+
+    # ✅ Indicator-conditioned orders: one vectorized pass over the whole book
+    for order_id, spec in signal_orders.on_tick(indicators):
+        triggered.append(OrderTriggered(spec["user_id"], spec["side"], spec["amount"], f"signal #{order_id}", current_price))
+
+    # ✅ Alert-only subscriptions: bisect the sorted trigger lists, fan out one message per user
+    notify_price_alerts(price_alerts.on_tick(current_price), current_price)
+
+    for order in triggered:
+        await event_bus.publish(order)
+
+
+async def execute_triggered(order: OrderTriggered):
+    """OrderTriggered -> swap. Runs on several workers so triggers arriving together still batch."""
+    if order.side == "buy":
+        coro_factory = lambda: handle_buy_now(order.user_id, order.amount, order.reason)
+    else:
+        coro_factory = lambda: handle_sell_now(order.user_id, order.amount or None, reason=order.reason)
+    await inflight.run(f"{order.user_id}:{order.reason}", coro_factory)  # A target re-firing mid-sell joins the running one
+
+
+async def notify_confirmation(event: TxConfirmed):
+    if event.status == "failed":
+        messenger.send(event.user_id, f"❌ Your {event.side} failed on-chain.\n📄 TxID: {event.txid}", PRIORITY_FILL)
+    elif event.status == "confirmed":
+        messenger.send(event.user_id, f"✅ Your {event.side} is confirmed.\n📄 TxID: {event.txid}", PRIORITY_FILL)
+    else:
+        messenger.send(event.user_id, f"⚠️ Your {event.side} was not confirmed in time. Check Solscan:\n{event.txid}", PRIORITY_FILL)
+
+
+async def reverse_failed_fill(event: TxConfirmed):
+    """TxConfirmed(failed/timeout) -> remove the fill log_fill wrote when the swap was submitted."""
+    if event.status != "confirmed":
+        reverse_fill(event.user_id, event.txid)
+
+
+async def refresh_balance(event: TxConfirmed):
+    """TxConfirmed -> fresh cached balances -> BalanceChanged."""
+    wallet = user_wallets.get(event.user_id)
+    if event.status != "confirmed" or wallet is None:
+        return
+    sol, tokens = wallet.sol_balance, wallet.token_balance
+    await update_wallet_balances(event.user_id)
+    await event_bus.publish(BalanceChanged(event.user_id, wallet.sol_balance - sol, wallet.token_balance - tokens, "swap"))
+
+
+async def notify_balance_change(event: BalanceChanged):
+    if event.reason != "deposit":
+        return
+    received = " and ".join(part for part in (f"{event.sol_delta:.4f} SOL" if event.sol_delta > 0 else "",
+                                              f"{event.token_delta:.2f} tokens" if event.token_delta > 0 else "") if part)
+    messenger.send(event.user_id, f"💰 **Deposit received:** {received}", PRIORITY_ALERT, parse_mode="Markdown")
+
+
+# ✅ Pipeline wiring: price ticks are disposable, orders and fills are never dropped
+event_bus.subscribe(PriceTick, evaluate_triggers, policy=DROP_OLDEST, maxsize=64)
+event_bus.subscribe(OrderTriggered, execute_triggered, policy=BLOCK, workers=EXECUTION_WORKERS)
+event_bus.subscribe(TxConfirmed, notify_confirmation, policy=BLOCK)
+event_bus.subscribe(TxConfirmed, reverse_failed_fill, policy=BLOCK)
+event_bus.subscribe(TxConfirmed, refresh_balance, policy=DROP_OLDEST, workers=4)
+event_bus.subscribe(BalanceChanged, notify_balance_change, policy=BLOCK)
+
+
+def notify_price_alerts(fired: list, price: float):
+    """Queue one message per user for this tick's alerts; the messenger paces and coalesces delivery."""
+    by_user = {}
+    for alert_id, spec in fired:
+        by_user.setdefault(spec["user_id"], []).append(f"#{alert_id}: {spec['direction']} {spec['price']:.6g}")
+    for user_id, lines in by_user.items():
+        messenger.send(user_id, f"🔔 Price alert: now {price:.6g} SOL\n" + "\n".join(lines), PRIORITY_ALERT)
+    if fired:
+        logger.info(f"🔔 {len(fired)} price alerts fired for {len(by_user)} users at {price:.6f} SOL")
+
 
 async def get_token_price(token_address: str):
     """Fetches the token price from Jupiter API asynchronously."""
     try:
         params = {
             "inputMint": token_address,
-            "outputMint": "So11111111111111111111111111111111111111112",
-            "amount": 1_000_000  # 1 token assuming 6 decimals
+            "outputMint": SOL_MINT,
+            "amount": 10**TOKEN_DECIMALS  # 1 whole token
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(JUPITER_API, params=params, timeout=10)
-            response.raise_for_status()  # ✅ Raise error if request fails
+        async def fetch():
+            async with httpx.AsyncClient() as client:
+                response = await client.get(JUPITER_API, params=params, timeout=10)
+                response.raise_for_status()  # ✅ Raise error if request fails
+                return response.json()
 
-            return float(response.json()["outAmount"]) / 1_000_000
+        quote = await resilient_call("jupiter", fetch, idempotent=True)
+        price = float(quote["outAmount"]) / 1e9  # Lamports -> SOL
+        candle_store.on_tick(token_address, price)  # ✅ Every observed price feeds the history
+        return price
     except Exception as e:
         logging.error(f"🚨 Price check error: {e}")
         return 0  # ✅ Return 0 instead of crashing
@@ -498,8 +4163,9 @@ async def get_token_price(token_address: str):
 async def start(update: Update, context: CallbackContext):
     """Handles wallet creation (only once) with atomic safety, encryption, and UI buttons."""
     try:
-        user_id = str(update.effective_user.id)
+        user_id = user_key(update.effective_user.id)
         load_wallets()
+        deposit_scanner.touch(user_id)
         logging.info(f"✅ /start command received from user {user_id}")
 
         if user_id in user_wallets:
@@ -507,66 +4173,29 @@ async def start(update: Update, context: CallbackContext):
             wallet = user_wallets[user_id]
             await update_wallet_balances(user_id)
 
-            message = (
-                f"👋 **Welcome back!**\n"
-                f"📌 **Your Permanent Wallet Address:** `{wallet['address']}`\n"
-                f"💰 **SOL Balance:** {wallet['sol_balance']:.4f} SOL\n"
-                f"🎯 **Token Balance:** {wallet['token_balance']:.2f} Tokens\n\n"
-                "🔒 **Your wallet is permanently stored and cannot be replaced.**"
-            )
+            message = WELCOME_BACK_TEMPLATE.format(address=wallet.address, sol_balance=wallet.sol_balance, token_balance=wallet.token_balance)
 
         else:
-            # ✅ Create a new wallet only if the user does NOT have one
-            keypair = Keypair()
-            encrypted_key = cipher.encrypt(keypair.to_bytes()).decode()
-            # encrypted_key = cipher.encrypt(keypair.to_base58_string().encode()).decode()
-
-            new_wallet = {
-                "address": str(keypair.pubkey()),  # Store as string
-                "encrypted_key": encrypted_key,   # Secure private key storage
-                "sol_balance": 0.0,
-                "token_balance": 0.0,
-                "transactions": []
-            }
+            # ✅ Create a new wallet only if the user does NOT have one (pre-generated and pre-encrypted)
+            new_wallet = wallet_pool.claim()
 
             # ✅ Atomic update: Prevent overwriting existing wallets
             with lock:
                 load_wallets()
                 if user_id not in user_wallets:  # Double-check to prevent overwriting
                     user_wallets[user_id] = new_wallet
-                    save_wallets()
-                    message = (
-                        "✅ **Wallet Created**\n"
-                        f"📌 **Your Address:** `{new_wallet['address']}`\n"
-                        "🔐 **Your private key is encrypted & stored securely.**\n\n"
-                        "⚠️ **This wallet is PERMANENT and cannot be changed.**"
-                    )
+                    append_wallet_record(user_id, new_wallet)
+                    message = WALLET_CREATED_TEMPLATE.format(address=new_wallet.address)
                 else:
                     # Edge case: If another process created a wallet simultaneously
+                    wallet_pool.release(new_wallet)
                     wallet = user_wallets[user_id]
-                    message = (
-                        "⚠️ **Wallet creation interrupted, but your wallet is safe!**\n"
-                        f"📌 **Your Permanent Address:** `{wallet['address']}`"
-                    )
-
-        # ✅ Inline Keyboard Buttons for quick actions
-        keyboard = [
-            [InlineKeyboardButton("💼 Wallet Info", callback_data="wallet"),
-            InlineKeyboardButton("💰 Deposit", callback_data="deposit")],
-            [InlineKeyboardButton("🎯 Set Sell Target", callback_data="set_sell_target"),
-            InlineKeyboardButton("📈 Set Buy Target", callback_data="set_buy_target")],
-            [InlineKeyboardButton("🚀 Buy Now", callback_data="buy_now"),
-            InlineKeyboardButton("📉 Sell Now", callback_data="sell_now")],
-            [InlineKeyboardButton("📜 Transaction History", callback_data="transaction_history"),
-            InlineKeyboardButton("🚫 Cancel Sell", callback_data="cancel_sell")],
-            [InlineKeyboardButton("🔍 Solscan", callback_data="view_solscan"),
-            InlineKeyboardButton("❓ Help", callback_data="help")]
-        ]
+                    message = WALLET_RACE_TEMPLATE.format(address=wallet.address)
 
         await update.message.reply_text(
             message,
             parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=MAIN_MENU
         )
 
     except Exception as e:
@@ -577,7 +4206,7 @@ async def start(update: Update, context: CallbackContext):
 async def wallet_info(update: Update, context: CallbackContext):
     """Show user wallet details."""
     query = update.callback_query  # ✅ Get the query data
-    user_id = str(query.from_user.id)
+    user_id = user_key(query.from_user.id)
     load_wallets()
 
     if user_id not in user_wallets:
@@ -585,13 +4214,9 @@ async def wallet_info(update: Update, context: CallbackContext):
         return
     
     wallet_data = user_wallets[user_id]
-    balance = await get_sol_balance(wallet_data["address"])
+    balance = await get_sol_balance(wallet_data.address)
 
-    message = (
-        f"💰 **Wallet Info:**\n\n"
-        f"📌 **Address:** {wallet_data['address']}\n"
-        f"🔹 **SOL Balance:** {balance:.4f} SOL"
-    )
+    message = WALLET_INFO_TEMPLATE.format(address=wallet_data.address, balance=balance)
     
     await query.message.reply_text(message)
 
@@ -602,7 +4227,7 @@ def generate_moonpay_link(user_id: str) -> str:
     if user_id not in user_wallets:
         return "https://buy.moonpay.com/?apiKey=pk_live_tgPovrzh9urHG1HgjrxWGq5xgSCAAz&showWalletAddressForm=true&currencyCode=sol"
     
-    wallet_address = user_wallets[user_id]["address"]
+    wallet_address = user_wallets[user_id].address
     
     # ✅ Dynamically create the deposit link
     moonpay_link = (
@@ -614,13 +4239,13 @@ def generate_moonpay_link(user_id: str) -> str:
 
 async def deposit_info(query):
     load_wallets()
-    user_id = str(query.from_user.id)
+    user_id = user_key(query.from_user.id)
     with lock:
         if user_id not in user_wallets:
             await query.message.reply_text("No wallet found. Use /start to create one.")
             return
         
-        wallet_address = user_wallets[user_id]["address"]
+        wallet_address = user_wallets[user_id].address
         message = f"To deposit SOL, send funds to:\n{wallet_address}"
         await query.message.reply_text(message)
 
@@ -632,125 +4257,105 @@ async def confirm_reset_wallet(query):
 
 
 async def withdraw_phantom(update: Update, context: CallbackContext):
-    user_id = str(update.effective_user.id)
+    """Send SOL from the caller's own custodial wallet to an external address."""
+    user_id = user_key(update.effective_user.id)
     load_wallets()
     now = time.time()
 
     # Prevent spam (Only allow withdrawal every 60 seconds)
     if user_id in user_last_withdrawal and now - user_last_withdrawal[user_id] < 60:
-        await update.message.reply_text("⚠️ You can only withdraw once per minute.")
+        await update.effective_message.reply_text("⚠️ You can only withdraw once per minute.")
         return
-        
-    for attempt in range(3):
-        try:
-            response = await solana_client.send_transaction(...)
-            break
-        except Exception as e:
-            if attempt == 2:
-                await update.message.reply_text("❌ Withdrawal failed after 3 attempts")
-            await asyncio.sleep(1)
 
-    user_last_withdrawal[user_id] = now  # Update last withdrawal time
-    if len(context.args) != 2:
-        await update.message.reply_text("Usage: /withdraw <amount> <recipient_address>")
+    args = context.args or []
+    if len(args) != 2:
+        await update.effective_message.reply_text("Usage: /withdraw_sol <amount> <recipient_address>")
+        return
+
+    wallet = user_wallets.get(user_id)
+    if not wallet:
+        await update.effective_message.reply_text("No wallet found. Use /start to create one.")
         return
 
     try:
-        amount = float(context.args[0])
-        recipient = context.args[1]
+        amount = float(args[0])
+        recipient = args[1]
+        if not math.isfinite(amount) or amount <= 0:
+            await update.effective_message.reply_text("Invalid amount.")
+            return
 
         # Validate recipient address
         try:
             recipient_pubkey = Pubkey.from_string(recipient)
         except:
-            await update.message.reply_text("Invalid recipient address.")
+            await update.effective_message.reply_text("Invalid recipient address.")
             return
 
-        # Check bot wallet balance
-        bot_balance = await get_sol_balance(str(bot_wallet.pubkey()))
-        if amount > bot_balance:
-            await update.message.reply_text(f"Insufficient bot balance. Available: {bot_balance:.4f} SOL")
+        # Check the user's own balance (the bot wallet only pays the fee)
+        balance = await get_sol_balance(wallet.address)
+        if amount > balance:
+            await update.effective_message.reply_text(f"Insufficient balance. Available: {balance:.4f} SOL")
             return
 
-        # Construct transaction
-        transaction = Transaction()
+        # Construct, send and confirm transaction (retries are handled by the resilience layer)
+        keypair = load_user_keypair(wallet)
         params = TransferParams(
-            from_pubkey=bot_wallet.pubkey(),
+            from_pubkey=keypair.pubkey(),
             to_pubkey=recipient_pubkey,
             lamports=int(amount * 1e9),
         )
-        transaction.add(transfer(params))
+        user_last_withdrawal[user_id] = now  # Update last withdrawal time
+        response = await submit_instructions([transfer(params)], [keypair])
+        wallet.record_transaction(response)
+        append_wallet_record(user_id, wallet)
+        await update.effective_message.reply_text(f"✅ Successfully sent {amount} SOL to {recipient}\nTransaction: {response}")
 
-        # Send and confirm transaction
-        response = await solana_client.send_transaction(transaction, bot_wallet)
-        await update.message.reply_text(f"✅ Successfully sent {amount} SOL to {recipient}\nTransaction: {response}")
+    except TxOutcomeUnknown as e:
+        # Retrying could send the funds twice: point the user at the transaction instead
+        logging.critical(f"🚨 Withdrawal {e.txid} for {user_id} unconfirmed")
+        await update.effective_message.reply_text(f"⏳ Withdrawal sent but not yet confirmed. Check it before retrying:\nTransaction: {e.txid}")
 
     except Exception as e:
-        logging.error(f"Error processing withdrawal: {e}")
-        await update.message.reply_text(f"⚠️ Error: {e}")
+        logging.error(f"Error processing withdrawal for {user_id}: {e}")
+        await update.effective_message.reply_text("⚠️ Withdrawal failed. Please try again later.")
 
-async def execute_buy(user_id, buy_amount, current_price, context: CallbackContext):
-    """Executes a buy transaction securely"""
+async def execute_buy(user_id, buy_amount, current_price, context: CallbackContext = None):
+    """Executes a buy of `buy_amount` tokens at roughly `current_price` through the swap path."""
     if user_id not in user_wallets:
         logging.warning(f"User {user_id} has no wallet.")
         return
 
-    user_wallet = user_wallets[user_id]
-    user_address = user_wallet["address"]
-    user_private_key = cipher.decrypt(user_wallet["encrypted_key"].encode()).decode()
-
-    # Convert private key back to Keypair
-    buyer_keypair = Keypair.from_base58_string(user_private_key)
+    user_address = user_wallets[user_id].address
 
     # Check user's SOL balance
-    user_balance = await get_sol_balance(user_address)
-    total_cost = buy_amount * current_price
-
-    if total_cost > user_balance:
-        logging.warning(f"User {user_id} has insufficient SOL balance.")
-        await context.bot.send_message(chat_id=user_id, text="🚨 **Insufficient SOL balance!** Deposit more SOL to buy.")
-        return
-
-    # Construct transaction
-    transaction = Transaction()
-    
-    params = TransferParams(
-        from_pubkey=buyer_keypair.pubkey(),
-        to_pubkey=Pubkey.from_string("TOKEN_LIQUIDITY_POOL_ADDRESS"),  # Token exchange address
-        lamports=int(total_cost * 1e9),  # Convert SOL to lamports
-    )
-    
-    transaction.add(transfer(params))
-
-    # ✅ Sign the transaction securely
-    signed_tx = transaction.sign([buyer_keypair])
+    user_balance = await get_sol_balance(user_address)
+    total_cost = buy_amount * current_price
 
-    # ✅ Verify before broadcasting
-    if not signed_tx.verify():
-        logging.error("🚨 Buy transaction signature verification failed.")
-        await context.bot.send_message(chat_id=user_id, text="🚨 **Transaction failed! Invalid signature.**")
+    if total_cost > user_balance:
+        logging.warning(f"User {user_id} has insufficient SOL balance.")
+        messenger.send(user_id, "🚨 **Insufficient SOL balance!** Deposit more SOL to buy.", PRIORITY_FILL)
         return
 
-    # Send and confirm transaction
-    try:
-        response = await solana_client.send_transaction(signed_tx, buyer_keypair)
-        log_transaction(user_id, buy_amount, current_price, response)  # ✅ Log to DB
-
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"✅ **Auto-Buy Order Executed**\n"
-                 f"🔔 Bought {buy_amount} tokens at {current_price:.4f} SOL\n"
-                 f"📄 Transaction ID: {response}"
+    # ✅ Same quote → preflight → sign → submit path as every other order
+    result = await swap_aggregator.submit(user_id, True, total_cost)
+
+    if result["status"] == "success":
+        log_transaction(user_id, buy_amount, current_price, result["txid"])  # ✅ Log to DB
+        messenger.send(
+            user_id,
+            f"✅ **Auto-Buy Order Executed**\n"
+            f"🔔 Bought {buy_amount} tokens at {current_price:.4f} SOL\n"
+            f"📄 Transaction ID: {result['txid']}",
+            PRIORITY_FILL
         )
         logging.info(f"✅ User {user_id} bought {buy_amount} tokens at {current_price} SOL")
-
-    except Exception as e:
-        logging.error(f"Buy transaction failed: {e}")
-        await context.bot.send_message(chat_id=user_id, text="🚨 **Buy Order Failed**. Please check your wallet.")
+    else:
+        logging.error(f"Buy transaction failed: {result['message']}")
+        messenger.send(user_id, f"🚨 **Buy Order Failed**: {result['message']}", PRIORITY_FILL)
 
 async def cancel_buy(update: Update, context: CallbackContext):
     """Allows users to cancel a pending buy order"""
-    user_id = str(update.effective_user.id)
+    user_id = user_key(update.effective_user.id)
 
     if user_id not in user_buy_targets:
         await update.message.reply_text("❌ You don't have any active buy orders.")
@@ -775,36 +4380,9 @@ async def monitor_bot_wallet():
             logger.error(f"WebSocket error: {e}")
 
 
-async def monitor_market():
-    """Periodically checks if the price has hit any buy targets."""
-    while True:
-        try:
-            for user_id, buy_order in list(user_buy_targets.items()):
-                target_price = buy_order["price"]
-                buy_amount = buy_order["amount"]
-                
-                token_address = "TOKEN_ADDRESS_YOU_TRADE"
-                current_price = await get_token_price(token_address)
-
-                if current_price <= target_price:
-                    logging.info(f"🔔 Market Dip Detected! Buying for {user_id} at {current_price:.4f} SOL")
-                    await execute_buy(user_id, buy_amount, current_price)
-                    
-                    # Remove buy order after execution
-                    del user_buy_targets[user_id]
-
-            await asyncio.sleep(30)  # Check prices every 30 seconds
-
-        except Exception as e:
-            logging.error(f"Market monitoring error: {e}")
-            await asyncio.sleep(10)  # Retry after 10s if error occurs
-
-
-
-
 async def set_buy_target(update: Update, context: CallbackContext):
     """Ask the user for a buy target."""
-    user_id = str(update.effective_user.id)
+    user_id = user_key(update.effective_user.id)
     load_wallets()
 
     if user_id not in user_wallets:
@@ -817,7 +4395,7 @@ async def set_buy_target(update: Update, context: CallbackContext):
 
 async def receive_buy_target(update: Update, context: CallbackContext):
     """Process the user's buy target input."""
-    user_id = str(update.effective_user.id)
+    user_id = user_key(update.effective_user.id)
     load_wallets()
 
     try:
@@ -829,6 +4407,8 @@ async def receive_buy_target(update: Update, context: CallbackContext):
 
         # Store buy order with default amount (user can update later)
         user_buy_targets[user_id] = {"price": target_price, "amount": 1000}  # Default amount
+        if user_id in user_wallets:
+            token_accounts.request(user_wallets[user_id].address)
 
         await update.message.reply_text(
             f"✅ **Auto-Buy Order Set!**\n"
@@ -847,7 +4427,7 @@ SELL_TARGET_INPUT = range(1)
 
 async def set_sell_target(update: Update, context: CallbackContext):
     """Handles sell target setup from both button clicks and commands."""
-    user_id = str(update.effective_user.id)
+    user_id = user_key(update.effective_user.id)
     load_wallets()
 
     if user_id not in user_wallets:
@@ -860,7 +4440,7 @@ async def set_sell_target(update: Update, context: CallbackContext):
 
 async def receive_sell_target(update: Update, context: CallbackContext):
     """Process the user's sell target input."""
-    user_id = str(update.effective_user.id)
+    user_id = user_key(update.effective_user.id)
     load_wallets()
 
     try:
@@ -870,8 +4450,11 @@ async def receive_sell_target(update: Update, context: CallbackContext):
             await update.message.reply_text("❌ The target multiplier must be greater than 1.0.")
             return SELL_TARGET_INPUT  # Ask again
 
-        # Store sell target multiplier
+        # Store sell target multiplier and the entry price it is relative to
         user_sell_targets[user_id] = target_multiplier
+        entry_price = await get_token_price(TOKEN_MINT)
+        if entry_price:
+            user_entry_prices[user_id] = entry_price
 
         await update.message.reply_text(
             f"✅ **Sell Target Set!**\n"
@@ -890,7 +4473,7 @@ async def receive_sell_target(update: Update, context: CallbackContext):
     
 #     # ✅ Support both commands & button clicks
 #     query = update.callback_query
-#     user_id = str(update.effective_user.id) if update.message else str(query.from_user.id)
+#     user_id = user_key(update.effective_user.id) if update.message else user_key(query.from_user.id)
 
 #     load_wallets()
 #     if user_id not in user_wallets:
@@ -911,7 +4494,7 @@ async def receive_sell_target(update: Update, context: CallbackContext):
 
 # async def receive_target_input(update: Update, context: CallbackContext):
 #     """Step 2: Store user input and set sell target."""
-#     user_id = str(update.effective_user.id)
+#     user_id = user_key(update.effective_user.id)
 #     load_wallets()
 #     try:
 #         target = float(update.message.text)  # Get user input as float
@@ -942,7 +4525,7 @@ async def receive_sell_target(update: Update, context: CallbackContext):
 
 
 async def buy_now(update: Update, context: CallbackContext):
-    user_id = str(update.effective_user.id)
+    user_id = user_key(update.effective_user.id)
 
     if user_id not in user_wallets:
         await context.bot.send_message(chat_id=user_id, text="❌ You need to create a wallet first using /start.")
@@ -958,7 +4541,7 @@ async def buy_now(update: Update, context: CallbackContext):
 
 async def sell_now(update: Update, context: CallbackContext):
     """Execute an instant sell using the last sell target."""
-    user_id = str(update.effective_user.id)
+    user_id = user_key(update.effective_user.id)
     load_wallets()
 
     if user_id not in user_wallets:
@@ -972,7 +4555,11 @@ async def sell_now(update: Update, context: CallbackContext):
     sell_amount = user_sell_amounts.get(user_id, 100)  # Default to 100 tokens
     target_price = user_sell_targets[user_id]
 
-    result = await execute_swap(user_id, sell_amount)  # ✅ Call renamed `execute_sell()`
+    if not lifecycle.accepting:
+        await update.effective_message.reply_text("🔄 The bot is restarting. Please try again in a moment.")
+        return
+
+    result = await lifecycle.track(execute_swap(user_id, False, sell_amount))
     
     if result["status"] == "success":
         await update.effective_message.reply_text(f"✅ Sell order executed! TxID: {result['txid']}")
@@ -983,7 +4570,7 @@ async def sell_now(update: Update, context: CallbackContext):
 
 # async def set_buy_target(update: Update, context: CallbackContext):
 #     """Allows users to set a buy target for auto-purchase"""
-#     user_id = str(update.effective_user.id)
+#     user_id = user_key(update.effective_user.id)
 
 #     if user_id not in user_wallets:
 #         await context.bot.send_message(chat_id=user_id, text="❌ You need to create a wallet first using /start.")
@@ -1024,7 +4611,7 @@ async def sell_now(update: Update, context: CallbackContext):
 
 async def transaction_history(update: Update, context: CallbackContext):
     """Shows the user's last 5 transactions."""
-    user_id = str(update.effective_user.id)
+    user_id = user_key(update.effective_user.id)
     
     conn = sqlite3.connect("transactions.db")
     cursor = conn.cursor()
@@ -1046,9 +4633,101 @@ async def transaction_history(update: Update, context: CallbackContext):
 
 
 
+async def export_history(update: Update, context: CallbackContext):
+    """Send the user's full fill history as a file (/export [csv|json] [from] [to])."""
+    user_id = user_key(update.effective_user.id)
+    args = list(context.args or [])
+    fmt = args.pop(0).lower() if args and args[0].lower() in EXPORT_FORMATS else "csv"
+
+    try:
+        start, end = parse_export_range(*args[:2])
+    except ValueError:
+        await update.message.reply_text("Usage: /export [csv|json] [YYYY-MM-DD] [YYYY-MM-DD]")
+        return
+
+    path, count = await asyncio.to_thread(write_fills_export, user_id, fmt, start, end)
+    try:
+        if not count:
+            await update.message.reply_text("📜 No fills in that range.")
+            return
+        with open(path, "rb") as f:
+            await update.message.reply_document(
+                document=f,
+                filename=f"fills-{user_id}.{fmt}",
+                caption=f"📜 {count} fills"
+            )
+    finally:
+        os.remove(path)
+
+
+async def dca_command(update: Update, context: CallbackContext):
+    """Schedule a recurring buy (/dca <sol_amount> <interval> [runs])."""
+    user_id = user_key(update.effective_user.id)
+    if user_id not in user_wallets:
+        await update.message.reply_text("❌ You need a wallet first! Use /start")
+        return
+
+    try:
+        sol_amount = float(context.args[0])
+        interval_text = context.args[1]
+        max_runs = int(context.args[2]) if len(context.args) > 2 else None
+        if not math.isfinite(sol_amount) or sol_amount <= 0 or (max_runs is not None and max_runs <= 0):
+            raise ValueError
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /dca <sol_amount> <interval e.g. 30m|4h|1d> [runs]")
+        return
+
+    try:
+        interval = parse_interval(interval_text)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    if len(dca_scheduler.for_user(user_id)) >= DCA_MAX_PER_USER:
+        await update.message.reply_text(f"❌ You already have {DCA_MAX_PER_USER} recurring buys. Cancel one with /dca_cancel.")
+        return
+
+    order = dca_scheduler.create(user_id, sol_amount, interval, max_runs)
+    token_accounts.request(user_wallets[user_id].address)
+    await update.message.reply_text(
+        f"🔁 DCA #{order['id']}: buy {sol_amount} SOL every {context.args[1]}"
+        f"{f' for {max_runs} runs' if max_runs else ''}.\n"
+        f"⏰ First run: {time.strftime('%Y-%m-%d %H:%M UTC', time.gmtime(order['next_run']))}"
+    )
+
+
+async def dca_list(update: Update, context: CallbackContext):
+    """List the user's active recurring buys."""
+    orders = dca_scheduler.for_user(user_key(update.effective_user.id))
+    if not orders:
+        await update.message.reply_text("🔁 No recurring buys. Create one with /dca.")
+        return
+
+    lines = [
+        f"#{o['id']}: {o['sol_amount']} SOL every {o['interval_seconds'] // 60}m, "
+        f"{o['runs']}{'/' + str(o['max_runs']) if o['max_runs'] else ''} runs, "
+        f"next {time.strftime('%Y-%m-%d %H:%M UTC', time.gmtime(o['next_run']))}"
+        for o in orders
+    ]
+    await update.message.reply_text("🔁 Recurring buys:\n" + "\n".join(lines))
+
+
+async def dca_cancel(update: Update, context: CallbackContext):
+    """Cancel a recurring buy (/dca_cancel <id>)."""
+    try:
+        order_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /dca_cancel <id>")
+        return
+
+    if dca_scheduler.cancel(user_key(update.effective_user.id), order_id):
+        await update.message.reply_text(f"✅ DCA #{order_id} cancelled.")
+    else:
+        await update.message.reply_text(f"❌ No active DCA #{order_id}.")
+
+
 async def cancel_sell(update: Update, context: CallbackContext):
     """Allows users to cancel their pending sell order"""
-    user_id = str(update.effective_user.id)
+    user_id = user_key(update.effective_user.id)
 
     if user_id not in user_sell_targets:
         await update.message.reply_text("❌ You don't have any active sell orders.")
@@ -1056,15 +4735,212 @@ async def cancel_sell(update: Update, context: CallbackContext):
 
     # Remove sell target & amount
     del user_sell_targets[user_id]
-    del user_sell_amounts[user_id]
+    user_sell_amounts.pop(user_id, None)
     
     await update.message.reply_text("✅ Your sell order has been canceled.")
     logging.info(f"User {user_id} canceled their sell order.")
 
 
+async def set_stop_loss(update: Update, context: CallbackContext):
+    """Place a stop-loss: /stop_loss <price_in_sol> [amount]"""
+    user_id = user_key(update.effective_user.id)
+
+    if user_id not in user_wallets:
+        await update.message.reply_text("❌ No wallet found. Use /start to create one.")
+        return
+
+    try:
+        stop_price = float(context.args[0])
+        amount = float(context.args[1]) if len(context.args) > 1 else 0.0
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /stop_loss <price_in_sol> [amount]")
+        return
+
+    if not math.isfinite(stop_price) or stop_price <= 0 or not math.isfinite(amount) or amount < 0:
+        await update.message.reply_text("❌ The stop price must be positive and below the current price.")
+        return
+
+    current_price = await get_token_price(TOKEN_MINT)
+    if not current_price:
+        await update.message.reply_text("⚠️ Price unavailable right now. Please try again shortly.")
+        return
+    if stop_price >= current_price:
+        await update.message.reply_text("❌ The stop price must be positive and below the current price.")
+        return
+
+    stop_orders.place(user_id, STOP_LOSS, amount, current_price, stop_price=stop_price)
+    await update.message.reply_text(
+        f"✅ **Stop-Loss Set!**\n"
+        f"🔹 Sell {'all tokens' if not amount else f'{amount} tokens'} if the price falls to **{stop_price:.6f} SOL**."
+    )
+    logging.info(f"User {user_id} set stop-loss at {stop_price} SOL")
+
+
+async def set_trailing_stop(update: Update, context: CallbackContext):
+    """Place a trailing stop: /trailing_stop <percent> [amount]"""
+    user_id = user_key(update.effective_user.id)
+
+    if user_id not in user_wallets:
+        await update.message.reply_text("❌ No wallet found. Use /start to create one.")
+        return
+
+    try:
+        trail_pct = float(context.args[0]) / 100
+        amount = float(context.args[1]) if len(context.args) > 1 else 0.0
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /trailing_stop <percent> [amount]")
+        return
+
+    if not 0 < trail_pct < 1 or not math.isfinite(amount) or amount < 0:
+        await update.message.reply_text("❌ The trailing percentage must be between 0 and 100, and the amount non-negative.")
+        return
+
+    current_price = await get_token_price(TOKEN_MINT)
+    if not current_price:
+        await update.message.reply_text("⚠️ Price unavailable right now. Please try again shortly.")
+        return
+
+    stop_orders.place(user_id, TRAILING_STOP, amount, current_price, trail_pct=trail_pct)
+    await update.message.reply_text(
+        f"✅ **Trailing Stop Set!**\n"
+        f"🔹 Sell if the price drops **{trail_pct * 100:.1f}%** below its highest point "
+        f"(currently triggers at **{current_price * (1 - trail_pct):.6f} SOL**)."
+    )
+    logging.info(f"User {user_id} set trailing stop at {trail_pct * 100:.1f}%")
+
+
+async def set_signal(update: Update, context: CallbackContext):
+    """Place an indicator order: /signal <buy|sell> <amount> <indicator> <op> <value|indicator>"""
+    user_id = user_key(update.effective_user.id)
+
+    if user_id not in user_wallets:
+        await update.message.reply_text("❌ No wallet found. Use /start to create one.")
+        return
+
+    usage = (
+        "Usage: /signal <buy|sell> <amount> <indicator> <op> <value|indicator>\n"
+        f"Indicators: {', '.join(SIGNAL_INDICATORS)}\n"
+        f"Ops: {', '.join(SIGNAL_OPS)}\n"
+        "e.g. /signal buy 0.5 rsi14 < 30 (amount in SOL) or /signal sell 0 ema12 crosses_below ema26 (0 = all tokens)"
+    )
+    try:
+        side, amount, lhs, op, rhs = context.args
+        amount = float(amount)
+        if rhs not in INDICATOR_IDS and not math.isfinite(float(rhs)):
+            raise ValueError(rhs)
+    except ValueError:
+        await update.message.reply_text(usage)
+        return
+    if not math.isfinite(amount) or side not in ("buy", "sell") or lhs not in INDICATOR_IDS or op not in SIGNAL_OPS or amount < 0 or (side == "buy" and not amount):
+        await update.message.reply_text(usage)
+        return
+    if len(signal_orders.for_user(user_id)) >= SIGNAL_MAX_PER_USER:
+        await update.message.reply_text(f"❌ You already have {SIGNAL_MAX_PER_USER} signal orders. Cancel one with /signal_cancel.")
+        return
+
+    order_id = signal_orders.place(user_id, side, amount, lhs, op, rhs)
+    if side == "buy":
+        token_accounts.request(user_wallets[user_id].address)
+    current = signal_engine.get(TOKEN_MINT).snapshot()[lhs]
+    await update.message.reply_text(
+        f"✅ Signal #{order_id}: {side} {amount or 'all'} when {lhs} {op} {rhs}\n"
+        f"📊 {lhs} is {'warming up' if current is None else f'{current:.6g}'} now."
+    )
+    logging.info(f"User {user_id} placed signal #{order_id}: {side} {amount} when {lhs} {op} {rhs}")
+
+
+async def list_signals(update: Update, context: CallbackContext):
+    """Show the user's signal orders and the current indicator values."""
+    orders = signal_orders.for_user(user_key(update.effective_user.id))
+    values = signal_engine.get(TOKEN_MINT).snapshot()
+    lines = [f"#{i}: {o['side']} {o['amount'] or 'all'} when {o['lhs']} {o['op']} {o['rhs'] or o['threshold']}" for i, o in orders]
+    lines.append("\n📊 " + ", ".join(f"{name} {'…' if v is None else f'{v:.6g}'}" for name, v in values.items()))
+    await update.message.reply_text(("📡 Signal orders:\n" if orders else "📡 No signal orders.\n") + "\n".join(lines))
+
+
+async def cancel_signal(update: Update, context: CallbackContext):
+    """Cancel a signal order (/signal_cancel <id>)."""
+    try:
+        order_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /signal_cancel <id>")
+        return
+
+    if signal_orders.cancel(order_id, user_key(update.effective_user.id)):
+        await update.message.reply_text(f"✅ Signal #{order_id} canceled.")
+    else:
+        await update.message.reply_text(f"❌ No signal order #{order_id}.")
+
+
+async def set_price_alert(update: Update, context: CallbackContext):
+    """Subscribe to a price level without trading: /alert <price> [above|below]"""
+    user_id = user_key(update.effective_user.id)
+    usage = "Usage: /alert <price> [above|below] (direction defaults to the side of the current price)"
+    try:
+        price = float(context.args[0])
+        direction = context.args[1].lower() if len(context.args) > 1 else None
+    except (IndexError, ValueError):
+        await update.message.reply_text(usage)
+        return
+    if not math.isfinite(price) or price <= 0 or direction not in (None, ALERT_ABOVE, ALERT_BELOW):
+        await update.message.reply_text(usage)
+        return
+
+    current = signal_engine.get(TOKEN_MINT).last_price
+    if direction is None:
+        if current is None:
+            await update.message.reply_text("❌ No price yet; say above or below, e.g. /alert 0.002 above")
+            return
+        direction = ALERT_ABOVE if price > current else ALERT_BELOW
+    if len(price_alerts.by_user.get(user_id, ())) >= ALERT_MAX_PER_USER:
+        await update.message.reply_text(f"❌ You already have {ALERT_MAX_PER_USER} alerts. Remove one with /alert_cancel.")
+        return
+
+    alert_id = price_alerts.place(user_id, price, direction)
+    now = "" if current is None else f"\n📊 Price is {current:.6g} SOL now."
+    await update.message.reply_text(f"🔔 Alert #{alert_id}: when the price is {direction} {price:.6g} SOL.{now}")
+    logging.info(f"User {user_id} set price alert #{alert_id}: {direction} {price}")
+
+
+async def list_price_alerts(update: Update, context: CallbackContext):
+    """Show the user's price alerts."""
+    alerts = price_alerts.for_user(user_key(update.effective_user.id))
+    if not alerts:
+        await update.message.reply_text("🔔 No price alerts. Add one with /alert <price>.")
+        return
+    lines = [f"#{i}: {a['direction']} {a['price']:.6g} SOL" for i, a in alerts]
+    await update.message.reply_text("🔔 Price alerts:\n" + "\n".join(lines))
+
+
+async def cancel_price_alert(update: Update, context: CallbackContext):
+    """Remove a price alert (/alert_cancel <id>)."""
+    try:
+        alert_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /alert_cancel <id>")
+        return
+
+    if price_alerts.cancel(alert_id, user_key(update.effective_user.id)):
+        await update.message.reply_text(f"✅ Alert #{alert_id} removed.")
+    else:
+        await update.message.reply_text(f"❌ No alert #{alert_id}.")
+
+
+async def cancel_stop(update: Update, context: CallbackContext):
+    """Cancel the user's stop-loss or trailing stop."""
+    user_id = user_key(update.effective_user.id)
+
+    if not stop_orders.cancel(user_id):
+        await update.message.reply_text("❌ You don't have an active stop order.")
+        return
+
+    await update.message.reply_text("✅ Your stop order has been canceled.")
+    logging.info(f"User {user_id} canceled their stop order.")
+
+
 
 async def active_trades(update: Update, context: CallbackContext):
-    user_id = update.effective_user.id
+    user_id = user_key(update.effective_user.id)
     trades = user_active_trades.get(user_id, [])
     if not trades:
         await update.message.reply_text("No active trades.")
@@ -1073,20 +4949,145 @@ async def active_trades(update: Update, context: CallbackContext):
         await update.message.reply_text(f"Active Trades:\n{trade_list}")
 
 
+async def portfolio_command(update: Update, context: CallbackContext):
+    """Show position, average entry and PnL from the running aggregates and cached price."""
+    user_id = user_key(update.effective_user.id)
+    position = portfolio.get(user_id)
+
+    if not position.fill_count:
+        await update.effective_message.reply_text("📊 No trades yet. Your portfolio will appear after your first fill.")
+        return
+
+    price = candle_store.last_price(TOKEN_MINT)
+    message = (
+        f"📊 **Portfolio**\n\n"
+        f"🎯 **Position:** {position.position:.4f} tokens\n"
+        f"📌 **Avg Entry:** {position.avg_entry:.9f} SOL\n"
+        f"💼 **Cost Basis:** {position.cost_basis:.4f} SOL\n"
+        f"✅ **Realized PnL:** {position.realized_pnl:+.4f} SOL"
+    )
+    if price is not None:
+        message += (
+            f"\n💲 **Value:** {position.position * price:.4f} SOL @ {price:.9f}\n"
+            f"📈 **Unrealized PnL:** {position.unrealized_pnl(price):+.4f} SOL"
+        )
+
+    await update.effective_message.reply_text(message, parse_mode="Markdown")
+
+
+async def portfolio_check(update: Update, context: CallbackContext):
+    """Admin: compare portfolio aggregates against the fill ledger (/portfolio_check [fix])."""
+    if user_key(update.effective_user.id) not in ADMIN_USER_IDS:
+        await update.message.reply_text("⛔ Admins only.")
+        return
+
+    apply = bool(context.args) and context.args[0] == "fix"
+    mismatches = await portfolio.rebuild_from_ledger(apply)
+
+    if not mismatches:
+        await update.message.reply_text("✅ Portfolio aggregates match the ledger.")
+        return
+
+    lines = [f"{uid}: stored {stored.position:.4f} / ledger {expected.position:.4f}" for uid, stored, expected in mismatches[:20]]
+    await update.message.reply_text(
+        f"⚠️ {len(mismatches)} mismatched users{' (fixed)' if apply else ''}:\n" + "\n".join(lines)
+    )
+
+
+async def admin_job_command(update: Update, context: CallbackContext):
+    """Admin: /admin_audit, /admin_sweep or /admin_topup across all custodial wallets."""
+    user_id = user_key(update.effective_user.id)
+    if user_id not in ADMIN_USER_IDS:
+        await update.message.reply_text("⛔ Admins only.")
+        return
+
+    kind = update.message.text.split()[0].lstrip("/").split("@")[0].replace("admin_", "")
+    if kind not in ADMIN_JOB_KINDS:
+        await update.message.reply_text(f"Usage: /admin_{'|/admin_'.join(ADMIN_JOB_KINDS)}")
+        return
+    if kind == "sweep" and not ADMIN_WALLET:
+        await update.message.reply_text("❌ ADMIN_WALLET_ADDRESS is not configured.")
+        return
+
+    load_wallets()
+    job = AdminJob.create(kind, created_by=user_id)
+    lifecycle.spawn(run_admin_job(job))
+    await update.message.reply_text(f"🛠️ Started `{job.job_id}` over {len(user_wallets)} wallets.", parse_mode="Markdown")
+
+
+async def admin_resume(update: Update, context: CallbackContext):
+    """Admin: resume a paused bulk job from its last checkpoint (/admin_resume <job_id>)."""
+    if user_key(update.effective_user.id) not in ADMIN_USER_IDS:
+        await update.message.reply_text("⛔ Admins only.")
+        return
+
+    job = AdminJob.load(context.args[0]) if context.args else None
+    if not job:
+        await update.message.reply_text("Usage: /admin_resume <job_id>")
+        return
+    if job.status == "done":
+        await update.message.reply_text(f"✅ `{job.job_id}` already finished.", parse_mode="Markdown")
+        return
+
+    load_wallets()
+    lifecycle.spawn(run_admin_job(job))
+    await update.message.reply_text(f"🛠️ Resuming `{job.job_id}` at {job.cursor}/{job.total}.", parse_mode="Markdown")
+
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+async def price_command(update: Update, context: CallbackContext):
+    """Show the latest oracle price and recent change from the candle store (no API call)."""
+    price = candle_store.last_price(TOKEN_MINT)
+    if price is None:
+        await update.effective_message.reply_text("⚠️ No price data yet. Please try again shortly.")
+        return
+
+    message = f"💲 **Price:** {price:.9f} SOL"
+    for label, resolution, count in (("1h", 60, 60), ("24h", 3600, 24)):
+        candles = candle_store.candles(TOKEN_MINT, resolution, count)
+        if len(candles) > 1 and candles[0][1]:
+            change = (price / candles[0][1] - 1) * 100
+            message += f"\n📊 **{label}:** {change:+.2f}%"
+
+    await update.effective_message.reply_text(message, parse_mode="Markdown")
+
+
+async def chart_command(update: Update, context: CallbackContext):
+    """Render a text chart of recent candles: /chart [1s|1m|5m|1h]"""
+    label = context.args[0] if context.args else "5m"
+    resolution = CANDLE_LABELS.get(label)
+    if resolution is None:
+        await update.effective_message.reply_text(f"Usage: /chart [{'|'.join(CANDLE_LABELS)}]")
+        return
+
+    candles = candle_store.candles(TOKEN_MINT, resolution, 32)
+    if len(candles) < 2:
+        await update.effective_message.reply_text("⚠️ Not enough price history yet.")
+        return
+
+    closes = candles[:, 4]
+    low, high = float(candles[:, 3].min()), float(candles[:, 2].max())
+    span = (high - low) or 1.0
+    spark = "".join(SPARK_CHARS[int((c - low) / span * (len(SPARK_CHARS) - 1))] for c in closes)
+
+    await update.effective_message.reply_text(
+        f"📈 {label} chart ({len(candles)} candles)\n"
+        f"`{spark}`\n"
+        f"High: {high:.9f} SOL\nLow: {low:.9f} SOL\nLast: {closes[-1]:.9f} SOL",
+        parse_mode="Markdown"
+    )
+
+
 async def help_command(update: Update, context: CallbackContext):
-    message = "\U0001F4AC **Help Menu:**\n\n"
-    message += "/start - Initialize wallet\n"
-    message += "/set_target <multiplier> - Set sell target\n"
-    message += "/active_trades - View active trades\n"
-    message += "/withdraw <amount> <recipient_address> - Withdraw SOL\n"
-    message += "Use the buttons to navigate."
-    await update.message.reply_text(message)
+    await update.effective_message.reply_text(HELP_TEXT)
 
 async def view_solscan(update: Update, context: CallbackContext):
     query = update.callback_query
-    user_id = query.from_user.id
+    user_id = user_key(query.from_user.id)
     if user_id in user_wallets:
-        wallet_address = user_wallets[user_id]["address"]
+        wallet_address = user_wallets[user_id].address
         solscan_url = f"https://solscan.io/account/{wallet_address}"
         await query.message.reply_text(
             f"🔍 View your wallet on Solscan:\n{solscan_url}",
@@ -1101,21 +5102,54 @@ async def view_solscan(update: Update, context: CallbackContext):
 
 # ✅ Check Solana Transaction Validity
 async def check_transaction(transaction_id):
-    load_wallets()
-    async with AsyncClient(SOLANA_RPC_URL) as client:
-        response = await client.get_confirmed_transaction(transaction_id)
-        return bool(response and response.get("result"))
+    response = await resilient_call(
+        "rpc", solana_client.get_transaction, Signature.from_string(transaction_id),
+        max_supported_transaction_version=0, idempotent=True
+    )
+    return bool(response and response.value)
+
+
+
+
+async def cancel_reset(update: Update, context: CallbackContext):
+    await update.callback_query.message.reply_text("Wallet reset canceled.")
 
 
+# ✅ Callback dispatch table, built once at import
+BUTTON_ACTIONS = {
+    "wallet": wallet_info,
+    "deposit": deposit_info,
+    "set_sell_target": set_sell_target,
+    "set_buy_target": set_buy_target,
+    "cancel_sell": cancel_sell,
+    "transaction_history": transaction_history,
+    "withdraw_sol": withdraw_phantom,
+    "active_trades": active_trades,
+    "help": help_command,
+    "reset_wallet": confirm_reset_wallet,
+    "cancel_reset": cancel_reset,
+    "view_solscan": view_solscan,
+    "buy_now": buy_now,
+    "sell_now": sell_now,
+}
 
 
 async def handle_button_click(update: Update, context: CallbackContext):
     """Handles all button interactions."""
     query = update.callback_query
-    await query.answer()
-    user_id = str(query.from_user.id)  # Define once
+    user_id = user_key(query.from_user.id)  # Define once
+    action_key = f"{user_id}:{query.data}"  # ✅ Idempotency key for double taps
+
+    running = inflight.join(action_key) if query.data in EXCLUSIVE_ACTIONS else None
+    if running is not None:
+        # ✅ Duplicate tap: acknowledge immediately and ride along with the running request
+        await query.answer("⏳ Already processing your previous request...")
+        await asyncio.shield(running)
+        return
 
+    await query.answer()
     load_wallets()
+    deposit_scanner.touch(user_id)  # ✅ Interactive users get their deposits picked up every scan round
 
     if query.data == "deposit":
         # ✅ Generate the dynamic MoonPay link
@@ -1123,8 +5157,7 @@ async def handle_button_click(update: Update, context: CallbackContext):
 
         # ✅ Send a message with a direct link
         await query.message.reply_text(
-            "💰 **Deposit SOL**\n\n"
-            "Click the button below to buy SOL and deposit directly into your wallet.",
+            DEPOSIT_TEXT,
             parse_mode="Markdown",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("💳 Buy SOL Now", url=moonpay_link)]
@@ -1132,35 +5165,21 @@ async def handle_button_click(update: Update, context: CallbackContext):
         )
         return  # ✅ Exit to avoid calling unknown actions
 
-    # ✅ Button actions mapped to functions
-    button_actions = {
-        "wallet": wallet_info,
-        "deposit": deposit_info,
-        "set_sell_target": set_sell_target,
-        "set_buy_target": set_buy_target,
-        "cancel_sell": cancel_sell,
-        "transaction_history": transaction_history,
-        "withdraw_sol": withdraw_phantom,
-        "active_trades": active_trades,
-        "help": help_command,
-        "reset_wallet": confirm_reset_wallet,
-        "cancel_reset": lambda q, c: q.message.reply_text("Wallet reset canceled."),
-        "view_solscan": view_solscan,
-        "buy_now": buy_now,
-        "sell_now": sell_now,
-    }
-
-    if query.data in button_actions:
-        await button_actions[query.data](update, context)
-    else:
+    action = BUTTON_ACTIONS.get(query.data)
+    if action is None:
         await query.message.reply_text("❌ Unknown action. Please try again.")
+    elif query.data in EXCLUSIVE_ACTIONS:
+        await inflight.run(action_key, lambda: action(update, context))
+    else:
+        await action(update, context)
 
 
 def run_flask():  
     """Starts Flask with Gunicorn in production or Waitress in local dev."""
     PORT = int(os.getenv("PORT", 5000))  # ✅ Ensure correct port binding
 
-    if os.getenv("RAILWAY_ENV"):  # ✅ Detect Railway environment correctly
+    # Gunicorn installs signal handlers, which only works on the main thread
+    if os.getenv("RAILWAY_ENV") and threading.current_thread() is threading.main_thread():  # ✅ Detect Railway environment correctly
         from gunicorn.app.base import BaseApplication  
 
         class FlaskApp(BaseApplication):  
@@ -1193,8 +5212,404 @@ conv_handler_sell = ConversationHandler(
 )
 
 
-async def run_telegram_bot():
-    """Starts the bot using polling"""
+# ✅ Lifecycle settings
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", 20))
+STATE_CHECKPOINT_FILE = "bot_state.json"
+CONFIRMATION_TIMEOUT = 120  # Seconds before an unseen transaction is reported as dropped
+
+
+class LifecycleManager:
+    """Graceful shutdown and restart: drain in-flight orders, persist state, resume confirmations."""
+    def __init__(self):
+        self.accepting = True   # New triggers, DCA runs and trade commands
+        self.executing = True   # Swap submissions; stays open while already-triggered orders drain
+        self.in_flight = set()
+        self.background = []
+        self.pending_confirmations = state_journal.table("pending_confirmations")  # txid -> {"user_ids", "side", "submitted_at"}
+        self.stop_event = asyncio.Event()
+
+    def spawn(self, coro):
+        """Start a long-running background task that is cancelled on shutdown."""
+        task = asyncio.create_task(coro)
+        self.background.append(task)
+        return task
+
+    def track(self, coro):
+        """Run order execution as a task that shutdown waits for (and handler cancellation cannot kill)."""
+        task = asyncio.ensure_future(coro)
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+        return task
+
+    def watch(self, txid: str, user_ids, side: str):
+        """Track a submitted transaction; a pooled swap notifies every user in the batch."""
+        user_ids = [user_ids] if isinstance(user_ids, str) else list(user_ids)
+        self.pending_confirmations[txid] = {"user_ids": user_ids, "side": side, "submitted_at": time.time()}
+
+    def request_shutdown(self, reason="signal"):
+        if not self.stop_event.is_set():
+            logging.info(f"🛑 Shutdown requested ({reason}); no new triggers will be accepted.")
+            self.accepting = False
+            self.stop_event.set()
+
+    def install_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.request_shutdown, sig.name)
+            except (NotImplementedError, RuntimeError):
+                signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(self.request_shutdown, "signal"))
+
+    def restore_checkpoint(self):
+        started = time.perf_counter()
+        try:
+            replayed = state_journal.recover()
+            logging.info(f"✅ Recovered state journal ({replayed} records replayed) in {time.perf_counter() - started:.3f}s")
+        except (OSError, json.JSONDecodeError, KeyError) as e:
+            logging.error(f"🚨 State journal unreadable: {str(e)}")
+
+        if not os.path.exists(STATE_CHECKPOINT_FILE):
+            return
+        try:
+            with open(STATE_CHECKPOINT_FILE) as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"🚨 State checkpoint unreadable: {str(e)}")
+            return
+
+        # Checkpoints from before the journal carry the dict state (and stop orders); import them once
+        for name, table in state_journal.tables.items():
+            if name in state:
+                table.update(state[name])
+        state_journal.flush()
+        os.replace(STATE_CHECKPOINT_FILE, STATE_CHECKPOINT_FILE + ".migrated")
+        logging.info(f"✅ Imported legacy checkpoint: {len(state.get('stop_orders', {}))} stop orders, "
+                     f"{len(self.pending_confirmations)} pending confirmations")
+
+    async def confirmation_monitor(self):
+        """Poll signature statuses for submitted swaps, including ones restored after a restart."""
+        confirmed = (TransactionConfirmationStatus.Confirmed, TransactionConfirmationStatus.Finalized)
+        while True:
+            try:
+                txids = list(self.pending_confirmations)[:256]
+                if txids:
+                    response = await solana_client.get_signature_statuses(
+                        [Signature.from_string(t) for t in txids], search_transaction_history=True
+                    )
+                    for txid, status in zip(txids, response.value):
+                        meta = self.pending_confirmations[txid]
+                        if status is not None and status.confirmation_status in confirmed:
+                            del self.pending_confirmations[txid]
+                            outcome = "failed" if status.err else "confirmed"
+                        elif time.time() - meta["submitted_at"] > CONFIRMATION_TIMEOUT:
+                            del self.pending_confirmations[txid]
+                            outcome = "timeout"
+                        else:
+                            continue
+                        for user_id in meta.get("user_ids") or [meta["user_id"]]:  # "user_id": entries journaled before batches
+                            await event_bus.publish(TxConfirmed(user_id, meta["side"], txid, outcome))
+            except Exception as e:
+                logger.error(f"Confirmation monitor error: {str(e)}")
+            await asyncio.sleep(2)
+
+    async def drain_messages(self, deadline: float):
+        while messenger.backlog() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+    async def shutdown(self):
+        """Stop triggers, drain executions up to the deadline, then flush every buffer.
+
+        Only the trigger stage stops first: orders already triggered were removed from
+        their books, so swaps stay open until their queue is drained and executed.
+        """
+        self.accepting = False
+        deadline = time.monotonic() + SHUTDOWN_DRAIN_SECONDS
+
+        if not await event_bus.drain(max(0.0, deadline - time.monotonic())):  # Queued triggers and submissions first
+            logging.warning("⚠️ Event queues not empty at the drain deadline")
+        await swap_aggregator.flush_all()
+        if self.in_flight:
+            logging.info(f"⏳ Draining {len(self.in_flight)} in-flight executions...")
+            _, still_running = await asyncio.wait(self.in_flight, timeout=max(0.0, deadline - time.monotonic()))
+            if still_running:
+                logging.warning(f"⚠️ {len(still_running)} executions still running at the drain deadline")
+        self.executing = False
+        await self.drain_messages(deadline)
+        await api_server.stop()
+
+        for task in self.background:
+            task.cancel()
+
+        candle_store.flush()
+        wallet_pool.stop()
+        save_wallets()
+        state_journal.close()
+        await solana_client.close()
+        for handler in logging.getLogger().handlers:
+            handler.flush()
+        logging.info("✅ Shutdown complete; state checkpointed.")
+
+
+lifecycle = LifecycleManager()
+
+
+# ✅ Read API settings
+API_PORT = int(os.getenv("API_PORT", 8081))
+API_CACHE_TTL = float(os.getenv("API_CACHE_TTL", 2))  # Seconds a rendered response is reused
+API_CACHE_ENTRIES = 2048
+API_PAGE_SIZE = 100
+API_PAGE_MAX = 1000
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def page_after(keys: list, cursor, limit: int):
+    """Keyset page over sorted `keys`: up to `limit` keys after `cursor`, plus the next cursor (or None)."""
+    start = bisect.bisect_right(keys, cursor) if cursor else 0
+    chunk = keys[start:start + limit]
+    return chunk, (chunk[-1] if start + limit < len(keys) else None)
+
+
+def fetch_fills_page(user_id: str, cursor, limit: int):
+    """Newest-first page of a user's fills, keyed on (timestamp, id) so the user index serves it."""
+    query = "SELECT id, timestamp, side, token_amount, sol_amount, price, transaction_id, batch_id FROM fills WHERE user_id = ?"
+    params = [user_id]
+    if cursor:
+        timestamp, _, fill_id = cursor.rpartition("~")
+        query += " AND (timestamp, id) < (?, ?)"
+        params += [timestamp, int(fill_id)]
+    query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    conn = sqlite3.connect("trading_bot.db")
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = [dict(row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (f"{rows[-1]['timestamp']}~{rows[-1]['id']}" if more else None)
+
+
+class ReadApi:
+    """Read-only JSON API (raw ASGI) for dashboards and partners, served on the bot's own loop.
+
+    Every view reads in-memory state (cached wallet balances, order books, portfolio
+    aggregates); fills come from an indexed SQLite page read off the loop. Nothing here
+    calls RPC or decrypts the wallet file. Rendered bodies are cached for API_CACHE_TTL
+    and carry a content ETag, so polling clients mostly get 304s.
+    """
+    def __init__(self):
+        self.routes = [
+            (re.compile(r"^/api/stats$"), self.stats_view),
+            (re.compile(r"^/api/users$"), self.users_view),
+            (re.compile(r"^/api/users/(\d+)$"), self.user_view),
+            (re.compile(r"^/api/users/(\d+)/orders$"), self.orders_view),
+            (re.compile(r"^/api/users/(\d+)/fills$"), self.fills_view),
+        ]
+        self.cache = OrderedDict()  # (path, query) -> (expires_at, body, etag)
+        self.user_ids = (0.0, [])  # (expires_at, sorted user keys)
+        self.stats = {"requests": 0, "cache_hits": 0, "not_modified": 0, "errors": 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        self.stats["requests"] += 1
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        try:
+            status, body, etag = await self.render(scope, headers)
+        except ApiError as e:
+            self.stats["errors"] += 1
+            status, body, etag = e.status, json.dumps({"error": str(e)}).encode(), None
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"🚨 Read API error on {scope['path']}: {str(e)}")
+            status, body, etag = 500, b'{"error":"internal error"}', None
+
+        response_headers = [(b"content-type", b"application/json")]
+        if etag:
+            response_headers += [(b"etag", etag.encode()), (b"cache-control", f"private, max-age={int(API_CACHE_TTL)}".encode())]
+            if etag in headers.get("if-none-match", ""):
+                self.stats["not_modified"] += 1
+                status, body = 304, b""
+        response_headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": response_headers})
+        await send({"type": "http.response.body", "body": body if scope["method"] != "HEAD" else b""})
+
+    async def render(self, scope, headers):
+        if scope["method"] not in ("GET", "HEAD"):
+            raise ApiError(405, "method not allowed")
+        supplied = headers.get("authorization", "").removeprefix("Bearer ").strip()
+        if not ADMIN_API_TOKEN or not hmac.compare_digest(supplied, ADMIN_API_TOKEN):
+            raise ApiError(401, "unauthorized")
+
+        key = (scope["path"], scope["query_string"])
+        now = time.monotonic()
+        cached = self.cache.get(key)
+        if cached and cached[0] > now:
+            self.stats["cache_hits"] += 1
+            return 200, cached[1], cached[2]
+
+        for pattern, view in self.routes:
+            match = pattern.match(scope["path"])
+            if match:
+                break
+        else:
+            raise ApiError(404, "not found")
+        params = dict(urllib.parse.parse_qsl(scope["query_string"].decode("latin-1")))
+        payload = await view(*match.groups(), params=params)
+
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        self.cache[key] = (now + API_CACHE_TTL, body, etag)
+        self.cache.move_to_end(key)
+        if len(self.cache) > API_CACHE_ENTRIES:
+            self.cache.popitem(last=False)
+        return 200, body, etag
+
+    @staticmethod
+    def limit(params) -> int:
+        try:
+            return min(max(int(params.get("limit", API_PAGE_SIZE)), 1), API_PAGE_MAX)
+        except ValueError:
+            raise ApiError(400, "limit must be an integer")
+
+    def sorted_user_ids(self) -> list:
+        expires_at, ids = self.user_ids
+        if expires_at <= time.monotonic():
+            ids = sorted(user_wallets)
+            self.user_ids = (time.monotonic() + API_CACHE_TTL, ids)
+        return ids
+
+    @staticmethod
+    def wallet_summary(user_id: str, wallet: UserWallet, price) -> dict:
+        position = portfolio.get(user_id)
+        return {
+            "user_id": user_id,
+            "address": wallet.address,
+            "sol_balance": wallet.sol_balance,
+            "token_balance": wallet.token_balance,
+            "recent_transactions": list(wallet.transactions),
+            "portfolio": {
+                "position": position.position,
+                "avg_entry": position.avg_entry,
+                "realized_pnl": position.realized_pnl,
+                "unrealized_pnl": position.unrealized_pnl(price) if price else None,
+                "fill_count": position.fill_count,
+            },
+        }
+
+    async def stats_view(self, params):
+        return {
+            "wallets": len(user_wallets),
+            "price": signal_engine.get(TOKEN_MINT).last_price,
+            "orders": {
+                "sell_targets": len(user_sell_targets),
+                "buy_targets": len(user_buy_targets),
+                "stop_orders": len(stop_orders),
+                "signal_orders": len(signal_orders),
+                "dca": len(dca_scheduler.orders),
+                "price_alerts": len(price_alerts),
+            },
+        }
+
+    async def users_view(self, params):
+        ids, next_cursor = page_after(self.sorted_user_ids(), params.get("cursor"), self.limit(params))
+        price = signal_engine.get(TOKEN_MINT).last_price
+        users = [self.wallet_summary(uid, user_wallets[uid], price) for uid in ids if uid in user_wallets]
+        return {"users": users, "next_cursor": next_cursor}
+
+    async def user_view(self, user_id, params):
+        wallet = user_wallets.get(user_id)
+        if wallet is None:
+            raise ApiError(404, "unknown user")
+        return self.wallet_summary(user_id, wallet, signal_engine.get(TOKEN_MINT).last_price)
+
+    async def orders_view(self, user_id, params):
+        if user_id not in user_wallets:
+            raise ApiError(404, "unknown user")
+        stop = stop_orders.get(user_id)
+        return {
+            "sell_target": user_sell_targets.get(user_id),
+            "entry_price": user_entry_prices.get(user_id),
+            "buy_target": user_buy_targets.get(user_id),
+            "stop_order": {**stop, "kind": STOP_ORDER_NAMES[stop["kind"]]} if stop else None,
+            "signals": [{"id": i, **spec} for i, spec in signal_orders.for_user(user_id)],
+            "dca": dca_scheduler.for_user(user_id),
+            "price_alerts": [{"id": i, **spec} for i, spec in price_alerts.for_user(user_id)],
+        }
+
+    async def fills_view(self, user_id, params):
+        if user_id not in user_wallets:
+            raise ApiError(404, "unknown user")
+        cursor = params.get("cursor")
+        if cursor and not cursor.rpartition("~")[2].isdigit():
+            raise ApiError(400, "invalid cursor")
+        fills, next_cursor = await asyncio.to_thread(fetch_fills_page, user_id, cursor, self.limit(params))
+        return {"fills": fills, "next_cursor": next_cursor}
+
+
+class ApiServer(uvicorn.Server):
+    """uvicorn running as a task on the bot's event loop; the lifecycle manager owns shutdown and signals."""
+    @contextlib.contextmanager
+    def capture_signals(self):
+        yield
+
+    def install_signal_handlers(self):  # uvicorn < 0.29
+        pass
+
+    def start(self):
+        self.task = lifecycle.spawn(self.serve())
+
+    async def stop(self, timeout=5.0):
+        self.should_exit = True
+        if getattr(self, "task", None):
+            await asyncio.wait({self.task}, timeout=timeout)
+
+
+read_api = ReadApi()
+api_server = ApiServer(uvicorn.Config(read_api, host="0.0.0.0", port=API_PORT, lifespan="off",
+                                      access_log=False, log_level="warning"))
+
+
+async def on_startup(application: Application):
+    """Prepare storage, restore checkpointed state and launch background monitors."""
+    setup_database()
+    load_wallets()
+    wallet_pool.start({wallet.address for wallet in user_wallets.values()})
+    lifecycle.restore_checkpoint()
+    candle_store.load(TOKEN_MINT)
+    stop_orders.load()
+    signal_orders.load()
+    price_alerts.load()
+    tick_resolution = max(r for r in CANDLE_RESOLUTIONS if r <= max(PRICE_POLL_INTERVAL, CANDLE_RESOLUTIONS[0]))
+    signal_engine.warm(TOKEN_MINT, candle_store.candles(TOKEN_MINT, tick_resolution, 2 * signal_engine.get(TOKEN_MINT).window)[:, 4])
+    portfolio.load()
+    resume_admin_jobs()
+    dca_scheduler.load()
+    deposit_scanner.load()
+    lifecycle.spawn(messenger.run(application.bot))
+    event_bus.start(lifecycle.spawn)
+    if ADMIN_API_TOKEN:
+        api_server.start()
+    lifecycle.spawn(lifecycle.confirmation_monitor())
+    lifecycle.spawn(price_monitor())
+    lifecycle.spawn(dca_scheduler.run())
+    lifecycle.spawn(state_journal.run())
+    lifecycle.spawn(token_accounts.run())
+    lifecycle.spawn(deposit_scanner.run())
+    lifecycle.spawn(reconcile_pending_payouts())
+    if DIAGNOSTICS_ENABLED:
+        lifecycle.spawn(diagnostics.run())
+
+
+def build_application() -> Application:
+    """Create the Telegram application with every handler registered."""
     bot = Application.builder().token(TOKEN).build()
 
     # ✅ Register command handlers
@@ -1205,14 +5620,60 @@ async def run_telegram_bot():
     bot.add_handler(CommandHandler("set_buy_target", set_buy_target))
     bot.add_handler(CommandHandler("cancel_sell", cancel_sell))
     bot.add_handler(CommandHandler("transaction_history", transaction_history))
+    bot.add_handler(CommandHandler("export", export_history))
+    bot.add_handler(CommandHandler("dca", dca_command))
+    bot.add_handler(CommandHandler("dca_list", dca_list))
+    bot.add_handler(CommandHandler("dca_cancel", dca_cancel))
     bot.add_handler(CommandHandler("withdraw_sol", withdraw_phantom))
     bot.add_handler(CommandHandler("active_trades", active_trades))
     bot.add_handler(CommandHandler("help", help_command))
     bot.add_handler(CommandHandler("view_solscan", view_solscan))
+    bot.add_handler(CommandHandler("stop_loss", set_stop_loss))
+    bot.add_handler(CommandHandler("trailing_stop", set_trailing_stop))
+    bot.add_handler(CommandHandler("cancel_stop", cancel_stop))
+    bot.add_handler(CommandHandler("signal", set_signal))
+    bot.add_handler(CommandHandler("signals", list_signals))
+    bot.add_handler(CommandHandler("signal_cancel", cancel_signal))
+    bot.add_handler(CommandHandler("alert", set_price_alert))
+    bot.add_handler(CommandHandler("alerts", list_price_alerts))
+    bot.add_handler(CommandHandler("alert_cancel", cancel_price_alert))
+    bot.add_handler(CommandHandler("portfolio", portfolio_command))
+    bot.add_handler(CommandHandler("portfolio_check", portfolio_check))
+    bot.add_handler(CommandHandler(["admin_audit", "admin_sweep", "admin_topup"], admin_job_command))
+    bot.add_handler(CommandHandler("admin_resume", admin_resume))
+    bot.add_handler(CommandHandler("price", price_command))
+    bot.add_handler(CommandHandler("chart", chart_command))
 
     # ✅ Register button click handlers
     bot.add_handler(CallbackQueryHandler(handle_button_click))
 
-    logging.info("🤖 Telegram Bot is Running and Polling for Updates...")
+    if DIAGNOSTICS_ENABLED:  # ✅ Each handler becomes the root span of its Telegram → swap → RPC chain
+        for handlers in bot.handlers.values():
+            for handler in handlers:
+                if hasattr(handler, "callback"):
+                    handler.callback = traced(handler.callback)
+
+    return bot
+
+
+async def run_telegram_bot():
+    """Starts the bot using polling and runs until SIGTERM/SIGINT, then shuts down gracefully."""
+    lifecycle.install_signal_handlers()
+    bot = build_application()
+
+    async with bot:
+        await on_startup(bot)
+        await bot.start()
+        await bot.updater.start_polling()
+        logging.info("🤖 Telegram Bot is Running and Polling for Updates...")
+
+        await lifecycle.stop_event.wait()
+
+        await bot.updater.stop()  # Stop taking updates; Telegram holds them for the next process
+        await lifecycle.shutdown()
+        await bot.stop()
+
 
-    await bot.run_polling()  # ✅ Ensure polling is started
\ No newline at end of file
+if __name__ == "__main__":
+    threading.Thread(target=run_flask, daemon=True).start()
+    asyncio.run(run_telegram_bot())
\ No newline at end of file
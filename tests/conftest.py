@@ -0,0 +1,78 @@
+"""Test setup: bot.py reads its settings from the environment and keeps its files in the working
+directory, so both are pointed somewhere harmless before the module is imported."""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from cryptography.fernet import Fernet
+from solders.keypair import Keypair
+
+os.environ.update({
+    "TELEGRAM_BOT_TOKEN": "123456:test",
+    "SOLANA_RPC_URL": "http://127.0.0.1:1",
+    "BOT_WALLET_PRIVATE_KEY": str(Keypair()),
+    "ENCRYPTION_KEY": Fernet.generate_key().decode(),
+    "JUPITER_API": "http://127.0.0.1:1/quote",
+    "TOKEN_MINT": "So11111111111111111111111111111111111111112",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="bot-tests-"))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run the test in its own empty directory (bot.py uses relative paths for its files)."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+class RpcStub(BaseHTTPRequestHandler):
+    """Local JSON-RPC node answering every method with `result` after `delay` seconds, or HTTP 503 while `failing`."""
+    result = 0
+    delay = 0.0
+    failing = False
+    hits = 0
+
+    def do_POST(self):
+        type(self).hits += 1
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.delay)
+        if self.failing:
+            self.send_response(503)
+            self.end_headers()
+            return
+        body = json.dumps({"jsonrpc": "2.0", "result": self.result, "id": request["id"]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def rpc_stubs():
+    """Factory for stub RPC nodes: rpc_stubs(delay, ...) -> [(url, handler class)], shut down after the test."""
+    servers = []
+
+    def start(*delays):
+        nodes = []
+        for delay in delays:
+            handler = type("Node", (RpcStub,), {"delay": delay, "result": 1000 + len(servers)})
+            server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+            threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+            servers.append(server)
+            nodes.append((f"http://127.0.0.1:{server.server_address[1]}", handler))
+        return nodes
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
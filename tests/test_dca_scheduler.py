@@ -0,0 +1,70 @@
+import sqlite3
+import time
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def scheduler(workdir, monkeypatch):
+    monkeypatch.setattr(bot, "DCA_JITTER_FRACTION", 0.0)
+    bot.setup_database()
+    return bot.DcaScheduler()
+
+
+def stored(order_id):
+    conn = sqlite3.connect("trading_bot.db")
+    row = conn.execute("SELECT next_run, runs, status FROM dca_orders WHERE id = ?", (order_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def test_advance_persists_the_next_slot_anchored_to_the_schedule(scheduler):
+    order = scheduler.create("u1", 0.1, 3600)
+    first = order["next_run"]
+
+    scheduler._advance([order])
+    assert stored(order["id"]) == (first + 3600, 1, "active")
+    assert (first + 3600, order["id"]) in scheduler.heap
+
+    # A restart resumes from the persisted slot rather than repeating the run
+    restarted = bot.DcaScheduler()
+    restarted.load()
+    assert restarted.orders[order["id"]]["next_run"] == first + 3600
+    assert restarted.orders[order["id"]]["runs"] == 1
+
+
+def test_advance_finishes_orders_at_max_runs(scheduler):
+    order = scheduler.create("u1", 0.1, 3600, max_runs=1)
+
+    scheduler._advance([order])
+    assert stored(order["id"])[1:] == (1, "done")
+    assert order["id"] not in scheduler.orders
+
+    restarted = bot.DcaScheduler()
+    restarted.load()
+    assert not restarted.orders
+
+
+def test_advance_after_a_stall_does_not_schedule_catch_up_runs(scheduler):
+    order = scheduler.create("u1", 0.1, 3600)
+    order["next_run"] -= 10 * 3600
+
+    before = time.time()
+    scheduler._advance([order])
+    assert order["next_run"] >= before
+    assert stored(order["id"])[0] == order["next_run"]
+
+
+def test_failed_write_leaves_memory_untouched(scheduler):
+    order = scheduler.create("u1", 0.1, 3600)
+    snapshot, heap = dict(order), list(scheduler.heap)
+    conn = sqlite3.connect("trading_bot.db")
+    conn.execute("DROP TABLE dca_orders")
+    conn.close()
+
+    with pytest.raises(sqlite3.Error):
+        scheduler._advance([order])
+    assert order == snapshot
+    assert scheduler.heap == heap
@@ -0,0 +1,119 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from solders.keypair import Keypair
+
+import bot
+
+ADDRESS = str(Keypair().pubkey())
+
+
+class FakeChain:
+    """getSignaturesForAddress over one wallet's history (newest first), with before/until/limit paging."""
+    def __init__(self):
+        self.history = []  # Oldest first
+        self.calls = 0
+
+    def add(self, count):
+        signer = Keypair()
+        for _ in range(count):
+            signature = signer.sign_message(len(self.history).to_bytes(4, "big"))
+            self.history.append(SimpleNamespace(signature=signature, err=None))
+
+    async def get_signatures_for_address(self, owner, before=None, until=None, limit=1000):
+        self.calls += 1
+        statuses = self.history[::-1]
+        if before is not None:
+            statuses = statuses[[s.signature for s in statuses].index(before) + 1:]
+        if until is not None:
+            signatures = [s.signature for s in statuses]
+            statuses = statuses[:signatures.index(until)] if until in signatures else statuses
+        return SimpleNamespace(value=statuses[:limit])
+
+    async def get_transaction(self, signature, **kwargs):
+        return SimpleNamespace(value=None)  # Not a deposit: only cursor movement is under test
+
+
+@pytest.fixture
+def chain(monkeypatch):
+    chain = FakeChain()
+    monkeypatch.setattr(bot, "solana_client", chain)
+    monkeypatch.setattr(bot, "DEPOSIT_PAGE_LIMIT", 4)
+    monkeypatch.setattr(bot, "DEPOSIT_MAX_PAGES", 2)
+    return chain
+
+
+def scan_until_caught_up(scanner, chain, rounds=50):
+    """Run scan rounds for the wallet until its cursor reaches the newest signature; returns what each round processed."""
+    processed = []
+    original = scanner._new_signatures
+
+    async def recording(address):
+        signatures = await original(address)
+        processed.append([str(s.signature) for s in signatures])
+        return signatures
+
+    scanner._new_signatures = recording
+
+    async def run():
+        semaphore = asyncio.Semaphore(1)
+        for _ in range(rounds):
+            await scanner._scan_wallet("u1", ADDRESS, semaphore)
+            if scanner.cursors[ADDRESS] == str(chain.history[-1].signature) and ADDRESS not in scanner.backfill:
+                return
+        raise AssertionError("Scanner never caught up")
+
+    asyncio.run(run())
+    return processed
+
+
+def signatures(chain, start, stop=None):
+    return [str(s.signature) for s in chain.history[start:stop]]
+
+
+@pytest.mark.parametrize("backlog", [1, 3, 8, 16, 25])
+def test_backlog_beyond_the_page_budget_is_processed_once_and_in_order(chain, backlog):
+    chain.add(1)
+    scanner = bot.DepositScanner()
+    scanner.cursors[ADDRESS] = str(chain.history[0].signature)
+    chain.add(backlog)
+
+    processed = scan_until_caught_up(scanner, chain)
+    flat = [signature for batch in processed for signature in batch]
+    assert flat == signatures(chain, 1)  # Every new signature exactly once, oldest first, none skipped
+
+
+def test_cursor_stays_put_while_the_backlog_is_paged_back(chain):
+    chain.add(1)
+    scanner = bot.DepositScanner()
+    cursor = scanner.cursors[ADDRESS] = str(chain.history[0].signature)
+    chain.add(20)
+
+    async def one_round():
+        return await scanner._scan_wallet("u1", ADDRESS, asyncio.Semaphore(1))
+
+    assert asyncio.run(one_round()) is False  # 8 of 20 fetched: budget spent before reaching the cursor
+    assert scanner.cursors[ADDRESS] == cursor
+    assert str(scanner.backfill[ADDRESS].signature) == str(chain.history[13].signature)
+    assert chain.calls == bot.DEPOSIT_MAX_PAGES
+
+
+def test_first_scan_only_sets_the_cursor(chain):
+    chain.add(5)
+    scanner = bot.DepositScanner()
+    assert scan_until_caught_up(scanner, chain) == [[str(chain.history[-1].signature)]]
+
+
+def test_empty_wallet_gets_a_cursor_that_still_scans_its_first_transaction(chain):
+    scanner = bot.DepositScanner()
+
+    async def one_round():
+        return await scanner._scan_wallet("u1", ADDRESS, asyncio.Semaphore(1))
+
+    asyncio.run(one_round())
+    assert scanner.cursors[ADDRESS] == ""
+
+    chain.add(3)
+    processed = scan_until_caught_up(scanner, chain)
+    assert [signature for batch in processed for signature in batch] == signatures(chain, 0)
@@ -0,0 +1,26 @@
+import asyncio
+
+import pytest
+from solders.keypair import Keypair
+
+import bot
+
+
+@pytest.fixture
+def wallet(workdir, monkeypatch):
+    bot.setup_database()
+    monkeypatch.setattr(bot.portfolio, "positions", {})
+    monkeypatch.setitem(bot.user_wallets, "u1", bot.UserWallet(str(Keypair().pubkey()), "key"))
+
+
+@pytest.mark.parametrize("view", ["user_view", "orders_view", "fills_view"])
+def test_per_user_views_reject_unknown_users(wallet, view):
+    with pytest.raises(bot.ApiError) as raised:
+        asyncio.run(getattr(bot.read_api, view)("nobody", {}))
+    assert raised.value.status == 404
+
+
+def test_fills_view_pages_a_known_users_fills(wallet):
+    bot.log_fill("u1", "buy", 10.0, 1.0, "tx1")
+    page = asyncio.run(bot.read_api.fills_view("u1", {}))
+    assert [fill["transaction_id"] for fill in page["fills"]] == ["tx1"]
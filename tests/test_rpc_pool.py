@@ -0,0 +1,188 @@
+import asyncio
+import functools
+
+import pytest
+
+import bot
+
+
+def make_pool(nodes, **kwargs):
+    kwargs.setdefault("explore_rate", 0.0)
+    pool = bot.RpcPool([url for url, _ in nodes], **kwargs)
+    for endpoint in pool.endpoints:
+        endpoint.breaker.failure_threshold = 2
+        endpoint.breaker.reset_timeout = 0.2
+    return pool
+
+
+async def slot(pool):
+    return (await pool.get_slot()).value
+
+
+def test_reads_settle_on_the_fastest_node(rpc_stubs):
+    slow, medium, fast = nodes = rpc_stubs(0.05, 0.02, 0.0)
+    pool = make_pool(nodes)
+
+    async def run():
+        try:
+            return [await slot(pool) for _ in range(6)]
+        finally:
+            await pool.close()
+
+    answers = asyncio.run(run())
+    # Unmeasured nodes are tried first, so each is measured once before the ranking settles
+    assert answers[:3] == [slow[1].result, medium[1].result, fast[1].result]
+    assert answers[3:] == [fast[1].result] * 3
+    assert pool.ranked()[0].url == fast[0]
+
+
+def test_read_fails_over_to_the_next_node(rpc_stubs):
+    fast, slow = nodes = rpc_stubs(0.0, 0.02)
+    pool = make_pool(nodes)
+
+    async def run():
+        try:
+            for _ in range(2):  # Measure both nodes
+                await slot(pool)
+            fast[1].failing = True
+            return await slot(pool)
+        finally:
+            await pool.close()
+
+    assert asyncio.run(run()) == slow[1].result
+    assert pool.endpoints[0].error_rate > 0
+
+
+def test_failing_node_is_demoted_and_skipped_once_its_breaker_opens(rpc_stubs):
+    fast, slow = nodes = rpc_stubs(0.0, 0.02)
+    fast[1].failing = True
+    pool = make_pool(nodes)
+
+    async def run():
+        try:
+            answers = [await slot(pool) for _ in range(3)]
+            hits = fast[1].hits
+            answers += [await slot(pool) for _ in range(3)]
+            return answers, hits
+        finally:
+            await pool.close()
+
+    answers, hits = asyncio.run(run())
+    assert answers == [slow[1].result] * 6
+    assert pool.endpoints[0].breaker.state == "open"
+    assert fast[1].hits == hits == 2  # failure_threshold attempts, then no more traffic
+    assert [e.url for e in pool.ranked()] == [slow[0], fast[0]]
+
+
+def test_recovered_node_wins_its_place_back(rpc_stubs):
+    fast, slow = nodes = rpc_stubs(0.0, 0.03)
+    fast[1].failing = True
+    pool = make_pool(nodes)
+
+    async def run():
+        try:
+            for _ in range(3):
+                await slot(pool)
+            assert pool.endpoints[0].breaker.state == "open"
+
+            fast[1].failing = False
+            await asyncio.sleep(0.25)  # Past reset_timeout: the breaker admits one probe
+            pool.explore_rate = 1.0  # Two nodes: exploration always tries the lower-ranked one first
+            answer = await slot(pool)
+            pool.explore_rate = 0.0
+            for _ in range(5):
+                await slot(pool)
+            return answer
+        finally:
+            await pool.close()
+
+    assert asyncio.run(run()) == fast[1].result
+    assert pool.endpoints[0].breaker.state == "closed"
+    assert pool.ranked()[0].url == fast[0]
+
+
+def test_read_raises_when_every_node_fails(rpc_stubs):
+    nodes = rpc_stubs(0.0, 0.0)
+    for _, handler in nodes:
+        handler.failing = True
+    pool = make_pool(nodes)
+
+    async def run():
+        try:
+            with pytest.raises(Exception) as first:
+                await slot(pool)
+            for _ in range(2):
+                with pytest.raises(Exception):
+                    await slot(pool)
+            with pytest.raises(bot.CircuitOpenError):  # Every breaker is open now
+                await slot(pool)
+            return first.value
+        finally:
+            await pool.close()
+
+    assert not isinstance(asyncio.run(run()), bot.CircuitOpenError)
+
+
+def test_broadcast_reaches_the_best_fanout_nodes_and_returns_the_first_success(rpc_stubs):
+    a, b, c = nodes = rpc_stubs(0.03, 0.0, 0.01)
+    pool = make_pool(nodes, fanout=2)
+
+    async def run():
+        try:
+            for _ in range(3):
+                await slot(pool)  # Rank the nodes: b, c, a
+            before = [handler.hits for _, handler in nodes]
+            answer = (await pool.broadcast("get_slot")).value
+            await asyncio.sleep(0.05)  # Let the slower send finish in the background
+            return answer, [handler.hits - hit for (_, handler), hit in zip(nodes, before)]
+        finally:
+            await pool.close()
+
+    answer, sent = asyncio.run(run())
+    assert answer == b[1].result
+    assert sent == [0, 1, 1]
+
+
+def test_broadcast_survives_a_failing_target(rpc_stubs):
+    a, b = nodes = rpc_stubs(0.0, 0.02)
+    a[1].failing = True
+    pool = make_pool(nodes, fanout=2)
+
+    async def run():
+        try:
+            return (await pool.broadcast("get_slot")).value
+        finally:
+            await pool.close()
+
+    assert asyncio.run(run()) == b[1].result
+    assert a[1].hits == b[1].hits == 1
+
+
+def test_broadcast_raises_when_every_target_fails_or_none_is_healthy(rpc_stubs):
+    nodes = rpc_stubs(0.0, 0.0)
+    for _, handler in nodes:
+        handler.failing = True
+    pool = make_pool(nodes, fanout=2)
+
+    async def run():
+        try:
+            for _ in range(2):
+                with pytest.raises(Exception) as raised:
+                    await pool.broadcast("get_slot")
+                assert not isinstance(raised.value, bot.CircuitOpenError)
+            with pytest.raises(bot.CircuitOpenError):
+                await pool.broadcast("get_slot")
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_submissions_are_broadcast_and_reads_are_routed(rpc_stubs):
+    pool = make_pool(rpc_stubs(0.0))
+
+    assert isinstance(pool.send_transaction, functools.partial) and pool.send_transaction.func == pool.broadcast
+    assert isinstance(pool.get_balance, functools.partial) and pool.get_balance.func == pool.call
+    with pytest.raises(AttributeError):
+        pool.not_an_rpc_method
+    asyncio.run(pool.close())
@@ -0,0 +1,127 @@
+import os
+import shutil
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def journal(workdir):
+    return new_journal()
+
+
+def new_journal():
+    """A fresh process's view of the journal files in the working directory."""
+    journal = bot.StateJournal("state.journal", "state.snapshot.json")
+    journal.orders = journal.table("orders")
+    journal.meta = journal.table("meta")
+    return journal
+
+
+def recovered():
+    journal = new_journal()
+    replayed = journal.recover()
+    return journal, replayed
+
+
+def test_replay_restores_every_mutation(journal):
+    journal.orders["a"] = {"price": 1.5}
+    journal.orders["b"] = {"price": 2.0}
+    journal.orders.pop("a")
+    journal.meta.update(x=1, y=2)
+    journal.meta.clear()
+    journal.meta["z"] = 3
+    journal.flush()
+
+    restored, replayed = recovered()
+    assert dict(restored.orders) == {"b": {"price": 2.0}}
+    assert dict(restored.meta) == {"z": 3}
+    assert replayed == 7
+
+
+def test_torn_tail_is_ignored_and_the_journal_stays_appendable(journal):
+    journal.orders["a"] = 1
+    journal.orders["b"] = 2
+    journal.flush()
+    with open("state.journal", "a", encoding="utf-8") as f:
+        f.write('{"s": 3, "t": "orders", "o": "set", "k": "c", ')  # Crash mid-write
+
+    restored, replayed = recovered()
+    assert dict(restored.orders) == {"a": 1, "b": 2}
+    assert replayed == 2
+
+    # Recovery compacts, so records written now do not follow the torn line
+    restored.orders["c"] = 3
+    restored.flush()
+    again, _ = recovered()
+    assert dict(again.orders) == {"a": 1, "b": 2, "c": 3}
+
+
+def test_compaction_bounds_replay_to_the_tail(journal):
+    for i in range(10):
+        journal.orders[str(i)] = i
+    journal.snapshot()
+    journal.orders["10"] = 10
+    del journal.orders["0"]
+    journal.flush()
+
+    restored, replayed = recovered()
+    assert replayed == 2
+    assert dict(restored.orders) == {str(i): i for i in range(1, 11)}
+    assert restored.seq == 12
+
+
+def test_crash_between_rotation_and_snapshot_keeps_both_tails(journal):
+    journal.orders["a"] = 1
+    journal.snapshot()
+    journal.orders["b"] = 2
+    journal._rotate()  # Compaction started: the tail moved to .1, snapshot never written
+    journal.orders["c"] = 3
+    journal.flush()
+    assert os.path.exists("state.journal.1")
+
+    restored, replayed = recovered()
+    assert dict(restored.orders) == {"a": 1, "b": 2, "c": 3}
+    assert replayed == 2
+    assert not os.path.exists("state.journal.1")
+
+
+def test_repeated_interrupted_compactions_append_to_the_rotated_tail(journal):
+    journal.orders["a"] = 1
+    journal._rotate()
+    journal.orders["b"] = 2
+    journal._rotate()  # .1 already exists: the new tail is appended to it
+    journal.orders["c"] = 3
+    journal.flush()
+
+    restored, replayed = recovered()
+    assert dict(restored.orders) == {"a": 1, "b": 2, "c": 3}
+    assert replayed == 3
+
+
+def test_records_already_in_the_snapshot_are_not_replayed_twice(journal):
+    journal.orders["a"] = 1
+    journal.meta["n"] = 1
+    state = journal._rotate()
+    shutil.copy("state.journal.1", "rotated.bak")
+    journal._write_snapshot(state)
+    shutil.copy("rotated.bak", "state.journal.1")  # Crash after the snapshot, before .1 was removed
+    journal.meta["n"] = 2
+    journal.flush()
+
+    restored, replayed = recovered()
+    assert replayed == 1
+    assert dict(restored.orders) == {"a": 1}
+    assert dict(restored.meta) == {"n": 2}
+
+
+def test_unknown_tables_are_skipped_but_advance_the_sequence(journal):
+    journal.table("retired")["x"] = 1
+    journal.orders["a"] = 1
+    journal.flush()
+
+    restored, replayed = recovered()
+    assert replayed == 2
+    assert restored.seq == 2
+    assert dict(restored.orders) == {"a": 1}
@@ -0,0 +1,129 @@
+import asyncio
+import sqlite3
+
+import pytest
+from solders.keypair import Keypair
+
+import bot
+
+SWAP_TXID = str(Keypair().sign_message(b"swap"))
+
+
+def transaction_id(label):
+    return str(Keypair().sign_message(label.encode()))
+
+
+@pytest.fixture
+def pooled(workdir, monkeypatch):
+    """Two wallets in a pooled buy, with the chain replaced by scripted outcomes."""
+    bot.setup_database()
+    for user_id in ("u1", "u2"):
+        keypair = Keypair()
+        monkeypatch.setitem(bot.user_wallets, user_id, bot.UserWallet(str(keypair.pubkey()), bot.cipher.encrypt(str(keypair).encode()).decode()))
+    monkeypatch.setattr(bot.portfolio, "positions", {})
+
+    script = {"submits": [], "swap": None, "output": 2000, "quotes": 0}
+
+    async def submit_instructions(instructions, signers, confirm=True):
+        outcome = script["submits"].pop(0) if script["submits"] else transaction_id("ok")
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def request_swap_quote(is_buy, amount, wallet):
+        script["quotes"] += 1
+        return {"outAmount": "1000", "otherAmountThreshold": "900"}
+
+    async def send_swap_transaction(quote, keypair, preflight_key=None):
+        return {"status": "success", "txid": SWAP_TXID}
+
+    async def confirm_outcome(txid, sent_at):
+        if script["swap"]:
+            raise script["swap"]
+
+    async def swap_output(txid, is_buy):
+        return script["output"]
+
+    monkeypatch.setattr(bot, "submit_instructions", submit_instructions)
+    monkeypatch.setattr(bot, "request_swap_quote", request_swap_quote)
+    monkeypatch.setattr(bot, "send_swap_transaction", send_swap_transaction)
+    monkeypatch.setattr(bot, "confirm_outcome", confirm_outcome)
+    monkeypatch.setattr(bot.lifecycle, "watch", lambda *args: None)
+
+    aggregator = bot.SwapAggregator(0.1)
+    monkeypatch.setattr(aggregator, "_swap_output", swap_output)
+
+    def run():
+        return asyncio.run(aggregator._execute_pooled(True, [("u1", 0.1, None), ("u2", 0.3, None)]))
+
+    script["run"] = run
+    return script
+
+
+def rows(query):
+    conn = sqlite3.connect("trading_bot.db")
+    result = conn.execute(query).fetchall()
+    conn.close()
+    return result
+
+
+def test_measured_output_is_split_pro_rata(pooled):
+    results = pooled["run"]()
+
+    assert [r["status"] for r in results] == ["success", "success"]
+    assert [r["out_amount"] for r in results] == [500 / 10**bot.TOKEN_DECIMALS, 1500 / 10**bot.TOKEN_DECIMALS]
+    assert rows("SELECT user_id, transaction_id FROM fills ORDER BY user_id") == [("u1", SWAP_TXID), ("u2", SWAP_TXID)]
+    assert rows("SELECT * FROM pending_payouts") == []
+
+
+def test_unmeasurable_output_pays_the_quoted_minimum(pooled):
+    pooled["output"] = None
+    results = pooled["run"]()
+    assert [r["out_amount"] for r in results] == [225 / 10**bot.TOKEN_DECIMALS, 675 / 10**bot.TOKEN_DECIMALS]
+
+
+def test_failed_payout_is_recorded_as_owed(pooled):
+    pooled["submits"] = [transaction_id("collect"), RuntimeError("payout rejected")]
+    results = pooled["run"]()
+
+    assert [r["status"] for r in results] == ["error", "error"]
+    assert rows("SELECT user_id, asset, units, status FROM pending_payouts ORDER BY user_id") == [
+        ("u1", "token", 500, "pending"), ("u2", "token", 1500, "pending")
+    ]
+    assert len(rows("SELECT * FROM fills")) == 2  # The swap itself filled
+
+
+def test_failed_swap_refunds_inputs_without_fills(pooled):
+    pooled["swap"] = bot.TransactionFailedError("slippage exceeded")
+    results = pooled["run"]()
+
+    assert [r["message"] for r in results] == ["Swap failed, funds returned"] * 2
+    assert rows("SELECT * FROM fills") == []
+    assert rows("SELECT * FROM pending_payouts") == []
+
+
+def test_unknown_swap_outcome_is_neither_refunded_nor_paid(pooled):
+    pooled["swap"] = bot.TxOutcomeUnknown(SWAP_TXID)
+    pooled["submits"] = [transaction_id("collect"), AssertionError("nothing may be sent after an unknown swap")]
+    results = pooled["run"]()
+
+    assert all(r["status"] == "error" for r in results)
+    assert rows("SELECT * FROM fills") == []
+    assert rows("SELECT user_id, asset, units, status, txid, owed_if FROM pending_payouts ORDER BY id") == [
+        ("u1", "sol", 100_000_000, "unconfirmed", SWAP_TXID, "dropped"),
+        ("u1", "token", 225, "unconfirmed", SWAP_TXID, "landed"),
+        ("u2", "sol", 300_000_000, "unconfirmed", SWAP_TXID, "dropped"),
+        ("u2", "token", 675, "unconfirmed", SWAP_TXID, "landed"),
+    ]
+
+
+def test_unknown_collection_outcome_skips_the_swap(pooled):
+    collect_txid = transaction_id("collect")
+    pooled["submits"] = [bot.TxOutcomeUnknown(collect_txid)]
+    results = pooled["run"]()
+
+    assert all(r["status"] == "error" for r in results)
+    assert pooled["quotes"] == 0
+    assert rows("SELECT user_id, asset, status, owed_if FROM pending_payouts ORDER BY id") == [
+        ("u1", "sol", "unconfirmed", "landed"), ("u2", "sol", "unconfirmed", "landed")
+    ]